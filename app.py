@@ -18,6 +18,8 @@ import time
 from datetime import datetime
 from pathlib import Path
 
+from zip_demographics import ensure_zip_demographics
+
 APP_DIR = Path(__file__).parent
 DATA_DIR = APP_DIR / "data"
 DATA_DIR.mkdir(exist_ok=True)
@@ -342,18 +344,7 @@ def init_db():
             /* Location */
             latitude REAL, longitude REAL,
             dedup_key TEXT, first_seen TEXT, last_refreshed TEXT,
-            /* Census ACS demographics (real data) */
-            zip_population INTEGER,
-            zip_median_income INTEGER,
-            zip_pct_65_plus REAL,
-            zip_pop_growth_pct REAL,
-            zip_median_age REAL,
-            zip_pct_uninsured REAL,
-            zip_pct_disabled REAL,
-            zip_pct_poverty REAL,
-            zip_pct_health_insurance REAL,
-            zip_total_households INTEGER,
-            zip_pct_owner_occupied REAL,
+            /* Census ACS demographics live in zip_demographics */
             /* HRSA designations */
             hpsa_designated INTEGER DEFAULT 0,
             hpsa_score INTEGER,
@@ -403,13 +394,6 @@ def init_db():
         "medicare_opioid_claims": "INTEGER",
         "medicare_antibiotic_claims": "INTEGER",
         "medicare_avg_cost_per_claim": "REAL",
-        "zip_median_age": "REAL",
-        "zip_pct_uninsured": "REAL",
-        "zip_pct_disabled": "REAL",
-        "zip_pct_poverty": "REAL",
-        "zip_pct_health_insurance": "REAL",
-        "zip_total_households": "INTEGER",
-        "zip_pct_owner_occupied": "REAL",
         "hpsa_designated": "INTEGER DEFAULT 0",
         "hpsa_score": "INTEGER",
         "medically_underserved": "INTEGER DEFAULT 0",
@@ -424,6 +408,8 @@ def init_db():
             except Exception:
                 pass
     conn.commit()
+    # Census data per ZIP, read through the pharmacy_details view
+    ensure_zip_demographics(conn)
     conn.close()
 
 try:
@@ -521,7 +507,7 @@ def search_pharmacies(search="", state="", city="", zip_code="", independent_onl
     order = order_map.get(sort_by, "acquisition_score DESC")
     total = conn.execute(f"SELECT COUNT(*) FROM pharmacies {where}", params).fetchone()[0]
     rows = conn.execute(
-        f"SELECT * FROM pharmacies {where} ORDER BY {order} NULLS LAST LIMIT ? OFFSET ?",
+        f"SELECT * FROM pharmacy_details {where} ORDER BY {order} NULLS LAST LIMIT ? OFFSET ?",
         params + [per_page, offset],
     ).fetchall()
     conn.close()
@@ -529,7 +515,7 @@ def search_pharmacies(search="", state="", city="", zip_code="", independent_onl
 
 def get_pharmacy_detail(pharmacy_id):
     conn = get_db()
-    row = conn.execute("SELECT * FROM pharmacies WHERE id = ?", (pharmacy_id,)).fetchone()
+    row = conn.execute("SELECT * FROM pharmacy_details WHERE id = ?", (pharmacy_id,)).fetchone()
     conn.close()
     return dict(row) if row else None
 
@@ -686,7 +672,7 @@ if page == "Dashboard":
                    ROUND(acquisition_score, 1) as score,
                    deal_status,
                    ROUND(nearest_walgreens_miles, 1) as walgreens_dist
-            FROM pharmacies WHERE acquisition_score IS NOT NULL
+            FROM pharmacy_details WHERE acquisition_score IS NOT NULL
             ORDER BY acquisition_score DESC LIMIT 100
         """).fetchall()
         conn.close()
@@ -785,7 +771,7 @@ elif page == "Top Targets":
 
     total = conn.execute(f"SELECT COUNT(*) FROM pharmacies {where}", params).fetchone()[0]
     rows = conn.execute(
-        f"SELECT * FROM pharmacies {where} ORDER BY {order} NULLS LAST LIMIT ? OFFSET ?",
+        f"SELECT * FROM pharmacy_details {where} ORDER BY {order} NULLS LAST LIMIT ? OFFSET ?",
         params + [per_page, offset],
     ).fetchall()
     df = pd.DataFrame([dict(r) for r in rows])
@@ -1235,7 +1221,7 @@ elif page == "Query Tools":
                    SUM(medicare_claims_count) as total_claims,
                    ROUND(AVG(acquisition_score), 1) as avg_score,
                    AVG(zip_pct_65_plus) as avg_65_plus
-            FROM pharmacies
+            FROM pharmacy_details
             WHERE is_independent = 1
               AND years_in_operation >= 20
               AND city IS NOT NULL
@@ -1280,11 +1266,11 @@ elif page == "Query Tools":
                 d.zip,
                 d.deact_count,
                 p.city, p.state,
-                p.zip_population,
-                p.zip_pct_65_plus,
-                p.zip_pop_growth_pct,
+                z.population,
+                z.pct_65_plus,
+                z.pop_growth_pct,
                 p.zip_pharmacy_count,
-                p.zip_pct_uninsured,
+                z.pct_uninsured,
                 active.active_independents
             FROM (
                 SELECT zip, COUNT(*) as deact_count
@@ -1294,9 +1280,8 @@ elif page == "Query Tools":
                   AND zip IS NOT NULL
                 GROUP BY zip
             ) d
-            JOIN pharmacies p ON p.zip = d.zip AND p.id = (
-                SELECT id FROM pharmacies WHERE zip = d.zip AND zip_population IS NOT NULL LIMIT 1
-            )
+            JOIN zip_demographics z ON z.zip = substr(d.zip, 1, 5) AND z.population IS NOT NULL
+            JOIN pharmacies p ON p.id = (SELECT id FROM pharmacies WHERE zip = d.zip LIMIT 1)
             LEFT JOIN (
                 SELECT zip, COUNT(*) as active_independents
                 FROM pharmacies
@@ -1304,7 +1289,7 @@ elif page == "Query Tools":
                   AND npi_deactivation_date IS NULL
                 GROUP BY zip
             ) active ON active.zip = d.zip
-            WHERE p.zip_pct_65_plus >= 15 OR p.zip_pop_growth_pct > 0
+            WHERE z.pct_65_plus >= 15 OR z.pop_growth_pct > 0
             ORDER BY d.deact_count DESC
             LIMIT 100
         """).fetchall()
@@ -1354,7 +1339,7 @@ elif page == "Query Tools":
                    zip_pct_65_plus,
                    zip_pharmacy_count,
                    hpsa_score
-            FROM pharmacies
+            FROM pharmacy_details
             WHERE is_independent = 1
               AND hpsa_designated = 1
               {state_cond}
@@ -1468,7 +1453,7 @@ elif page == "Query Tools":
                    SUM(CASE WHEN years_in_operation >= 20 THEN 1 ELSE 0 END) as long_tenured,
                    MAX(zip_pct_65_plus) as max_65_plus,
                    SUM(CASE WHEN hpsa_designated = 1 THEN 1 ELSE 0 END) as hpsa_count
-            FROM pharmacies
+            FROM pharmacy_details
             WHERE is_independent = 1
               AND city IS NOT NULL
               {state_cond}
@@ -1611,7 +1596,7 @@ elif page == "Tuck-in Finder":
         score_params = [min_score_tuckin] if min_score_tuckin > 0 else []
 
         nearby = conn.execute(f"""
-            SELECT * FROM pharmacies
+            SELECT * FROM pharmacy_details
             WHERE is_independent = 1 AND {zip_condition}
               {score_cond}
             ORDER BY acquisition_score DESC NULLS LAST
@@ -1735,7 +1720,7 @@ elif page == "Directory":
 
     total = conn.execute(f"SELECT COUNT(*) FROM pharmacies {where}", params).fetchone()[0]
     rows = conn.execute(
-        f"SELECT * FROM pharmacies {where} ORDER BY {order} NULLS LAST LIMIT ? OFFSET ?",
+        f"SELECT * FROM pharmacy_details {where} ORDER BY {order} NULLS LAST LIMIT ? OFFSET ?",
         params + [per_page, offset_val],
     ).fetchall()
     df = pd.DataFrame([dict(r) for r in rows])
@@ -1878,7 +1863,7 @@ elif page == "Market Map":
         }
         agg, where_clause, label = metric_map[map_metric]
         state_data = conn.execute(f"""
-            SELECT state, {agg} as val FROM pharmacies
+            SELECT state, {agg} as val FROM pharmacy_details
             WHERE state IS NOT NULL AND {where_clause}
             GROUP BY state ORDER BY val DESC
         """).fetchall()
@@ -2101,7 +2086,7 @@ elif page == "Data Sources":
     conn = get_db()
     total = conn.execute("SELECT COUNT(*) FROM pharmacies").fetchone()[0]
     has_medicare = conn.execute("SELECT COUNT(*) FROM pharmacies WHERE medicare_claims_count IS NOT NULL AND medicare_claims_count > 0").fetchone()[0]
-    has_census = conn.execute("SELECT COUNT(*) FROM pharmacies WHERE zip_population IS NOT NULL").fetchone()[0]
+    has_census = conn.execute("SELECT COUNT(*) FROM pharmacy_details WHERE zip_population IS NOT NULL").fetchone()[0]
     has_hpsa = conn.execute("SELECT COUNT(*) FROM pharmacies WHERE hpsa_designated = 1").fetchone()[0]
     has_dates = conn.execute("SELECT COUNT(*) FROM pharmacies WHERE enumeration_date IS NOT NULL").fetchone()[0]
     has_scores = conn.execute("SELECT COUNT(*) FROM pharmacies WHERE acquisition_score IS NOT NULL").fetchone()[0]
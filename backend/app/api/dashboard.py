@@ -52,6 +52,7 @@ async def dashboard_stats(db: AsyncSession = Depends(get_db), user=Depends(get_c
             {
                 "id": r.id,
                 "status": r.status,
+                "run_type": r.run_type,
                 "started_at": r.started_at.isoformat() if r.started_at else None,
                 "completed_at": r.completed_at.isoformat() if r.completed_at else None,
                 "records_processed": r.records_processed,
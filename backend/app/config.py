@@ -7,6 +7,12 @@ class Settings(BaseSettings):
     DATABASE_URL_SYNC: str = "postgresql://pharmacy:changeme123@db:5432/pharmacy_intel"
     SECRET_KEY: str = "devsecretkey_change_in_production"
     DATA_DIR: str = "/app/data"
+    PIPELINE_WORKERS: int = 1  # >1 parses NPPES byte ranges in a process pool
+    NPPES_KEEP_CSV: bool = False  # extract the ~10GB CSV instead of streaming the ZIP
+    PIPELINE_LOADER: str = "upsert"  # "copy" stages each batch with COPY and merges it
+    DOWNLOAD_SEGMENTS: int = 4  # concurrent range requests per bulk download
+    CMS_PARTD_URL: str = ""  # bulk Part D CSV; empty uses data/cms_partd.csv if present
+    CENSUS_COUNTY_URL: str = ""  # county reference CSV; empty uses data/county_data.csv
     ADMIN_EMAIL: str = "admin@pharma.local"
     ADMIN_PASSWORD: str = "admin123"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 1440  # 24 hours
@@ -1,6 +1,6 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from app.config import get_settings
 
 settings = get_settings()
@@ -15,6 +15,23 @@ class Base(DeclarativeBase):
     pass
 
 
+# Columns added after tables may already exist; create_all() only creates missing tables.
+ADDED_COLUMNS = [
+    ("pharmacies", "npi_deactivation_date", "DATE"),
+    ("pharmacies", "source_hash", "VARCHAR(64)"),
+    ("pipeline_runs", "run_type", "VARCHAR(50) DEFAULT 'full'"),
+    ("pipeline_runs", "source_file", "VARCHAR(500)"),
+    ("pipeline_runs", "source_fingerprint", "VARCHAR(64)"),
+    ("pipeline_runs", "byte_offset", "BIGINT"),
+]
+
+
+def add_missing_columns(conn):
+    """Add ADDED_COLUMNS to existing tables. Takes a sync connection."""
+    for table, column, ddl in ADDED_COLUMNS:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {ddl}"))
+
+
 async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
@@ -4,7 +4,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy import text
 
-from app.database import engine, Base, sync_engine, AsyncSessionLocal
+from app.database import engine, Base, sync_engine, AsyncSessionLocal, add_missing_columns
 from app.models import User
 from app.auth.utils import hash_password
 from app.auth.router import router as auth_router
@@ -25,6 +25,7 @@ async def lifespan(app: FastAPI):
     # Create tables on startup
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_columns)
 
     # Seed admin user if not exists
     async with AsyncSessionLocal() as session:
@@ -1,8 +1,8 @@
 from datetime import datetime
 from sqlalchemy import (
-    Column, Integer, BigInteger, String, Boolean, Float, DateTime, Text, Index
+    Column, Integer, BigInteger, String, Boolean, Float, Date, DateTime, Text, Index
 )
-from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.dialects.postgresql import TSVECTOR, JSONB
 from app.database import Base
 
 
@@ -65,6 +65,8 @@ class Pharmacy(Base):
     dedup_key = Column(String(255), index=True)
     first_seen = Column(DateTime, default=datetime.utcnow)
     last_refreshed = Column(DateTime, default=datetime.utcnow)
+    npi_deactivation_date = Column(Date)
+    source_hash = Column(String(64))  # hash of the NPPES record last loaded
 
     # Full-text search
     search_vector = Column(TSVECTOR)
@@ -87,6 +89,16 @@ class PharmacyChange(Base):
     detected_at = Column(DateTime, default=datetime.utcnow)
 
 
+class PendingChange(Base):
+    """A loaded pharmacy whose change detection hasn't run yet; see change_detection."""
+    __tablename__ = "pending_changes"
+
+    npi = Column(String(10), primary_key=True)
+    is_new = Column(Boolean, default=False)
+    old_values = Column(JSONB)  # TRACKED_FIELDS before the load; null for new pharmacies
+    run_id = Column(Integer)
+
+
 class PipelineRun(Base):
     __tablename__ = "pipeline_runs"
 
@@ -94,8 +106,23 @@ class PipelineRun(Base):
     started_at = Column(DateTime)
     completed_at = Column(DateTime)
     status = Column(String(50), default="pending")
+    run_type = Column(String(50), default="full")  # full, incremental
+    source_file = Column(String(500))
+    source_fingerprint = Column(String(64))
+    byte_offset = Column(BigInteger)  # ingest checkpoint: CSV bytes loaded so far
     records_processed = Column(Integer, default=0)
     records_added = Column(Integer, default=0)
     records_updated = Column(Integer, default=0)
     changes_detected = Column(Integer, default=0)
     error_log = Column(Text)
+
+
+class PipelineStage(Base):
+    __tablename__ = "pipeline_stages"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    stage = Column(String(100), unique=True, nullable=False)
+    input_fingerprint = Column(String(64))  # hash of input files and upstream stage keys
+    rows_affected = Column(Integer)
+    run_id = Column(Integer)
+    completed_at = Column(DateTime)
@@ -1,12 +1,20 @@
 """
 Change detection — snapshots current state and detects changes after pipeline run.
+
+A full run loads pharmacies long before it diffs them (clustering runs in
+between). So that a run dying in between doesn't lose its changes, each
+load batch stores its new NPIs and the pre-load values of its updated ones
+in pending_changes, committed with the batch; detect_pending_changes()
+diffs and clears whatever is pending, from this run or an earlier one.
 """
 import logging
 from datetime import datetime
-from sqlalchemy import select, text
+from sqlalchemy import delete, select, text
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
-from app.models import Pharmacy, PharmacyChange
+from app.models import Pharmacy, PharmacyChange, PendingChange
+from app.pipeline.loader import copy_rows
 
 logger = logging.getLogger(__name__)
 
@@ -15,68 +23,160 @@ TRACKED_FIELDS = [
     "phone", "is_chain", "is_independent", "chain_parent", "authorized_official_name",
 ]
 
+SNAPSHOT_BATCH_SIZE = 5000
 
-def snapshot_current_state(db: Session) -> dict:
-    """Take a snapshot of current pharmacy data for change comparison."""
-    result = db.execute(select(Pharmacy))
-    pharmacies = result.scalars().all()
 
+def snapshot_current_state(db: Session, npis: set | None = None) -> dict:
+    """
+    Take a snapshot of current pharmacy data for change comparison:
+    {npi: tuple of TRACKED_FIELDS values}. Only those columns are selected,
+    streamed through a server-side cursor; no ORM objects are built.
+    Pass npis to snapshot only those pharmacies (incremental updates).
+    """
+    columns = [Pharmacy.npi] + [getattr(Pharmacy, field) for field in TRACKED_FIELDS]
     snapshot = {}
-    for p in pharmacies:
-        snapshot[p.npi] = {field: getattr(p, field) for field in TRACKED_FIELDS}
+
+    if npis is None:
+        result = db.execute(select(*columns).execution_options(yield_per=SNAPSHOT_BATCH_SIZE))
+        for row in result:
+            snapshot[row[0]] = tuple(row[1:])
+    else:
+        npis = list(npis)
+        for i in range(0, len(npis), SNAPSHOT_BATCH_SIZE):
+            batch = npis[i:i + SNAPSHOT_BATCH_SIZE]
+            for row in db.execute(select(*columns).where(Pharmacy.npi.in_(batch))):
+                snapshot[row[0]] = tuple(row[1:])
 
     logger.info(f"Snapshot captured: {len(snapshot)} existing pharmacies")
     return snapshot
 
 
 def detect_changes(db: Session, snapshot: dict, updated_npis: set, new_npis: set) -> int:
-    """Compare current state against snapshot and record changes."""
-    changes_count = 0
+    """
+    Compare current state against snapshot and record changes. Current
+    values are read in SNAPSHOT_BATCH_SIZE batches, diffed in memory and
+    written to pharmacy_changes with one bulk insert.
+    """
     now = datetime.utcnow()
+    current = snapshot_current_state(db, new_npis | (updated_npis & snapshot.keys()))
+    name_index = TRACKED_FIELDS.index("organization_name")
+    changes = []
 
     # New pharmacies
     for npi in new_npis:
-        result = db.execute(select(Pharmacy).where(Pharmacy.npi == npi))
-        pharmacy = result.scalar_one_or_none()
-        if pharmacy:
-            change = PharmacyChange(
-                npi=npi,
-                organization_name=pharmacy.organization_name,
-                change_type="new",
-                field_changed="all",
-                new_value=f"New pharmacy: {pharmacy.organization_name}",
-                detected_at=now,
-            )
-            db.add(change)
-            changes_count += 1
+        if npi in current:
+            name = current[npi][name_index]
+            changes.append({
+                "npi": npi,
+                "organization_name": name,
+                "change_type": "new",
+                "field_changed": "all",
+                "old_value": None,
+                "new_value": f"New pharmacy: {name}",
+                "detected_at": now,
+            })
 
     # Updated pharmacies
     for npi in updated_npis:
-        if npi not in snapshot:
-            continue
-
-        result = db.execute(select(Pharmacy).where(Pharmacy.npi == npi))
-        pharmacy = result.scalar_one_or_none()
-        if not pharmacy:
+        if npi not in snapshot or npi not in current:
             continue
 
-        old_data = snapshot[npi]
-        for field in TRACKED_FIELDS:
-            old_val = str(old_data.get(field) or "")
-            new_val = str(getattr(pharmacy, field) or "")
+        values = current[npi]
+        for field, old, new in zip(TRACKED_FIELDS, snapshot[npi], values):
+            old_val = str(old or "")
+            new_val = str(new or "")
             if old_val != new_val:
-                change = PharmacyChange(
-                    npi=npi,
-                    organization_name=pharmacy.organization_name,
-                    change_type="updated",
-                    field_changed=field,
-                    old_value=old_val,
-                    new_value=new_val,
-                    detected_at=now,
-                )
-                db.add(change)
-                changes_count += 1
+                changes.append({
+                    "npi": npi,
+                    "organization_name": values[name_index],
+                    "change_type": "updated",
+                    "field_changed": field,
+                    "old_value": old_val,
+                    "new_value": new_val,
+                    "detected_at": now,
+                })
+
+    if changes:
+        db.execute(insert(PharmacyChange), changes)
+    db.commit()
+    logger.info(f"Change detection: {len(changes)} changes recorded")
+    return len(changes)
+
+
+def record_pending_changes(db: Session, snapshot: dict, inserted: set, updated: set, run_id: int | None = None):
+    """
+    Queue a load batch's NPIs for detect_pending_changes(). An NPI already
+    pending keeps its entry, so the diff runs from its state before the
+    first load that touched it. The caller commits, with the batch.
+    """
+    rows = [{"npi": npi, "is_new": True, "old_values": None, "run_id": run_id} for npi in inserted]
+    rows += [
+        {"npi": npi, "is_new": False, "old_values": list(snapshot[npi]), "run_id": run_id}
+        for npi in updated if npi in snapshot
+    ]
+    if rows:
+        db.execute(insert(PendingChange).on_conflict_do_nothing(index_elements=["npi"]), rows)
+
+
+def detect_pending_changes(db: Session) -> int:
+    """Run detect_changes() over everything in pending_changes and clear it, in one commit."""
+    snapshot = {}
+    new_npis = set()
+    for npi, is_new, old_values in db.execute(
+        select(PendingChange.npi, PendingChange.is_new, PendingChange.old_values)
+    ):
+        if is_new:
+            new_npis.add(npi)
+        else:
+            snapshot[npi] = tuple(old_values)
+    db.execute(delete(PendingChange))
+    return detect_changes(db, snapshot, set(snapshot), new_npis)
+
+
+def record_deactivations(db: Session, deactivations: dict) -> int:
+    """
+    Mark NPIs deactivated in NPPES ({npi: date}) and record a change for each
+    newly deactivated one. The dates are COPYed into a temporary table and
+    applied with one UPDATE ... FROM, which returns the rows it changed along
+    with their previous date; the changes go in with one bulk insert.
+    """
+    changes = []
+    now = datetime.utcnow()
+
+    if deactivations:
+        db.execute(text("""
+            CREATE TEMPORARY TABLE npi_deactivations (
+                npi VARCHAR(10),
+                deactivated_on DATE
+            ) ON COMMIT DROP
+        """))
+        copy_rows(db, "npi_deactivations", ["npi", "deactivated_on"], deactivations.items())
+        # The second reference to pharmacies reads the rows as they were
+        # before this statement, which gives the old date
+        deactivated = db.execute(text("""
+            UPDATE pharmacies
+            SET npi_deactivation_date = d.deactivated_on,
+                last_refreshed = :now
+            FROM npi_deactivations d, pharmacies old
+            WHERE pharmacies.npi = d.npi AND old.npi = d.npi
+              AND pharmacies.npi_deactivation_date IS DISTINCT FROM d.deactivated_on
+            RETURNING pharmacies.npi, pharmacies.organization_name, old.npi_deactivation_date, d.deactivated_on
+        """), {"now": now})
+        changes = [
+            {
+                "npi": npi,
+                "organization_name": name,
+                "change_type": "deactivated",
+                "field_changed": "npi_deactivation_date",
+                "old_value": str(old or ""),
+                "new_value": deactivated_on.isoformat(),
+                "detected_at": now,
+            }
+            for npi, name, old, deactivated_on in deactivated
+        ]
+        if changes:
+            db.execute(insert(PharmacyChange), changes)
 
     db.commit()
-    logger.info(f"Change detection: {changes_count} changes recorded")
-    return changes_count
+    logger.info(f"Deactivations: {len(changes)} pharmacies deactivated")
+    return len(changes)
@@ -0,0 +1,24 @@
+"""
+Source file fingerprints — cheap identity for multi-GB input files.
+
+Standard library only: run_pipeline.py at the repo root imports this
+module as backend.app.pipeline.fingerprint for its own NPPES cache and
+checkpoints.
+"""
+import hashlib
+import os
+
+
+def file_fingerprint(path: str, sample_size: int = 1024 * 1024, samples: int = 8) -> str:
+    """
+    Identify a source file by size, mtime and a SHA-256 over evenly spaced
+    sample blocks (first and last included). Hashing all of a 10GB NPPES
+    file would cost as much I/O as the scan a fingerprint exists to avoid.
+    """
+    st = os.stat(path)
+    h = hashlib.sha256(f"{st.st_size}:{st.st_mtime_ns}".encode())
+    with open(path, "rb") as f:
+        for i in range(samples):
+            f.seek(max(0, st.st_size - sample_size) * i // (samples - 1))
+            h.update(f.read(sample_size))
+    return h.hexdigest()[:16]
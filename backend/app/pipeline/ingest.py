@@ -0,0 +1,84 @@
+"""
+NPPES ingest — turns the NPPES CSV into prepared pharmacy records.
+
+Serial mode streams parse_nppes() block by block. Parallel mode splits the
+CSV into record-aligned byte ranges and parses, filters, normalizes and
+classifies each range in a process pool; batches come back in file order,
+so the writer sees exactly the records a serial run would produce. Every
+batch carries the CSV byte offset it ends at, which the orchestrator
+checkpoints so an interrupted run can resume there. A complete scan caches
+the raw pharmacy subset, and later runs on the same release read the cache
+instead of the CSV.
+"""
+import logging
+import zipfile
+from multiprocessing import Pool
+
+from app.pipeline.nppes_scan import byte_ranges
+from app.pipeline.sources.npi import parse_nppes, parse_nppes_range
+from app.pipeline.sources.nppes_cache import load_cached_records, save_cached_records
+from app.pipeline.normalize import normalize_record
+from app.pipeline.chain_filter import classify_pharmacy, extract_ownership_signals
+
+logger = logging.getLogger(__name__)
+
+CACHED_BATCH_SIZE = 10000
+
+
+def prepare_record(record: dict) -> dict:
+    """Normalize, classify chain/independent, and extract ownership signals."""
+    record = normalize_record(record)
+    record = classify_pharmacy(record)
+    record = extract_ownership_signals(record)
+    return record
+
+
+def _prepare_range(task: tuple) -> tuple[list, list]:
+    csv_path, header, start, end = task
+    raw = parse_nppes_range(csv_path, header, start, end)
+    return raw, [prepare_record(dict(r)) for r in raw]
+
+
+def iter_pharmacy_batches(csv_path: str, workers: int = 1, cache_dir: str | None = None,
+                          refresh_cache: bool = False, start: int = 0):
+    """
+    Yield (offset, records) batches of prepared pharmacy records in file
+    order, starting at CSV byte offset start. offset is None for batches
+    served from the cache, which always covers the whole file and so only
+    serves scans from the start.
+    """
+    if cache_dir and not refresh_cache and not start:
+        cached = load_cached_records(cache_dir, csv_path)
+        if cached is not None:
+            for i in range(0, len(cached), CACHED_BATCH_SIZE):
+                yield None, [prepare_record(r) for r in cached[i:i + CACHED_BATCH_SIZE]]
+            return
+
+    raw_records = []
+    for offset, raw, prepared in _iter_parsed(csv_path, workers, start):
+        raw_records.extend(raw)
+        yield offset, prepared
+
+    # A resumed scan never saw the start of the file
+    if cache_dir and not start:
+        save_cached_records(cache_dir, csv_path, raw_records)
+
+
+def _iter_parsed(csv_path: str, workers: int, start: int = 0):
+    """Yield (offset, raw, prepared) record batches straight from the CSV."""
+    if workers > 1 and zipfile.is_zipfile(csv_path):
+        # Byte ranges need a seekable CSV; a compressed member is read once, in order
+        logger.info("Parallel parsing needs an extracted CSV (NPPES_KEEP_CSV); parsing the ZIP serially")
+        workers = 1
+    if workers <= 1:
+        for offset, chunk in parse_nppes(csv_path, start=start):
+            yield offset, chunk, [prepare_record(dict(r)) for r in chunk]
+        return
+
+    header, ranges = byte_ranges(csv_path, start=start)
+    logger.info(f"Parsing NPPES CSV with {workers} workers over {len(ranges)} byte ranges")
+    tasks = [(csv_path, header, begin, end) for begin, end in ranges]
+    with Pool(workers) as pool:
+        for i, (raw, prepared) in enumerate(pool.imap(_prepare_range, tasks), 1):
+            logger.info(f"  Parsed range {i}/{len(ranges)}: {len(prepared)} pharmacy records")
+            yield ranges[i - 1][1], raw, prepared
@@ -0,0 +1,158 @@
+"""
+Bulk loader — writes prepared pharmacy records with set-based upserts.
+
+The "upsert" loader sends each batch as one executemany of INSERT ... ON
+CONFLICT (npi) DO UPDATE straight through Core (no ORM objects), which
+SQLAlchemy packs into multi-row statements. The "copy" loader COPYs each
+batch into a temporary staging table and merges it into pharmacies with one
+statement. Either way semantics match a per-record upsert: new NPIs are
+inserted with first_seen set; existing ones take every non-null incoming
+value, keep their other columns, and count as refreshed.
+
+Each row stores source_hash, a hash of the NPPES record it was last loaded
+from. An existing row whose hash matches the incoming record is left alone:
+no write, no last_refreshed bump, and it isn't reported as updated, so
+change detection and search vectors skip it too.
+"""
+import io
+import json
+import hashlib
+import logging
+from datetime import datetime
+
+from sqlalchemy import func, literal_column, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.models import Pharmacy
+
+logger = logging.getLogger(__name__)
+
+STAGING_TABLE = "pharmacies_staging"
+
+
+def upsert_pharmacies(db: Session, records: list) -> tuple[set, set]:
+    """Upsert prepared pharmacy records. Returns (inserted NPIs, updated NPIs); the caller commits."""
+    rows = _merge_by_npi(records)
+    if not rows:
+        return set(), set()
+
+    now = datetime.utcnow()
+    columns = sorted({key for row in rows for key in row})
+    for row in rows:
+        for key in columns:
+            row.setdefault(key, None)
+        row["first_seen"] = now
+        row["last_refreshed"] = now
+
+    table = Pharmacy.__table__
+    stmt = insert(table)
+    set_ = {
+        key: func.coalesce(stmt.excluded[key], table.c[key])
+        for key in columns if key != "npi"
+    }
+    # Listed with a pharmacy taxonomy means active again
+    set_["npi_deactivation_date"] = None
+    set_["last_refreshed"] = stmt.excluded.last_refreshed
+    changed = (table.c.source_hash.is_distinct_from(stmt.excluded.source_hash)
+               | table.c.npi_deactivation_date.is_not(None))
+    stmt = stmt.on_conflict_do_update(index_elements=["npi"], set_=set_, where=changed).returning(
+        table.c.npi, literal_column("xmax = 0").label("inserted")
+    )
+
+    inserted = set()
+    updated = set()
+    for npi, was_inserted in db.execute(stmt, rows):
+        (inserted if was_inserted else updated).add(npi)
+
+    return inserted, updated
+
+
+def copy_pharmacies(db: Session, records: list) -> tuple[set, set]:
+    """
+    COPY records into the staging table and merge them into pharmacies.
+    Returns (inserted NPIs, updated NPIs); the caller commits, which drops
+    the staging table. It is temporary, so overlapping runs each get their own.
+    """
+    rows = _merge_by_npi(records)
+    if not rows:
+        return set(), set()
+    columns = sorted({key for row in rows for key in row})
+    db.execute(text(
+        f"CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE} ON COMMIT DROP "
+        "AS SELECT * FROM pharmacies WITH NO DATA"
+    ))
+    copy_rows(db, STAGING_TABLE, columns, ([row.get(key) for key in columns] for row in rows))
+
+    updates = ", ".join(f"{key} = COALESCE(EXCLUDED.{key}, pharmacies.{key})" for key in columns if key != "npi")
+    result = db.execute(
+        text(f"""
+            INSERT INTO pharmacies ({', '.join(columns)}, first_seen, last_refreshed)
+            SELECT {', '.join(columns)}, :now, :now FROM {STAGING_TABLE}
+            ON CONFLICT (npi) DO UPDATE SET {updates},
+                npi_deactivation_date = NULL,
+                last_refreshed = EXCLUDED.last_refreshed
+            WHERE pharmacies.source_hash IS DISTINCT FROM EXCLUDED.source_hash
+                OR pharmacies.npi_deactivation_date IS NOT NULL
+            RETURNING npi, xmax = 0
+        """),
+        {"now": datetime.utcnow()},
+    )
+    inserted = set()
+    updated = set()
+    for npi, was_inserted in result:
+        (inserted if was_inserted else updated).add(npi)
+    return inserted, updated
+
+
+LOADERS = {"upsert": upsert_pharmacies, "copy": copy_pharmacies}
+
+
+def copy_rows(db: Session, table: str, columns: list, rows):
+    """COPY rows (sequences of values in columns order) into table on the session's connection."""
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join(_copy_value(value) for value in row) + "\n")
+    buf.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+    finally:
+        cursor.close()
+
+
+def _copy_value(value) -> str:
+    """One field in COPY text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (
+        str(value).replace("\\", "\\\\").replace("\t", "\\t")
+        .replace("\n", "\\n").replace("\r", "\\r")
+    )
+
+
+def _merge_by_npi(records: list) -> list:
+    """
+    One row per NPI: ON CONFLICT can't touch a row twice in one statement.
+    Later records overwrite earlier ones with their non-null values, as
+    sequential upserts would.
+    """
+    merged = {}
+    for record in records:
+        row = merged.get(record["npi"])
+        if row is None:
+            merged[record["npi"]] = dict(record)
+        else:
+            row.update({k: v for k, v in record.items() if v is not None})
+    rows = list(merged.values())
+    for row in rows:
+        row["source_hash"] = record_hash(row)
+    return rows
+
+
+def record_hash(record: dict) -> str:
+    """SHA-256 of a prepared NPPES record, independent of key order."""
+    payload = json.dumps(record, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
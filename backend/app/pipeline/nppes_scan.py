@@ -0,0 +1,128 @@
+"""
+Byte-level NPPES scanning shared by both loaders.
+
+The backend ingest (app.pipeline.sources.npi) and the SQLite loader at the
+repo root (run_pipeline.py) both locate pharmacy records in the raw CSV
+bytes before any CSV parsing, and split the file into record-aligned byte
+ranges for parallel parsing. This module is that shared code. It only uses
+the standard library and imports nothing else from the app package, so
+run_pipeline.py imports it as backend.app.pipeline.nppes_scan without the
+backend's dependencies installed.
+"""
+import os
+import re
+
+# Pharmacy taxonomy codes
+PHARMACY_TAXONOMIES = {
+    "183500000X",  # Pharmacist
+    "3336C0002X",  # Community/Retail Pharmacy
+    "3336C0003X",  # Compounding Pharmacy
+    "3336C0004X",  # Long Term Care Pharmacy
+    "3336H0001X",  # Home Infusion Therapy Pharmacy
+    "3336I0012X",  # Institutional Pharmacy
+    "3336L0003X",  # Mail Order Pharmacy
+    "3336M0002X",  # Military/U.S. Coast Guard Pharmacy
+    "3336M0003X",  # Managed Care Organization Pharmacy
+    "3336N0007X",  # Nuclear Pharmacy
+    "3336S0011X",  # Specialty Pharmacy
+    "333600000X",  # Pharmacy
+}
+
+# Byte-level prefilter: every code shares one of these 4-byte prefixes, so a
+# couple of bytes.find scans locate every candidate before any CSV parsing.
+TAXONOMY_BYTES = {t.encode() for t in PHARMACY_TAXONOMIES}
+TAXONOMY_PREFIXES = sorted({t[:4] for t in TAXONOMY_BYTES})
+BLOCK_SIZE = 64 * 1024 * 1024
+
+# NPPES quotes every field and opens each record with the quoted 10-digit
+# NPI, so this marks a record boundary even mid-file without quote context.
+RECORD_START = re.compile(rb'\n(?="\d{10}",)')
+RANGE_SIZE = 256 * 1024 * 1024
+
+
+def _find_all(data: bytes, needle: bytes):
+    i = data.find(needle)
+    while i != -1:
+        yield i
+        i = data.find(needle, i + 1)
+
+
+def prefilter_records(data: bytes) -> tuple[bytes, int]:
+    """
+    Pick the records in data that contain a pharmacy taxonomy code.
+
+    data must start at a record boundary. Returns (kept, consumed): the
+    matching complete records joined as bytes, and the offset just past the
+    last complete record. Quote parity (counted from the last known record
+    boundary) decides whether a newline ends a record or sits inside a
+    quoted field, so multi-line records are kept or dropped whole.
+    """
+    pos = par = 0
+
+    def inside_quotes(x: int) -> int:
+        nonlocal pos, par
+        par ^= data.count(b'"', min(x, pos), max(x, pos)) & 1
+        pos = x
+        return par
+
+    hits = sorted(
+        i for prefix in TAXONOMY_PREFIXES for i in _find_all(data, prefix)
+        if data[i:i + 10] in TAXONOMY_BYTES
+    )
+    kept = []
+    end = 0
+    for i in hits:
+        if i < end:
+            continue
+        start = data.rfind(b"\n", 0, i) + 1
+        while start > end and inside_quotes(start):
+            start = data.rfind(b"\n", 0, start - 1) + 1
+        start = max(start, end)
+        stop = data.find(b"\n", i)
+        while stop != -1 and inside_quotes(stop):
+            stop = data.find(b"\n", stop + 1)
+        if stop == -1:
+            break
+        kept.append(data[start:stop + 1])
+        pos, par, end = stop + 1, 0, stop + 1
+
+    consumed = data.rfind(b"\n") + 1
+    while consumed > end and inside_quotes(consumed):
+        consumed = data.rfind(b"\n", 0, consumed - 1) + 1
+    return b"".join(kept), max(consumed, end)
+
+
+def count_records(data: bytes, end: int | None = None) -> int:
+    """
+    Number of NPPES records in data[:end], which must start at a record
+    boundary. Counts record starts rather than newlines, since quoted
+    fields can contain newlines.
+    """
+    end = len(data) if end is None else end
+    if end == 0 or data[:1].isspace():
+        return 0
+    return 1 + sum(1 for _ in RECORD_START.finditer(data, 0, end))
+
+
+def byte_ranges(csv_path: str, range_size: int = RANGE_SIZE, start: int = 0) -> tuple[bytes, list]:
+    """
+    Split the CSV body, from record-aligned offset start onwards, into
+    record-aligned (start, end) byte ranges. Returns (header, ranges).
+    """
+    size = os.path.getsize(csv_path)
+    with open(csv_path, "rb") as f:
+        header = f.readline()
+        bounds = [max(len(header), start)]
+        target = bounds[0] + range_size
+        while target < size:
+            f.seek(target)
+            window = f.read(1024 * 1024)
+            match = RECORD_START.search(window)
+            if match:
+                bounds.append(target + match.start() + 1)
+                target = bounds[-1] + range_size
+            else:
+                # Overlap windows so a boundary split across two reads is still found
+                target += max(len(window) - 16, 1)
+    bounds.append(size)
+    return header, [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
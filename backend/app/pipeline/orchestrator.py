@@ -11,136 +11,179 @@ Runs the full data pipeline:
 7. Geographic enrichment
 8. Change detection
 9. Update search vectors
+
+run_incremental() applies NPPES weekly update files between full runs.
 """
 import logging
+import os
 from datetime import datetime
 
 from sqlalchemy import create_engine, text, select, func
 from sqlalchemy.orm import Session
 
 from app.config import get_settings
-from app.database import Base
+from app.database import Base, add_missing_columns
 from app.models import Pharmacy, PipelineRun
-from app.pipeline.sources.npi import download_nppes, parse_nppes
+from app.pipeline.sources.npi import download_nppes, find_nppes_updates, parse_nppes_updates
+from app.pipeline.sources.nppes_cache import has_cached_records
 from app.pipeline.sources.cms import download_cms_partd, parse_cms_partd
-from app.pipeline.sources.census import download_geographic_data
-from app.pipeline.normalize import normalize_record, generate_dedup_key
-from app.pipeline.chain_filter import classify_pharmacy, cluster_multi_location, extract_ownership_signals
-from app.pipeline.change_detection import snapshot_current_state, detect_changes
+from app.pipeline.sources.census import download_county_data, parse_geographic_data
+from app.pipeline.chain_filter import CHAIN_MAP, CHAIN_PATTERNS, INSTITUTIONAL_PATTERNS
+from app.pipeline.ingest import iter_pharmacy_batches, prepare_record, CACHED_BATCH_SIZE
+from app.pipeline.fingerprint import file_fingerprint
+from app.pipeline.loader import LOADERS, copy_rows
+from app.pipeline.stages import stage_key, stage_is_current, stage_run_id, record_stage, run_stage
+from app.pipeline.change_detection import (
+    snapshot_current_state, record_pending_changes, detect_pending_changes, record_deactivations,
+)
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
 settings = get_settings()
 
-
-def run_pipeline():
-    """Execute the full data pipeline."""
+# Classification rules are applied while loading, so a change to them
+# reloads NPPES (from the subset cache) like a new file would
+CLASSIFIER_KEY = stage_key(sorted(CHAIN_MAP.items()), CHAIN_PATTERNS, INSTITUTIONAL_PATTERNS)
+
+
+def run_pipeline(workers: int | None = None, refresh_cache: bool = False, resume: bool = False,
+                 force: bool = False):
+    """
+    Execute the full data pipeline. workers > 1 parses NPPES in a process
+    pool; refresh_cache rescans NPPES even if its pharmacy subset is cached;
+    resume continues the last interrupted run on the same NPPES file from
+    its checkpoint. Stages whose inputs are unchanged since they last
+    completed are skipped unless force is set.
+    """
+    workers = workers or settings.PIPELINE_WORKERS
     engine = create_engine(settings.DATABASE_URL_SYNC, echo=False)
     Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        add_missing_columns(conn)
 
     with Session(engine) as db:
-        # Create pipeline run record
-        pipeline_run = PipelineRun(started_at=datetime.utcnow(), status="running")
-        db.add(pipeline_run)
+        # Step 1: Download NPI data
+        logger.info("=" * 60)
+        logger.info("STAGE 1: Downloading NPPES data...")
+        logger.info("=" * 60)
+        nppes_path = download_nppes(
+            settings.DATA_DIR, keep_csv=settings.NPPES_KEEP_CSV, segments=settings.DOWNLOAD_SEGMENTS
+        )
+        fingerprint = file_fingerprint(nppes_path)
+        cache_dir = os.path.join(settings.DATA_DIR, "cache")
+
+        if resume and not refresh_cache and has_cached_records(cache_dir, nppes_path):
+            # The cache always covers the whole file, so resuming part way gains nothing
+            logger.info("Pharmacy records are cached for this NPPES file; loading them whole instead of resuming")
+            resume = False
+        pipeline_run = _find_checkpoint(db, fingerprint) if resume else None
+        if pipeline_run:
+            logger.info(f"Resuming run {pipeline_run.id} at byte {pipeline_run.byte_offset:,}")
+            pipeline_run.status = "running"
+        else:
+            if resume:
+                logger.info("No checkpoint for this NPPES file; starting from the beginning")
+            # Create pipeline run record
+            pipeline_run = PipelineRun(
+                started_at=datetime.utcnow(), status="running", run_type="full",
+                source_fingerprint=fingerprint, byte_offset=0,
+            )
+            db.add(pipeline_run)
         db.commit()
 
         try:
-            # Step 0: Snapshot current state for change detection
-            snapshot = snapshot_current_state(db)
-
-            # Step 1: Download NPI data
-            logger.info("=" * 60)
-            logger.info("STAGE 1: Downloading NPPES data...")
-            logger.info("=" * 60)
-            csv_path = download_nppes(settings.DATA_DIR)
+            start = pipeline_run.byte_offset or 0
+            records_processed = pipeline_run.records_processed or 0
+            records_added = pipeline_run.records_added or 0
+            records_updated = pipeline_run.records_updated or 0
+            changes_detected = 0
 
             # Step 2: Parse, normalize, classify, and load
             logger.info("=" * 60)
             logger.info("STAGE 2: Parsing and loading pharmacy records...")
             logger.info("=" * 60)
-
-            records_processed = 0
-            records_added = 0
-            records_updated = 0
-            new_npis = set()
-            updated_npis = set()
-            all_records = []
-
-            for chunk in parse_nppes(csv_path):
-                for record in chunk:
-                    records_processed += 1
-
-                    # Normalize
-                    record = normalize_record(record)
-
-                    # Classify chain/independent
-                    record = classify_pharmacy(record)
-
-                    # Extract ownership signals
-                    record = extract_ownership_signals(record)
-
-                    all_records.append(record)
-
-                # Batch upsert
-                for record in all_records:
-                    npi = record["npi"]
-                    existing = db.execute(
-                        select(Pharmacy).where(Pharmacy.npi == npi)
-                    ).scalar_one_or_none()
-
-                    if existing:
-                        # Update existing record
-                        for key, value in record.items():
-                            if key != "npi" and value is not None:
-                                setattr(existing, key, value)
-                        existing.last_refreshed = datetime.utcnow()
-                        records_updated += 1
-                        updated_npis.add(npi)
-                    else:
-                        # Insert new record
-                        pharmacy = Pharmacy(
-                            **record,
-                            first_seen=datetime.utcnow(),
-                            last_refreshed=datetime.utcnow(),
-                        )
-                        db.add(pharmacy)
-                        records_added += 1
-                        new_npis.add(npi)
-
-                db.commit()
-                all_records = []
-                logger.info(f"  Loaded batch. Total: {records_processed:,} processed, {records_added:,} new, {records_updated:,} updated")
+            load_key = stage_key(fingerprint, CLASSIFIER_KEY)
+            load = force or refresh_cache or start > 0 or not stage_is_current(db, "nppes_load", load_key)
+            if not load:
+                logger.info("  NPPES file unchanged since the last load, skipping")
+            else:
+                # Snapshot current state for change detection. Batches loaded
+                # before a checkpoint queued their changes already.
+                snapshot = snapshot_current_state(db)
+
+                load_batch = LOADERS[settings.PIPELINE_LOADER]
+                for offset, records in iter_pharmacy_batches(
+                    nppes_path, workers=workers, cache_dir=cache_dir,
+                    refresh_cache=refresh_cache, start=start,
+                ):
+                    records_processed += len(records)
+                    inserted, updated = load_batch(db, records)
+                    record_pending_changes(db, snapshot, inserted, updated, pipeline_run.id)
+                    records_added += len(inserted)
+                    records_updated += len(updated)
+                    # The checkpoint commits with the records it covers and their queued changes
+                    if offset is not None:
+                        pipeline_run.byte_offset = offset
+                    pipeline_run.records_processed = records_processed
+                    pipeline_run.records_added = records_added
+                    pipeline_run.records_updated = records_updated
+                    db.commit()
+                    logger.info(f"  Loaded batch. Total: {records_processed:,} processed, {records_added:,} new, {records_updated:,} updated")
+                record_stage(db, "nppes_load", load_key, records_processed, pipeline_run.id)
+
+            # Downstream stages read the pharmacies table: they rerun after
+            # any load that wrote it (forced or resumed ones included, which
+            # keep load_key) and after weekly updates
+            last_update = db.scalar(
+                select(func.max(PipelineRun.id)).where(
+                    PipelineRun.run_type == "incremental", PipelineRun.status == "completed"
+                )
+            )
+            data_key = stage_key(stage_run_id(db, "nppes_load"), last_update)
 
             # Step 3: Multi-location clustering
             logger.info("=" * 60)
             logger.info("STAGE 3: Multi-location clustering...")
             logger.info("=" * 60)
-            _run_multi_location_clustering(db)
+            run_stage(db, "multi_location_clustering", stage_key(data_key),
+                      _run_multi_location_clustering, pipeline_run.id, force)
 
             # Step 4: CMS Medicare enrichment
             logger.info("=" * 60)
             logger.info("STAGE 4: CMS Medicare Part D enrichment...")
             logger.info("=" * 60)
-            _enrich_medicare(db)
+            cms_path = _fetch_optional(download_cms_partd, settings.CMS_PARTD_URL)
+            run_stage(db, "medicare_enrichment", stage_key(data_key, _fingerprint_or_none(cms_path)),
+                      lambda db: _enrich_medicare(db, cms_path), pipeline_run.id, force)
 
             # Step 5: Geographic enrichment
             logger.info("=" * 60)
             logger.info("STAGE 5: Geographic enrichment...")
             logger.info("=" * 60)
-            _enrich_geography(db)
+            county_path = _fetch_optional(download_county_data, settings.CENSUS_COUNTY_URL)
+            geo_key = stage_key(data_key, _fingerprint_or_none(county_path))
+            run_stage(db, "geographic_enrichment", geo_key,
+                      lambda db: _enrich_geography(db, county_path), pipeline_run.id, force)
 
             # Step 6: Change detection
             logger.info("=" * 60)
             logger.info("STAGE 6: Change detection...")
             logger.info("=" * 60)
-            changes_detected = detect_changes(db, snapshot, updated_npis, new_npis)
+            # Includes changes queued by an earlier run that failed after loading
+            changes_detected = detect_pending_changes(db)
 
             # Step 7: Update search vectors
             logger.info("=" * 60)
             logger.info("STAGE 7: Updating search vectors...")
             logger.info("=" * 60)
-            _update_search_vectors(db)
+            # Only rows written since the load, which a failed earlier run may
+            # have done; weekly updates maintain their own
+            load_run = db.get(PipelineRun, stage_run_id(db, "nppes_load") or pipeline_run.id)
+            since = min(pipeline_run.started_at, load_run.started_at) if load_run else pipeline_run.started_at
+            run_stage(db, "search_vectors", stage_key(data_key, geo_key),
+                      lambda db: _update_search_vectors(db, since=since),
+                      pipeline_run.id, force)
 
             # Complete pipeline run
             pipeline_run.completed_at = datetime.utcnow()
@@ -161,6 +204,7 @@ def run_pipeline():
 
         except Exception as e:
             logger.error(f"Pipeline failed: {e}", exc_info=True)
+            db.rollback()
             pipeline_run.completed_at = datetime.utcnow()
             pipeline_run.status = "failed"
             pipeline_run.error_log = str(e)
@@ -168,94 +212,251 @@ def run_pipeline():
             raise
 
 
-def _run_multi_location_clustering(db: Session):
-    """Flag multi-location operators that slipped through keyword filtering."""
-    result = db.execute(
-        text("""
-            UPDATE pharmacies SET is_chain = true, is_independent = false, chain_parent = 'Multi-Location Operator'
-            WHERE is_independent = true AND organization_name IN (
-                SELECT organization_name FROM pharmacies
-                WHERE is_independent = true
-                GROUP BY organization_name
-                HAVING COUNT(*) >= 10
+def _fetch_optional(download, url: str) -> str | None:
+    """Path of an optional enrichment source, or None if it's unavailable (non-fatal)."""
+    try:
+        return download(settings.DATA_DIR, url=url or None)
+    except Exception as e:
+        logger.warning(f"Download failed (non-fatal): {e}")
+        return None
+
+
+def _fingerprint_or_none(path: str | None) -> str | None:
+    return file_fingerprint(path) if path else None
+
+
+def _find_checkpoint(db: Session, fingerprint: str) -> PipelineRun | None:
+    """The latest interrupted full run on this NPPES file that got past its first batch."""
+    return db.scalars(
+        select(PipelineRun)
+        .where(
+            PipelineRun.run_type == "full",
+            PipelineRun.status != "completed",
+            PipelineRun.source_fingerprint == fingerprint,
+            PipelineRun.byte_offset > 0,
+        )
+        .order_by(PipelineRun.id.desc())
+        .limit(1)
+    ).first()
+
+
+def run_incremental():
+    """
+    Apply NPPES weekly update files that haven't been loaded yet, oldest
+    first. Each file upserts its pharmacy records, records deactivations of
+    known pharmacies, and runs change detection and search vector updates
+    for the touched NPIs only. Medicare and geographic enrichment stay with
+    the monthly full run.
+    """
+    engine = create_engine(settings.DATABASE_URL_SYNC, echo=False)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        add_missing_columns(conn)
+
+    with Session(engine) as db:
+        applied = set(db.scalars(
+            select(PipelineRun.source_file).where(
+                PipelineRun.run_type == "incremental", PipelineRun.status == "completed"
             )
-        """)
+        ))
+        pending = [p for p in find_nppes_updates(settings.DATA_DIR) if os.path.basename(p) not in applied]
+        if not pending:
+            logger.info(f"No new NPPES update files in {settings.DATA_DIR}")
+            return
+
+        for path in pending:
+            _apply_update_file(db, path)
+
+
+def _apply_update_file(db: Session, path: str):
+    """Load one NPPES update file as its own pipeline run."""
+    pipeline_run = PipelineRun(
+        started_at=datetime.utcnow(), status="running",
+        run_type="incremental", source_file=os.path.basename(path),
     )
+    db.add(pipeline_run)
     db.commit()
-    logger.info(f"Multi-location clustering updated {result.rowcount} records")
 
+    try:
+        logger.info("=" * 60)
+        logger.info(f"INCREMENTAL UPDATE: {os.path.basename(path)}")
+        logger.info("=" * 60)
+        known_npis = set(db.scalars(select(Pharmacy.npi)))
+        records, deactivations = parse_nppes_updates(path, known_npis)
+        records = [prepare_record(r) for r in records]
+
+        touched = {r["npi"] for r in records} | set(deactivations)
+        snapshot = snapshot_current_state(db, touched)
+
+        new_npis = set()
+        updated_npis = set()
+        load_batch = LOADERS[settings.PIPELINE_LOADER]
+        for i in range(0, len(records), CACHED_BATCH_SIZE):
+            inserted, updated = load_batch(db, records[i:i + CACHED_BATCH_SIZE])
+            record_pending_changes(db, snapshot, inserted, updated, pipeline_run.id)
+            new_npis |= inserted
+            updated_npis |= updated
+            db.commit()
+
+        changes_detected = record_deactivations(db, deactivations)
+        _run_multi_location_clustering(db)
+        changes_detected += detect_pending_changes(db)
+        # Records whose source_hash matched were not rewritten
+        _update_search_vectors(db, new_npis | updated_npis | set(deactivations))
+
+        pipeline_run.completed_at = datetime.utcnow()
+        pipeline_run.status = "completed"
+        pipeline_run.records_processed = len(records)
+        pipeline_run.records_added = len(new_npis)
+        pipeline_run.records_updated = len(updated_npis)
+        pipeline_run.changes_detected = changes_detected
+        db.commit()
+        logger.info(f"  {len(new_npis):,} new, {len(updated_npis):,} updated, "
+                    f"{len(deactivations):,} deactivated, {changes_detected} changes")
+
+    except Exception as e:
+        logger.error(f"Incremental update failed: {e}", exc_info=True)
+        db.rollback()
+        pipeline_run.completed_at = datetime.utcnow()
+        pipeline_run.status = "failed"
+        pipeline_run.error_log = str(e)
+        db.commit()
+        raise
+
+
+def _run_multi_location_clustering(db: Session) -> int:
+    """
+    Flag multi-location operators that slipped through keyword filtering,
+    and unflag those that have dropped below the threshold. Returns rows
+    updated.
+    """
+    # Count already-flagged locations too: a weekly update only reclassifies
+    # the pharmacies in the file. Deactivated locations don't count.
+    operators = """
+        SELECT organization_name FROM pharmacies
+        WHERE (is_independent = true OR chain_parent = 'Multi-Location Operator')
+            AND organization_name IS NOT NULL AND npi_deactivation_date IS NULL
+        GROUP BY organization_name
+        HAVING COUNT(*) >= 10
+    """
+    unflagged = db.execute(text(f"""
+        UPDATE pharmacies SET is_chain = false, is_independent = true, chain_parent = NULL
+        WHERE chain_parent = 'Multi-Location Operator' AND organization_name NOT IN ({operators})
+    """)).rowcount
+    flagged = db.execute(text(f"""
+        UPDATE pharmacies SET is_chain = true, is_independent = false, chain_parent = 'Multi-Location Operator'
+        WHERE is_independent = true AND organization_name IN ({operators})
+    """)).rowcount
+    db.commit()
+    logger.info(f"Multi-location clustering flagged {flagged} records, unflagged {unflagged}")
+    return flagged + unflagged
 
-def _enrich_medicare(db: Session):
-    """Join CMS Part D data to pharmacy records."""
+
+def _enrich_medicare(db: Session, csv_path: str | None) -> int | None:
+    """
+    Join CMS Part D data to pharmacy records. The metrics are COPYed into a
+    temporary table and applied with one UPDATE ... FROM, which only touches
+    NPIs that are pharmacies. Returns pharmacies updated, None if skipped or
+    failed.
+    """
     try:
-        csv_path = download_cms_partd(settings.DATA_DIR)
         if not csv_path:
             logger.info("No CMS data available, skipping Medicare enrichment")
-            return
+            return None
 
-        cms_data = parse_cms_partd(csv_path)
+        cms_data = parse_cms_partd(csv_path, npis=set(db.scalars(select(Pharmacy.npi))))
         if not cms_data:
-            return
-
-        updated = 0
-        for npi, metrics in cms_data.items():
-            result = db.execute(
-                text("""
-                    UPDATE pharmacies
-                    SET medicare_claims_count = :claims,
-                        medicare_beneficiary_count = :benes,
-                        medicare_total_cost = :cost
-                    WHERE npi = :npi
-                """),
-                {
-                    "npi": npi,
-                    "claims": metrics.get("medicare_claims_count"),
-                    "benes": metrics.get("medicare_beneficiary_count"),
-                    "cost": metrics.get("medicare_total_cost"),
-                },
+            return None
+
+        db.execute(text("""
+            CREATE TEMPORARY TABLE cms_partd_metrics (
+                npi VARCHAR(10),
+                claims INTEGER,
+                benes INTEGER,
+                cost DOUBLE PRECISION
+            ) ON COMMIT DROP
+        """))
+        copy_rows(db, "cms_partd_metrics", ["npi", "claims", "benes", "cost"], (
+            (
+                npi,
+                metrics.get("medicare_claims_count"),
+                metrics.get("medicare_beneficiary_count"),
+                metrics.get("medicare_total_cost"),
             )
-            if result.rowcount > 0:
-                updated += 1
-
-            if updated % 10000 == 0 and updated > 0:
-                db.commit()
-
+            for npi, metrics in cms_data.items()
+        ))
+        result = db.execute(text("""
+            UPDATE pharmacies
+            SET medicare_claims_count = m.claims,
+                medicare_beneficiary_count = m.benes,
+                medicare_total_cost = m.cost
+            FROM cms_partd_metrics m
+            WHERE pharmacies.npi = m.npi
+        """))
+        updated = result.rowcount
         db.commit()
         logger.info(f"Medicare enrichment: updated {updated:,} pharmacies")
+        return updated
 
     except Exception as e:
         logger.warning(f"Medicare enrichment failed (non-fatal): {e}")
+        db.rollback()
+        return None
 
 
-def _enrich_geography(db: Session):
-    """Add geographic context data."""
+def _enrich_geography(db: Session, csv_path: str | None) -> int | None:
+    """Add geographic context data. Returns counties loaded, None if skipped or failed."""
+    if not csv_path:
+        return None
     try:
-        county_data = download_geographic_data(settings.DATA_DIR)
+        county_data = parse_geographic_data(csv_path)
         # Geographic enrichment would map ZIP to county and add RUCC codes
         # For now, this is a placeholder that will be enhanced with ZIP-to-FIPS crosswalk
         logger.info(f"Geographic data loaded: {len(county_data)} counties available")
+        return len(county_data)
     except Exception as e:
         logger.warning(f"Geographic enrichment failed (non-fatal): {e}")
+        return None
+
+
+SEARCH_VECTOR_EXPR = """
+    to_tsvector('english',
+        coalesce(organization_name, '') || ' ' ||
+        coalesce(dba_name, '') || ' ' ||
+        coalesce(city, '') || ' ' ||
+        coalesce(state, '') || ' ' ||
+        coalesce(zip, '') || ' ' ||
+        coalesce(county, '') || ' ' ||
+        coalesce(npi, '')
+    )
+"""
 
 
-def _update_search_vectors(db: Session):
-    """Build full-text search vectors for all pharmacies."""
-    db.execute(
-        text("""
-            UPDATE pharmacies SET search_vector =
-                to_tsvector('english',
-                    coalesce(organization_name, '') || ' ' ||
-                    coalesce(dba_name, '') || ' ' ||
-                    coalesce(city, '') || ' ' ||
-                    coalesce(state, '') || ' ' ||
-                    coalesce(zip, '') || ' ' ||
-                    coalesce(county, '') || ' ' ||
-                    coalesce(npi, '')
-                )
-        """)
+def _update_search_vectors(db: Session, npis: set | None = None, since: datetime | None = None) -> int:
+    """
+    Build full-text search vectors for pharmacies: only npis if given, only
+    rows written since a time (plus any still without a vector) if given,
+    otherwise all. Rows whose vector is already current are not rewritten,
+    so the GIN index only sees real changes. Returns rows updated.
+    """
+    conditions = [f"search_vector IS DISTINCT FROM {SEARCH_VECTOR_EXPR}"]
+    params = {}
+    if npis is not None:
+        if not npis:
+            return 0
+        conditions.append("npi = ANY(:npis)")
+        params["npis"] = list(npis)
+    if since is not None:
+        conditions.append("(last_refreshed >= :since OR search_vector IS NULL)")
+        params["since"] = since
+
+    result = db.execute(
+        text(f"UPDATE pharmacies SET search_vector = {SEARCH_VECTOR_EXPR} WHERE {' AND '.join(conditions)}"),
+        params,
     )
     db.commit()
-    logger.info("Search vectors updated")
+    logger.info(f"Search vectors updated for {result.rowcount:,} pharmacies")
+    return result.rowcount
 
 
 if __name__ == "__main__":
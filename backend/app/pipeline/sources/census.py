@@ -5,16 +5,27 @@ Provides county-level and RUCC data for geographic enrichment.
 import os
 import logging
 
+from app.pipeline.sources.download import download_file
+
 logger = logging.getLogger(__name__)
 
 
-def download_geographic_data(data_dir: str) -> dict:
-    """Load geographic reference data. Returns {fips: county_info} dict."""
+def download_county_data(data_dir: str, url: str | None = None) -> str | None:
+    """
+    Download the county reference CSV when url is set. Returns its path,
+    or None if there is no county_data.csv in data_dir.
+    """
     csv_path = os.path.join(data_dir, "county_data.csv")
+    if url:
+        return download_file(url, csv_path)
     if not os.path.exists(csv_path):
         logger.info("No geographic reference data found. Skipping.")
-        return {}
+        return None
+    return csv_path
 
+
+def parse_geographic_data(csv_path: str) -> dict:
+    """Load geographic reference data. Returns {fips: county_info} dict."""
     import pandas as pd
     df = pd.read_csv(csv_path, dtype=str)
     result = {}
@@ -5,34 +5,73 @@ Downloads and parses Medicare Part D prescriber utilization data.
 import os
 import logging
 
+from app.pipeline.sources.download import download_file
+
 logger = logging.getLogger(__name__)
 
+NPI_COLUMN = "Prscrbr_NPI"
+# Part D column -> pharmacy metric
+PARTD_METRICS = {
+    "Tot_Clms": "medicare_claims_count",
+    "Tot_Benes": "medicare_beneficiary_count",
+    "Tot_Drug_Cst": "medicare_total_cost",
+    "Brnd_Tot_Clms": "medicare_brand_claims",
+    "Gnrc_Tot_Clms": "medicare_generic_claims",
+    "Opioid_Tot_Clms": "medicare_opioid_claims",
+    "Antbtc_Tot_Clms": "medicare_antibiotic_claims",
+}
+FLOAT_METRICS = {"medicare_total_cost"}
+CHUNK_SIZE = 100000
+
 
-def download_cms_partd(data_dir: str):
-    """Download CMS Part D data. Returns path or None if unavailable."""
+def download_cms_partd(data_dir: str, url: str | None = None):
+    """
+    Download CMS Part D data. Returns path or None if unavailable.
+    Without a url, only a cms_partd.csv already in data_dir is used.
+    """
     csv_path = os.path.join(data_dir, "cms_partd.csv")
+    if url:
+        return download_file(url, csv_path)
     if os.path.exists(csv_path):
         return csv_path
     logger.info("CMS Part D data not available locally. Skipping Medicare enrichment.")
     return None
 
 
-def parse_cms_partd(csv_path: str) -> dict:
-    """Parse CMS Part D CSV into {npi: metrics} dict."""
+def parse_cms_partd(csv_path: str, npis: set | None = None, chunksize: int = CHUNK_SIZE) -> dict:
+    """
+    Parse CMS Part D CSV into {npi: metrics} dict.
+
+    Reads chunksize rows at a time and only the PARTD_METRICS columns, so
+    memory is bounded by the chunk rather than the file. Pass npis to keep
+    only those prescribers (the pharmacies); the file covers every Part D
+    prescriber. Blank or non-numeric values count as 0.
+    """
     import pandas as pd
 
     try:
-        df = pd.read_csv(csv_path, dtype=str, low_memory=False)
+        reader = pd.read_csv(
+            csv_path, dtype=str, chunksize=chunksize,
+            usecols=lambda column: column == NPI_COLUMN or column in PARTD_METRICS,
+        )
         result = {}
-        for _, row in df.iterrows():
-            npi = str(row.get("Prscrbr_NPI", "") or "").strip()
-            if not npi:
+        for chunk in reader:
+            npi = chunk[NPI_COLUMN].str.strip()
+            keep = npi.notna() & (npi != "")
+            if npis is not None:
+                keep &= npi.isin(npis)
+            if not keep.any():
                 continue
-            result[npi] = {
-                "medicare_claims_count": int(float(row.get("Tot_Clms", 0) or 0)),
-                "medicare_beneficiary_count": int(float(row.get("Tot_Benes", 0) or 0)),
-                "medicare_total_cost": float(row.get("Tot_Drug_Cst", 0) or 0),
-            }
+
+            metrics = pd.DataFrame(index=npi[keep])
+            for column, field in PARTD_METRICS.items():
+                if column not in chunk:
+                    continue
+                values = pd.to_numeric(chunk.loc[keep, column], errors="coerce").fillna(0).to_numpy()
+                metrics[field] = values if field in FLOAT_METRICS else values.astype("int64")
+            # A repeated NPI keeps its last row
+            metrics = metrics[~metrics.index.duplicated(keep="last")]
+            result.update(metrics.to_dict("index"))
         return result
     except Exception as e:
         logger.warning(f"Failed to parse CMS data: {e}")
@@ -0,0 +1,209 @@
+"""
+Download manager for large bulk files (NPPES, CMS Part D, Census).
+
+Files are fetched with concurrent HTTP range requests into a `.part` file.
+A sidecar `<file>.manifest.json` records the remote validators (ETag,
+Last-Modified, size) and which pieces are on disk, so an interrupted
+download resumes where it stopped. Once complete, the manifest keeps the
+validators and SHA-256, and later calls skip the download while the remote
+copy is unchanged. Servers without range support get a single stream. A
+range request that fails with a 429/5xx status or a dropped connection is
+retried with exponential backoff before the download gives up.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+PIECE_SIZE = 16 * 1024 * 1024
+DEFAULT_SEGMENTS = 4
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+
+
+class DownloadError(RuntimeError):
+    pass
+
+
+class _RetryableError(DownloadError):
+    """A range request failure worth retrying."""
+
+
+def download_file(url: str, dest: str, segments: int = DEFAULT_SEGMENTS, sha256: str | None = None,
+                  piece_size: int = PIECE_SIZE, client: httpx.Client | None = None,
+                  timeout: float = 300) -> str:
+    """
+    Download url to dest and return dest.
+
+    segments is the number of concurrent range requests. sha256, if given,
+    must match the finished file. A dest that exists without a manifest was
+    put there by hand and is used as is. Pass client to reuse a connection
+    pool or to point at a stand-in server.
+    """
+    own_client = client is None
+    if own_client:
+        client = httpx.Client(follow_redirects=True, timeout=timeout)
+    try:
+        return _download(client, url, dest, segments, sha256, piece_size)
+    finally:
+        if own_client:
+            client.close()
+
+
+def _download(client: httpx.Client, url: str, dest: str, segments: int, sha256: str | None,
+              piece_size: int) -> str:
+    manifest_path = dest + ".manifest.json"
+    part_path = dest + ".part"
+    manifest = _load_manifest(manifest_path)
+
+    if os.path.exists(dest) and manifest is None:
+        logger.info(f"Using existing file: {dest}")
+        return dest
+
+    try:
+        head = client.head(url)
+        head.raise_for_status()
+    except httpx.HTTPError as e:
+        if os.path.exists(dest):
+            logger.warning(f"Could not check {url} ({e}); using existing {dest}")
+            return dest
+        raise
+
+    remote = {
+        "url": url,
+        "etag": head.headers.get("etag"),
+        "last_modified": head.headers.get("last-modified"),
+        "size": int(head.headers["content-length"]) if "content-length" in head.headers else None,
+    }
+    unchanged = manifest is not None and _same_remote(manifest, remote)
+
+    if unchanged and manifest.get("complete") and os.path.exists(dest):
+        if os.path.getsize(dest) == manifest["size"]:
+            logger.info(f"Remote unchanged, skipping download: {dest}")
+            return dest
+
+    ranged = remote["size"] is not None and head.headers.get("accept-ranges") == "bytes"
+    if not ranged:
+        logger.info(f"Downloading {url} (single stream, server doesn't support ranges)")
+        _stream(client, url, part_path)
+    else:
+        if not (unchanged and os.path.exists(part_path) and not manifest.get("complete")):
+            manifest = dict(remote, complete=False, pieces_done=[])
+            with open(part_path, "wb") as f:
+                f.truncate(remote["size"])
+        _fetch_pieces(client, url, part_path, manifest, manifest_path, segments, piece_size)
+
+    size = os.path.getsize(part_path)
+    if remote["size"] is not None and size != remote["size"]:
+        raise DownloadError(f"Size mismatch for {url}: expected {remote['size']}, got {size}")
+    digest = _sha256(part_path)
+    if sha256 and digest != sha256.lower():
+        os.remove(part_path)
+        raise DownloadError(f"Checksum mismatch for {url}: expected {sha256}, got {digest}")
+
+    os.replace(part_path, dest)
+    _save_manifest(manifest_path, dict(remote, size=size, sha256=digest, complete=True))
+    logger.info(f"Downloaded {size / 1024 / 1024:.0f}MB: {dest}")
+    return dest
+
+
+def _fetch_pieces(client: httpx.Client, url: str, part_path: str, manifest: dict, manifest_path: str,
+                  segments: int, piece_size: int):
+    """Download the pieces not yet marked done, segments at a time."""
+    size = manifest["size"]
+    done = set(manifest["pieces_done"])
+    pending = [i for i in range(-(-size // piece_size)) if i not in done]
+    if done:
+        logger.info(f"Resuming {url}: {len(done)} of {len(done) + len(pending)} pieces on disk")
+    else:
+        logger.info(f"Downloading {url} ({size / 1024 / 1024:.0f}MB, {segments} segments)")
+
+    lock = threading.Lock()
+
+    def fetch(i: int):
+        start = i * piece_size
+        end = min(start + piece_size, size) - 1
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                _fetch_piece(client, url, part_path, start, end)
+                break
+            except (httpx.TransportError, _RetryableError) as e:
+                if attempt == MAX_RETRIES:
+                    raise DownloadError(f"{url} bytes {start}-{end} failed after {attempt + 1} attempts: {e}") from e
+                delay = BACKOFF_BASE * 2 ** attempt
+                logger.warning(f"{url} bytes {start}-{end} failed ({e}); retrying in {delay:.0f}s")
+                time.sleep(delay)
+        with lock:
+            done.add(i)
+            manifest["pieces_done"] = sorted(done)
+            _save_manifest(manifest_path, manifest)
+            if len(done) % 10 == 0:
+                logger.info(f"  Downloaded {len(done) * piece_size / 1024 / 1024:.0f}MB / {size / 1024 / 1024:.0f}MB")
+
+    with ThreadPoolExecutor(max_workers=max(1, segments)) as pool:
+        for _ in pool.map(fetch, pending):
+            pass
+
+
+def _fetch_piece(client: httpx.Client, url: str, part_path: str, start: int, end: int):
+    """Write bytes start..end (inclusive) of url into part_path at the same offset."""
+    with client.stream("GET", url, headers={"Range": f"bytes={start}-{end}"}) as resp:
+        if resp.status_code in RETRY_STATUSES:
+            raise _RetryableError(f"Range request for {url} returned {resp.status_code}")
+        if resp.status_code != 206:
+            raise DownloadError(f"Range request for {url} returned {resp.status_code}")
+        with open(part_path, "r+b") as f:
+            f.seek(start)
+            for chunk in resp.iter_bytes(chunk_size=1024 * 1024):
+                f.write(chunk)
+            if f.tell() != end + 1:
+                raise _RetryableError(f"Short read for {url} bytes {start}-{end}")
+
+
+def _stream(client: httpx.Client, url: str, path: str):
+    with client.stream("GET", url) as resp:
+        resp.raise_for_status()
+        with open(path, "wb") as f:
+            for chunk in resp.iter_bytes(chunk_size=1024 * 1024):
+                f.write(chunk)
+
+
+def _same_remote(manifest: dict, remote: dict) -> bool:
+    """True when the remote file is the one the manifest describes."""
+    if manifest.get("url") != remote["url"] or manifest.get("size") != remote["size"]:
+        return False
+    if remote["etag"] or manifest.get("etag"):
+        return manifest.get("etag") == remote["etag"]
+    return bool(remote["last_modified"]) and manifest.get("last_modified") == remote["last_modified"]
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(8 * 1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _load_manifest(path: str) -> dict | None:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_manifest(path: str, manifest: dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
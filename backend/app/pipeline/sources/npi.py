@@ -2,142 +2,244 @@
 NPI data source — downloads and parses the NPPES NPI registry.
 Filters for pharmacy taxonomy codes only.
 """
+import io
 import os
+import re
 import logging
 import zipfile
 import glob
+from contextlib import contextmanager
+from datetime import datetime, date
 import pandas as pd
 
+from app.pipeline.nppes_scan import PHARMACY_TAXONOMIES, BLOCK_SIZE, prefilter_records, count_records
+from app.pipeline.sources.download import download_file, DEFAULT_SEGMENTS
+
 logger = logging.getLogger(__name__)
 
 NPPES_FULL_URL = "https://download.cms.gov/nppes/NPPES_Data_Dissemination_January_2024.zip"
 
-# Pharmacy taxonomy codes
-PHARMACY_TAXONOMIES = {
-    "183500000X",  # Pharmacist
-    "3336C0002X",  # Community/Retail Pharmacy
-    "3336C0003X",  # Compounding Pharmacy
-    "3336C0004X",  # Long Term Care Pharmacy
-    "3336H0001X",  # Home Infusion Therapy Pharmacy
-    "3336I0012X",  # Institutional Pharmacy
-    "3336L0003X",  # Mail Order Pharmacy
-    "3336M0002X",  # Military/U.S. Coast Guard Pharmacy
-    "3336M0003X",  # Managed Care Organization Pharmacy
-    "3336N0007X",  # Nuclear Pharmacy
-    "3336S0011X",  # Specialty Pharmacy
-    "333600000X",  # Pharmacy
-}
-
-
-def download_nppes(data_dir: str) -> str:
-    """Download the NPPES full data file. Returns path to the CSV."""
+
+def download_nppes(data_dir: str, keep_csv: bool = False, segments: int = DEFAULT_SEGMENTS) -> str:
+    """
+    Download the NPPES full data file. Returns the path to parse: the
+    dissemination ZIP itself, which parse_nppes() streams without
+    extracting, or the extracted CSV when keep_csv is set (or one is
+    already on disk). The ZIP is fetched in segments parallel range
+    requests and is only downloaded again when the remote file changes.
+    """
     os.makedirs(data_dir, exist_ok=True)
     zip_path = os.path.join(data_dir, "nppes_full.zip")
     csv_pattern = os.path.join(data_dir, "npidata_pfile_*.csv")
 
     # Check if CSV already exists
-    existing = glob.glob(csv_pattern)
+    existing = [p for p in glob.glob(csv_pattern) if "fileheader" not in p]
     if existing:
         logger.info(f"Using existing NPPES CSV: {existing[0]}")
         return existing[0]
 
-    # Download
-    import httpx
-    logger.info(f"Downloading NPPES data from {NPPES_FULL_URL}")
-    logger.info("This is a large file (~700MB) and may take 30-60 minutes...")
-
-    with httpx.stream("GET", NPPES_FULL_URL, follow_redirects=True, timeout=3600) as resp:
-        resp.raise_for_status()
-        total = int(resp.headers.get("content-length", 0))
-        downloaded = 0
-        with open(zip_path, "wb") as f:
-            for chunk in resp.iter_bytes(chunk_size=1024 * 1024):
-                f.write(chunk)
-                downloaded += len(chunk)
-                if total:
-                    pct = downloaded / total * 100
-                    if downloaded % (50 * 1024 * 1024) < 1024 * 1024:
-                        logger.info(f"  Downloaded {downloaded / 1024 / 1024:.0f}MB / {total / 1024 / 1024:.0f}MB ({pct:.1f}%)")
+    download_file(NPPES_FULL_URL, zip_path, segments=segments)
+
+    if not keep_csv:
+        return zip_path
 
     # Extract
     logger.info("Extracting NPPES ZIP...")
     with zipfile.ZipFile(zip_path, "r") as z:
-        for name in z.namelist():
-            if name.startswith("npidata_pfile_") and name.endswith(".csv"):
-                z.extract(name, data_dir)
-                csv_path = os.path.join(data_dir, name)
-                logger.info(f"Extracted: {csv_path}")
-                return csv_path
-
+        name = _nppes_member(z)
+        z.extract(name, data_dir)
+        csv_path = os.path.join(data_dir, name)
+        logger.info(f"Extracted: {csv_path}")
+        return csv_path
+
+
+def _nppes_member(z: zipfile.ZipFile) -> str:
+    """Name of the main npidata CSV inside a dissemination ZIP."""
+    for name in z.namelist():
+        if name.startswith("npidata_pfile_") and name.endswith(".csv") and "fileheader" not in name:
+            return name
     raise RuntimeError("No NPI data CSV found in ZIP archive")
 
 
-def parse_nppes(csv_path: str, chunk_size: int = 10000):
+@contextmanager
+def open_nppes(path: str):
+    """Open an NPPES CSV, or the CSV member of a dissemination ZIP as a decompressing stream."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as z, z.open(_nppes_member(z)) as f:
+            yield f
+    else:
+        with open(path, "rb") as f:
+            yield f
+
+
+NPPES_COLUMNS = [
+    "NPI", "Entity Type Code", "Provider Organization Name (Legal Business Name)",
+    "Provider Other Organization Name", "Provider Other Organization Name Type Code",
+    "Provider First Line Business Practice Location Address",
+    "Provider Second Line Business Practice Location Address",
+    "Provider Business Practice Location Address City Name",
+    "Provider Business Practice Location Address State Name",
+    "Provider Business Practice Location Address Postal Code",
+    "Provider Business Practice Location Address Telephone Number",
+    "Provider Business Practice Location Address Fax Number",
+    "Healthcare Provider Taxonomy Code_1",
+    "Healthcare Provider Taxonomy Code_2",
+    "Healthcare Provider Taxonomy Code_3",
+    "Authorized Official Last Name",
+    "Authorized Official First Name",
+    "Authorized Official Title or Position",
+    "Authorized Official Telephone Number",
+]
+
+
+def parse_nppes(csv_path: str, start: int = 0, block_size: int = BLOCK_SIZE):
     """
-    Parse the NPPES CSV, yielding chunks of pharmacy records.
-    Filters for pharmacy taxonomy codes.
+    Parse the NPPES CSV (or dissemination ZIP) block by block, yielding
+    (offset, records): the pharmacy records of each block and the byte
+    offset in the CSV just past it. Parsing can resume from any yielded
+    offset via start; in a ZIP, seeking there decompresses without parsing.
+    Filters for pharmacy taxonomy codes: a byte-level prefilter drops lines
+    without any pharmacy code before pandas tokenizes them.
     """
     logger.info(f"Parsing NPPES CSV: {csv_path}")
 
-    cols = [
-        "NPI", "Entity Type Code", "Provider Organization Name (Legal Business Name)",
-        "Provider Other Organization Name", "Provider Other Organization Name Type Code",
-        "Provider First Line Business Practice Location Address",
-        "Provider Second Line Business Practice Location Address",
-        "Provider Business Practice Location Address City Name",
-        "Provider Business Practice Location Address State Name",
-        "Provider Business Practice Location Address Postal Code",
-        "Provider Business Practice Location Address Telephone Number",
-        "Provider Business Practice Location Address Fax Number",
-        "Healthcare Provider Taxonomy Code_1",
-        "Healthcare Provider Taxonomy Code_2",
-        "Healthcare Provider Taxonomy Code_3",
-        "Authorized Official Last Name",
-        "Authorized Official First Name",
-        "Authorized Official Title or Position",
-        "Authorized Official Telephone Number",
-    ]
-
-    for chunk in pd.read_csv(csv_path, usecols=cols, chunksize=chunk_size, low_memory=False, dtype=str):
-        records = []
-        for _, row in chunk.iterrows():
-            # Check if any taxonomy code is pharmacy
-            taxos = [
-                str(row.get("Healthcare Provider Taxonomy Code_1", "") or "").strip(),
-                str(row.get("Healthcare Provider Taxonomy Code_2", "") or "").strip(),
-                str(row.get("Healthcare Provider Taxonomy Code_3", "") or "").strip(),
-            ]
-            matching = [t for t in taxos if t in PHARMACY_TAXONOMIES]
-            if not matching:
-                continue
-
-            # Only organizations (entity type 2)
-            if str(row.get("Entity Type Code", "")).strip() != "2":
-                continue
-
-            auth_first = str(row.get("Authorized Official First Name", "") or "").strip()
-            auth_last = str(row.get("Authorized Official Last Name", "") or "").strip()
-            auth_name = f"{auth_first} {auth_last}".strip() if auth_first or auth_last else None
-
-            record = {
-                "npi": str(row["NPI"]).strip(),
-                "organization_name": str(row.get("Provider Organization Name (Legal Business Name)", "") or "").strip() or None,
-                "dba_name": str(row.get("Provider Other Organization Name", "") or "").strip() or None,
-                "entity_type": "organization",
-                "address_line1": str(row.get("Provider First Line Business Practice Location Address", "") or "").strip() or None,
-                "address_line2": str(row.get("Provider Second Line Business Practice Location Address", "") or "").strip() or None,
-                "city": str(row.get("Provider Business Practice Location Address City Name", "") or "").strip() or None,
-                "state": str(row.get("Provider Business Practice Location Address State Name", "") or "").strip() or None,
-                "zip": str(row.get("Provider Business Practice Location Address Postal Code", "") or "").strip()[:5] or None,
-                "phone": str(row.get("Provider Business Practice Location Address Telephone Number", "") or "").strip() or None,
-                "fax": str(row.get("Provider Business Practice Location Address Fax Number", "") or "").strip() or None,
-                "taxonomy_code": matching[0],
-                "authorized_official_name": auth_name,
-                "authorized_official_title": str(row.get("Authorized Official Title or Position", "") or "").strip() or None,
-                "authorized_official_phone": str(row.get("Authorized Official Telephone Number", "") or "").strip() or None,
-            }
-            records.append(record)
-
-        if records:
-            logger.info(f"  Parsed chunk: {len(records)} pharmacy records from {len(chunk)} total rows")
-            yield records
+    with open_nppes(csv_path) as raw:
+        header = raw.readline()
+        offset = max(start, len(header))
+        raw.seek(offset)
+        carry = b""
+        rows_scanned = 0
+        while True:
+            block = raw.read(block_size)
+            if not block:
+                break
+            data = carry + block
+            kept, consumed = prefilter_records(data)
+            rows_scanned += count_records(data, consumed)
+            carry = data[consumed:]
+            offset += consumed
+            records = _parse_kept(header, kept)
+            logger.info(f"  Parsed block: {len(records)} pharmacy records ({rows_scanned:,} rows scanned)")
+            yield offset, records
+        if carry.strip():
+            if not carry.endswith(b"\n"):
+                carry += b"\n"
+            kept, _ = prefilter_records(carry)
+            yield offset + len(carry), _parse_kept(header, kept)
+
+
+def parse_nppes_range(csv_path: str, header: bytes, start: int, end: int) -> list:
+    """Parse pharmacy records from one record-aligned byte range of the CSV."""
+    with open(csv_path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    if not data.endswith(b"\n"):
+        data += b"\n"
+    kept, _ = prefilter_records(data)
+    return _parse_kept(header, kept)
+
+
+def _parse_kept(header: bytes, kept: bytes) -> list:
+    """Pharmacy records from prefiltered CSV bytes."""
+    if not kept:
+        return []
+    chunk = pd.read_csv(io.BytesIO(header + kept), usecols=NPPES_COLUMNS, low_memory=False, dtype=str)
+    return _records_from_chunk(chunk)
+
+
+DEACTIVATION_DATE_COLUMN = "NPI Deactivation Date"
+WEEKLY_FILE_PATTERN = "NPPES_Data_Dissemination_*_Weekly*.zip"
+WEEKLY_PERIOD = re.compile(r"_(\d{6})_(\d{6})_Weekly")
+
+
+def find_nppes_updates(data_dir: str) -> list[str]:
+    """
+    Weekly NPPES update ZIPs in data_dir, oldest first. Files are named
+    NPPES_Data_Dissemination_MMDDYY_MMDDYY_Weekly.zip; the period end date
+    orders them (the names themselves don't sort across years).
+    """
+    def period_end(path: str):
+        match = WEEKLY_PERIOD.search(os.path.basename(path))
+        if not match:
+            return (datetime.fromtimestamp(os.path.getmtime(path)).date(), path)
+        return (datetime.strptime(match.group(2), "%m%d%y").date(), path)
+
+    return sorted(glob.glob(os.path.join(data_dir, WEEKLY_FILE_PATTERN)), key=period_end)
+
+
+def parse_nppes_updates(path: str, known_npis: set, chunk_size: int = 50000) -> tuple[list, dict]:
+    """
+    Parse a weekly NPPES update file (ZIP or CSV).
+
+    Returns (records, deactivations): pharmacy records in the same shape as
+    parse_nppes(), and {npi: deactivation date} for NPIs in known_npis.
+    Deactivated NPIs are published without taxonomy codes, so the byte
+    prefilter can't be used here; update files are small enough to parse whole.
+    """
+    logger.info(f"Parsing NPPES update file: {path}")
+    records = []
+    deactivations = {}
+
+    with open_nppes(path) as raw:
+        for chunk in pd.read_csv(raw, usecols=NPPES_COLUMNS + [DEACTIVATION_DATE_COLUMN],
+                                 chunksize=chunk_size, low_memory=False, dtype=str):
+            records.extend(_records_from_chunk(chunk))
+            deactivated = chunk[chunk[DEACTIVATION_DATE_COLUMN].notna()]
+            for npi, value in zip(deactivated["NPI"].str.strip(), deactivated[DEACTIVATION_DATE_COLUMN]):
+                if npi in known_npis:
+                    deactivated_on = _parse_nppes_date(value)
+                    if deactivated_on:
+                        deactivations[npi] = deactivated_on
+
+    logger.info(f"  {len(records):,} pharmacy records, {len(deactivations):,} deactivations")
+    return records, deactivations
+
+
+def _parse_nppes_date(value: str) -> date | None:
+    try:
+        return datetime.strptime(value.strip(), "%m/%d/%Y").date()
+    except ValueError:
+        return None
+
+
+def _records_from_chunk(chunk) -> list:
+    """Pharmacy organization records from a parsed NPPES DataFrame chunk."""
+    records = []
+    for _, row in chunk.iterrows():
+        # Check if any taxonomy code is pharmacy
+        taxos = [
+            str(row.get("Healthcare Provider Taxonomy Code_1", "") or "").strip(),
+            str(row.get("Healthcare Provider Taxonomy Code_2", "") or "").strip(),
+            str(row.get("Healthcare Provider Taxonomy Code_3", "") or "").strip(),
+        ]
+        matching = [t for t in taxos if t in PHARMACY_TAXONOMIES]
+        if not matching:
+            continue
+
+        # Only organizations (entity type 2)
+        if str(row.get("Entity Type Code", "")).strip() != "2":
+            continue
+
+        auth_first = str(row.get("Authorized Official First Name", "") or "").strip()
+        auth_last = str(row.get("Authorized Official Last Name", "") or "").strip()
+        auth_name = f"{auth_first} {auth_last}".strip() if auth_first or auth_last else None
+
+        record = {
+            "npi": str(row["NPI"]).strip(),
+            "organization_name": str(row.get("Provider Organization Name (Legal Business Name)", "") or "").strip() or None,
+            "dba_name": str(row.get("Provider Other Organization Name", "") or "").strip() or None,
+            "entity_type": "organization",
+            "address_line1": str(row.get("Provider First Line Business Practice Location Address", "") or "").strip() or None,
+            "address_line2": str(row.get("Provider Second Line Business Practice Location Address", "") or "").strip() or None,
+            "city": str(row.get("Provider Business Practice Location Address City Name", "") or "").strip() or None,
+            "state": str(row.get("Provider Business Practice Location Address State Name", "") or "").strip() or None,
+            "zip": str(row.get("Provider Business Practice Location Address Postal Code", "") or "").strip()[:5] or None,
+            "phone": str(row.get("Provider Business Practice Location Address Telephone Number", "") or "").strip() or None,
+            "fax": str(row.get("Provider Business Practice Location Address Fax Number", "") or "").strip() or None,
+            "taxonomy_code": matching[0],
+            "authorized_official_name": auth_name,
+            "authorized_official_title": str(row.get("Authorized Official Title or Position", "") or "").strip() or None,
+            "authorized_official_phone": str(row.get("Authorized Official Telephone Number", "") or "").strip() or None,
+        }
+        records.append(record)
+    return records
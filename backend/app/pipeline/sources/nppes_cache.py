@@ -0,0 +1,53 @@
+"""
+Columnar cache of the NPPES pharmacy subset.
+
+The first scan of an NPPES release writes the raw (pre-normalization)
+pharmacy records to a Parquet file keyed by the source fingerprint, so
+re-runs against the same release — including after a classification or
+normalization rule change — skip the 10GB scan.
+"""
+import glob
+import hashlib
+import logging
+import os
+
+import pandas as pd
+
+from app.pipeline.fingerprint import file_fingerprint
+from app.pipeline.sources.npi import NPPES_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+
+def cache_path(cache_dir: str, source_path: str) -> str:
+    """Cache file for a source, keyed by its fingerprint and the projected columns."""
+    key = hashlib.sha256(f"{file_fingerprint(source_path)}|{'|'.join(NPPES_COLUMNS)}".encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"nppes_pharmacies_{key}.parquet")
+
+
+def has_cached_records(cache_dir: str, source_path: str) -> bool:
+    """Whether this NPPES release's pharmacy records are cached."""
+    return os.path.exists(cache_path(cache_dir, source_path))
+
+
+def load_cached_records(cache_dir: str, source_path: str) -> list | None:
+    """Raw pharmacy records for this NPPES release, or None on a cache miss."""
+    path = cache_path(cache_dir, source_path)
+    if not os.path.exists(path):
+        return None
+    df = pd.read_parquet(path)
+    df = df.astype(object).where(df.notna(), None)
+    logger.info(f"Loaded {len(df):,} pharmacy records from cache: {path}")
+    return df.to_dict("records")
+
+
+def save_cached_records(cache_dir: str, source_path: str, records: list):
+    """Write the raw pharmacy records for this release, replacing older caches."""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(cache_dir, source_path)
+    for old in glob.glob(os.path.join(cache_dir, "nppes_pharmacies_*.parquet")):
+        os.remove(old)
+    tmp = path + ".tmp"
+    pd.DataFrame(records).to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+    logger.info(f"Cached {len(records):,} pharmacy records: {path}")
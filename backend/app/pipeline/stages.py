@@ -0,0 +1,69 @@
+"""
+Stage bookkeeping — lets a pipeline run skip stages whose inputs haven't changed.
+
+Each stage has a key: a hash of its input file fingerprints and the keys of
+the stages it reads from. When a stage finishes, its key and row count are
+stored in pipeline_stages; a later run whose key for that stage is the same
+skips it.
+"""
+import hashlib
+import logging
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models import PipelineStage
+
+logger = logging.getLogger(__name__)
+
+
+def stage_key(*inputs) -> str:
+    """Combine input fingerprints / upstream stage keys into one key (None for a missing input)."""
+    return hashlib.sha256("|".join(str(i) for i in inputs).encode()).hexdigest()[:16]
+
+
+def _stage(db: Session, name: str) -> PipelineStage | None:
+    return db.scalars(select(PipelineStage).where(PipelineStage.stage == name)).first()
+
+
+def stage_is_current(db: Session, name: str, key: str) -> bool:
+    """True if the stage last completed with this key."""
+    stage = _stage(db, name)
+    return stage is not None and stage.input_fingerprint == key
+
+
+def stage_run_id(db: Session, name: str) -> int | None:
+    """Id of the pipeline run that last completed the stage."""
+    stage = _stage(db, name)
+    return stage.run_id if stage else None
+
+
+def record_stage(db: Session, name: str, key: str, rows_affected: int, run_id: int | None = None):
+    """Store the key and output row count of a completed stage."""
+    stage = _stage(db, name)
+    if stage is None:
+        stage = PipelineStage(stage=name)
+        db.add(stage)
+    stage.input_fingerprint = key
+    stage.rows_affected = rows_affected
+    stage.run_id = run_id
+    stage.completed_at = datetime.utcnow()
+    db.commit()
+
+
+def run_stage(db: Session, name: str, key: str, fn, run_id: int | None = None, force: bool = False) -> bool:
+    """
+    Run fn(db) unless the stage is current. fn returns the rows it affected,
+    or None if it didn't complete (a non-fatal failure or missing input),
+    in which case the stage is not recorded and runs again next time.
+    Returns whether fn ran.
+    """
+    if not force and stage_is_current(db, name, key):
+        stage = _stage(db, name)
+        logger.info(f"  Inputs unchanged since {stage.completed_at:%Y-%m-%d %H:%M}, skipping ({stage.rows_affected:,} rows then)")
+        return False
+    rows = fn(db)
+    if rows is not None:
+        record_stage(db, name, key, rows, run_id)
+    return True
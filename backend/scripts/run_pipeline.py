@@ -1,10 +1,27 @@
 #!/usr/bin/env python3
 """Script to manually run the data pipeline."""
+import argparse
 import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
-from app.pipeline.orchestrator import run_pipeline
+from app.pipeline.orchestrator import run_pipeline, run_incremental
 
 if __name__ == "__main__":
-    run_pipeline()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="NPPES parser processes (default: PIPELINE_WORKERS setting)")
+    parser.add_argument("--refresh-cache", action="store_true",
+                        help="rescan NPPES even if its pharmacy subset is cached")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted full run from its last checkpoint")
+    parser.add_argument("--force", action="store_true",
+                        help="run every stage even if its inputs are unchanged")
+    parser.add_argument("--incremental", action="store_true",
+                        help="apply new NPPES weekly update files instead of a full run")
+    args = parser.parse_args()
+    if args.incremental:
+        run_incremental()
+    else:
+        run_pipeline(workers=args.workers, refresh_cache=args.refresh_cache, resume=args.resume,
+                     force=args.force)
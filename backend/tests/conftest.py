@@ -0,0 +1,37 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# Import the backend as the app package, as the Docker image does
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+SCHEMA = "pipeline_test"
+
+
+@pytest.fixture
+def pg_engine():
+    """
+    An engine on a scratch schema of TEST_DATABASE_URL holding the app's
+    tables. Modules using it skip themselves when that isn't set.
+    """
+    from sqlalchemy import create_engine, text
+    from app.database import Base, add_missing_columns
+    import app.models  # noqa: F401 (registers the tables)
+
+    url = os.environ["TEST_DATABASE_URL"]
+    admin = create_engine(url)
+    with admin.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    # Unqualified names (the pipeline's raw SQL included) resolve to the scratch schema
+    engine = create_engine(url, connect_args={"options": f"-csearch_path={SCHEMA}"})
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        add_missing_columns(conn)
+    yield engine
+    engine.dispose()
+    with admin.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+    admin.dispose()
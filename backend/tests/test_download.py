@@ -0,0 +1,150 @@
+"""Download manager against an in-process stand-in server (httpx.MockTransport)."""
+import hashlib
+import json
+import os
+
+import httpx
+import pytest
+
+from app.pipeline.sources import download
+from app.pipeline.sources.download import DownloadError, download_file
+
+PIECE = 1024
+URL = "https://example.test/nppes.zip"
+
+
+class RangeServer:
+    """Serves body with ETag and Range support; fail(request) may return a Response or raise to inject faults."""
+
+    def __init__(self, body: bytes, etag: str = '"v1"', fail=None):
+        self.body = body
+        self.etag = etag
+        self.fail = fail
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append((request.method, request.headers.get("range")))
+        if self.fail:
+            injected = self.fail(request)
+            if injected is not None:
+                return injected
+        headers = {"etag": self.etag, "accept-ranges": "bytes"}
+        if request.method == "HEAD":
+            return httpx.Response(200, headers={**headers, "content-length": str(len(self.body))})
+        start, end = map(int, request.headers["range"].removeprefix("bytes=").split("-"))
+        return httpx.Response(206, headers=headers, content=self.body[start:end + 1])
+
+    def client(self) -> httpx.Client:
+        return httpx.Client(transport=httpx.MockTransport(self))
+
+    def ranges(self) -> list:
+        return sorted(r for method, r in self.requests if method == "GET")
+
+
+def failing(ranges: set, response=None):
+    """A fault injector for requests on the given Range headers."""
+    def fail(request):
+        if request.headers.get("range") in ranges:
+            if response is None:
+                raise httpx.ReadError("connection reset", request=request)
+            return response
+    return fail
+
+
+@pytest.fixture
+def body():
+    return os.urandom(PIECE * 10 + 100)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(download, "BACKOFF_BASE", 0)
+
+
+def fetch(server, dest, **kwargs):
+    return download_file(URL, str(dest), client=server.client(), piece_size=PIECE, **kwargs)
+
+
+def test_segmented_download(tmp_path, body):
+    dest = tmp_path / "nppes.zip"
+    server = RangeServer(body)
+    fetch(server, dest, segments=3, sha256=hashlib.sha256(body).hexdigest())
+
+    assert dest.read_bytes() == body
+    assert len(server.ranges()) == 11
+    manifest = json.loads((tmp_path / "nppes.zip.manifest.json").read_text())
+    assert manifest["complete"] and manifest["etag"] == '"v1"'
+
+
+def test_transient_range_failures_are_retried(tmp_path, body):
+    dest = tmp_path / "nppes.zip"
+    flaky = {"bytes=1024-2047", "bytes=4096-5119"}
+
+    def fail(request):
+        # Each flaky range fails once, first with a 503, then with a dropped connection
+        rng = request.headers.get("range")
+        if rng in flaky:
+            flaky.discard(rng)
+            if rng == "bytes=1024-2047":
+                return httpx.Response(503)
+            raise httpx.ReadError("connection reset", request=request)
+
+    server = RangeServer(body, fail=fail)
+    fetch(server, dest)
+
+    assert dest.read_bytes() == body
+    assert server.ranges().count("bytes=1024-2047") == 2
+    assert server.ranges().count("bytes=4096-5119") == 2
+
+
+def test_interrupted_download_resumes(tmp_path, body, monkeypatch):
+    dest = tmp_path / "nppes.zip"
+    monkeypatch.setattr(download, "MAX_RETRIES", 1)
+    broken = RangeServer(body, fail=failing({"bytes=5120-6143"}, httpx.Response(500)))
+    with pytest.raises(DownloadError):
+        fetch(broken, dest, segments=1)
+    assert not dest.exists()
+    done = json.loads((tmp_path / "nppes.zip.manifest.json").read_text())["pieces_done"]
+    assert 5 not in done and done
+
+    server = RangeServer(body)
+    fetch(server, dest, segments=1)
+
+    assert dest.read_bytes() == body
+    fetched = {int(r.split("=")[1].split("-")[0]) // PIECE for r in server.ranges()}
+    assert fetched == set(range(11)) - set(done)
+
+
+def test_changed_etag_restarts_partial_download(tmp_path, body, monkeypatch):
+    dest = tmp_path / "nppes.zip"
+    monkeypatch.setattr(download, "MAX_RETRIES", 0)
+    with pytest.raises(DownloadError):
+        fetch(RangeServer(body, fail=failing({"bytes=5120-6143"})), dest, segments=1)
+
+    new_body = os.urandom(len(body))
+    server = RangeServer(new_body, etag='"v2"')
+    fetch(server, dest)
+
+    assert dest.read_bytes() == new_body
+    assert len(server.ranges()) == 11
+
+
+def test_unchanged_etag_skips_download(tmp_path, body):
+    dest = tmp_path / "nppes.zip"
+    fetch(RangeServer(body), dest)
+
+    server = RangeServer(body)
+    fetch(server, dest)
+    assert server.requests == [("HEAD", None)]
+
+    changed = RangeServer(body[::-1], etag='"v2"')
+    fetch(changed, dest)
+    assert dest.read_bytes() == body[::-1]
+
+
+def test_sha256_mismatch_raises(tmp_path, body):
+    dest = tmp_path / "nppes.zip"
+    with pytest.raises(DownloadError, match="Checksum mismatch"):
+        fetch(RangeServer(body), dest, sha256="0" * 64)
+    assert not dest.exists()
+    assert not (tmp_path / "nppes.zip.part").exists()
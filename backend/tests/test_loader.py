@@ -0,0 +1,41 @@
+"""Both LOADERS against a real Postgres; set TEST_DATABASE_URL (a postgresql:// URL) to run."""
+import os
+
+import pytest
+
+if not os.environ.get("TEST_DATABASE_URL"):
+    pytest.skip("TEST_DATABASE_URL is not set", allow_module_level=True)
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.pipeline.loader import LOADERS
+
+RECORDS = [
+    {"npi": "1000000001", "organization_name": "MAIN STREET PHARMACY", "city": "AKRON", "state": "OH", "zip": "44301"},
+    {"npi": "1000000002", "organization_name": "RIVERSIDE DRUG", "city": "DAYTON", "state": "OH", "zip": "45402"},
+    {"npi": "1000000003", "organization_name": "HILLTOP APOTHECARY", "city": None, "state": "OH", "zip": "43004"},
+]
+
+
+def load(engine, loader, records):
+    with Session(engine) as db:
+        result = LOADERS[loader](db, [dict(r) for r in records])
+        db.commit()
+    return result
+
+
+@pytest.mark.parametrize("loader", sorted(LOADERS))
+def test_loader_reports_inserted_updated_and_skips_unchanged(pg_engine, loader):
+    npis = {r["npi"] for r in RECORDS}
+    assert load(pg_engine, loader, RECORDS) == (npis, set())
+    assert load(pg_engine, loader, RECORDS) == (set(), set())
+
+    changed = [dict(r) for r in RECORDS]
+    changed[1]["organization_name"] = "RIVERSIDE DRUG & GIFT"
+    assert load(pg_engine, loader, changed) == (set(), {"1000000002"})
+
+    with pg_engine.connect() as conn:
+        rows = dict(conn.execute(text("SELECT npi, organization_name FROM pharmacies")).all())
+    assert rows["1000000002"] == "RIVERSIDE DRUG & GIFT"
+    assert rows["1000000001"] == "MAIN STREET PHARMACY"
@@ -0,0 +1,90 @@
+"""Weekly NPPES updates against a real Postgres; set TEST_DATABASE_URL (a postgresql:// URL) to run."""
+import csv
+import io
+import os
+import zipfile
+
+import pytest
+
+if not os.environ.get("TEST_DATABASE_URL"):
+    pytest.skip("TEST_DATABASE_URL is not set", allow_module_level=True)
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models import Pharmacy, PharmacyChange, PipelineRun
+from app.pipeline import orchestrator
+from app.pipeline.sources.npi import DEACTIVATION_DATE_COLUMN, NPPES_COLUMNS
+
+COLUMNS = NPPES_COLUMNS + [DEACTIVATION_DATE_COLUMN]
+OPERATOR = "HILLTOP DRUG"
+OPERATOR_NPIS = [str(1000000100 + i) for i in range(10)]
+
+
+def nppes_row(npi, name, phone="5125551234", deactivated=""):
+    row = dict.fromkeys(COLUMNS, "")
+    row["NPI"] = npi
+    row["Provider Organization Name (Legal Business Name)"] = name
+    row["Provider Business Practice Location Address Telephone Number"] = phone
+    row["Provider Business Practice Location Address State Name"] = "TX"
+    row["Provider Business Practice Location Address Postal Code"] = "78701"
+    if deactivated:
+        # Deactivated NPIs are published without an entity type or taxonomy
+        row[DEACTIVATION_DATE_COLUMN] = deactivated
+    else:
+        row["Entity Type Code"] = "2"
+        row["Healthcare Provider Taxonomy Code_1"] = "3336C0003X"
+    return row
+
+
+def write_update(path, rows):
+    """A weekly dissemination ZIP holding rows as its npidata CSV."""
+    buf = io.StringIO()
+    w = csv.DictWriter(buf, COLUMNS, quoting=csv.QUOTE_ALL)
+    w.writeheader()
+    w.writerows(rows)
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("npidata_pfile_20260202-20260208.csv", buf.getvalue())
+    return str(path)
+
+
+def test_update_file_changes_adds_and_deactivates(pg_engine, tmp_path):
+    first = write_update(tmp_path / "NPPES_Data_Dissemination_020226_020826_Weekly.zip", [
+        *(nppes_row(npi, OPERATOR) for npi in OPERATOR_NPIS),
+        nppes_row("1000000001", "MAIN STREET PHARMACY"),
+    ])
+    second = write_update(tmp_path / "NPPES_Data_Dissemination_020926_021526_Weekly.zip", [
+        nppes_row("1000000001", "MAIN STREET PHARMACY", phone="5125550000"),
+        nppes_row("1000000002", "RIVERSIDE DRUG"),
+        nppes_row(OPERATOR_NPIS[0], "", deactivated="02/10/2026"),
+    ])
+
+    with Session(pg_engine) as db:
+        orchestrator._apply_update_file(db, first)
+        flags = dict(db.execute(select(Pharmacy.npi, Pharmacy.chain_parent)).all())
+        assert {flags[npi] for npi in OPERATOR_NPIS} == {"Multi-Location Operator"}
+        assert flags["1000000001"] is None
+
+        orchestrator._apply_update_file(db, second)
+        changes = db.execute(
+            select(PharmacyChange.npi, PharmacyChange.change_type, PharmacyChange.field_changed,
+                   PharmacyChange.new_value)
+            .where(PharmacyChange.detected_at >= select(PipelineRun.started_at)
+                   .where(PipelineRun.source_file == os.path.basename(second)).scalar_subquery())
+        ).all()
+        pharmacies = {p.npi: p for p in db.scalars(select(Pharmacy))}
+        runs = db.execute(
+            select(PipelineRun.status, PipelineRun.records_added, PipelineRun.records_updated)
+            .order_by(PipelineRun.id)
+        ).all()
+
+    assert sorted(changes) == [
+        ("1000000001", "updated", "phone", "(512) 555-0000"),
+        ("1000000002", "new", "all", "New pharmacy: RIVERSIDE DRUG"),
+        (OPERATOR_NPIS[0], "deactivated", "npi_deactivation_date", "2026-02-10"),
+    ]
+    assert pharmacies["1000000001"].phone == "(512) 555-0000"
+    assert pharmacies[OPERATOR_NPIS[0]].npi_deactivation_date.isoformat() == "2026-02-10"
+    # Nine active locations are below the threshold: the operator is unflagged
+    assert all(pharmacies[npi].is_independent and pharmacies[npi].chain_parent is None for npi in OPERATOR_NPIS)
+    assert runs == [("completed", 11, 0), ("completed", 1, 1)]
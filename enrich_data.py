@@ -9,15 +9,52 @@ Pulls real data from public federal sources to enrich the pharmacy database:
 
 Usage:
     cd "Claude random/M&A dash"
-    python enrich_data.py
+    python enrich_data.py [--partd-csv PATH] [--concurrency N] [--rate R]
+                          [--cms-url URL] [--census-url URL] [--hpsa-url URL]
+                          [--cache-dir DIR] [--cache-max-mb N] [--no-cache] [--offline]
+
+Medicare Part D comes from data/cms_partd.csv (the CMS "Part D Prescribers
+by Provider" file) when it exists, otherwise from the CMS API. API responses
+are cached in data/http_cache, so a rerun only fetches what it hasn't seen;
+--offline replays that cache without touching the network.
 """
+import argparse
+import asyncio
 import sqlite3
-import requests
-import time
 import sys
+from datetime import datetime
 from pathlib import Path
 
+import httpx
+
+from fetcher import Fetcher, ResponseCache, DEFAULT_CONCURRENCY, CACHE_MAX_BYTES
+from zip_demographics import ensure_zip_demographics
+
 DB_PATH = Path(__file__).parent / "pharmacy_intel.db"
+DATA_DIR = Path(__file__).parent / "data"
+
+CMS_PARTD_API = "https://data.cms.gov/data-api/v1/dataset/4c25a35d-c715-43d0-afda-c5dbc3e4e4fb/data"
+CENSUS_ACS_API = "https://api.census.gov/data/2022/acs/acs5"
+HPSA_API = "https://data.hrsa.gov/api/hpsas"
+
+# API results are written with one executemany per this many rows
+WRITE_BATCH_SIZE = 500
+# API responses are cached here between runs
+HTTP_CACHE_DIR = DATA_DIR / "http_cache"
+
+# Offline Part D: the CMS "Part D Prescribers by Provider" CSV, if downloaded
+PARTD_CSV = DATA_DIR / "cms_partd.csv"
+PARTD_CHUNK_SIZE = 100000
+# Part D column -> pharmacies column
+PARTD_COLUMNS = {
+    "Tot_Clms": "medicare_claims_count",
+    "Tot_Benes": "medicare_beneficiary_count",
+    "Tot_Drug_Cst": "medicare_total_cost",
+    "Brnd_Tot_Clms": "medicare_brand_claims",
+    "Gnrc_Tot_Clms": "medicare_generic_claims",
+    "Opioid_Tot_Clms": "medicare_opioid_claims",
+    "Antbtc_Tot_Clms": "medicare_antibiotic_claims",
+}
 
 def get_db():
     conn = sqlite3.connect(str(DB_PATH))
@@ -30,7 +67,7 @@ def get_db():
 # 1. CMS MEDICARE PART D — Real prescription claim data by NPI
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def enrich_medicare_partd():
+def enrich_medicare_partd(base_url=CMS_PARTD_API, **fetch_options):
     """Pull real Medicare Part D prescriber data from CMS API by NPI."""
     print("\n=== CMS Medicare Part D Enrichment ===")
     conn = get_db()
@@ -49,86 +86,138 @@ def enrich_medicare_partd():
         conn.close()
         return
 
-    # CMS Part D API endpoint
-    base_url = "https://data.cms.gov/data-api/v1/dataset/4c25a35d-c715-43d0-afda-c5dbc3e4e4fb/data"
+    updated, errors = asyncio.run(_fetch_medicare_partd(conn, npi_list, base_url, fetch_options))
+    conn.close()
+    print(f"Medicare enrichment complete: {updated} updated, {errors} errors")
 
+
+async def _fetch_medicare_partd(conn, npi_list, base_url, fetch_options):
     updated = 0
     errors = 0
-    batch_size = 10
 
-    for i in range(0, len(npi_list), batch_size):
-        batch = npi_list[i:i + batch_size]
-        for npi in batch:
+    async with Fetcher(**fetch_options) as fetcher:
+        async def fetch(npi):
+            nonlocal errors
             try:
-                resp = requests.get(
-                    base_url,
-                    params={"filter[Prscrbr_NPI]": npi, "size": 1},
-                    timeout=15,
-                )
-                if resp.status_code == 200:
-                    data = resp.json()
-                    if data:
-                        rec = data[0]
-                        claims = int(rec.get("Tot_Clms", 0) or 0)
-                        benes = int(rec.get("Tot_Benes", 0) or 0)
-                        cost = float(rec.get("Tot_Drug_Cst", 0) or 0)
-                        brand_claims = int(rec.get("Brnd_Tot_Clms", 0) or 0)
-                        generic_claims = int(rec.get("Gnrc_Tot_Clms", 0) or 0)
-                        opioid_claims = int(rec.get("Opioid_Tot_Clms", 0) or 0)
-                        antibiotic_claims = int(rec.get("Antbtc_Tot_Clms", 0) or 0)
-                        avg_cost = cost / claims if claims > 0 else None
-
-                        conn.execute("""
-                            UPDATE pharmacies SET
-                                medicare_claims_count = ?,
-                                medicare_beneficiary_count = ?,
-                                medicare_total_cost = ?,
-                                medicare_brand_claims = ?,
-                                medicare_generic_claims = ?,
-                                medicare_opioid_claims = ?,
-                                medicare_antibiotic_claims = ?,
-                                medicare_avg_cost_per_claim = ?
-                            WHERE npi = ?
-                        """, (claims, benes, cost, brand_claims, generic_claims,
-                              opioid_claims, antibiotic_claims, avg_cost, npi))
-                        updated += 1
-                elif resp.status_code == 429:
-                    print("  Rate limited, waiting 30s...")
-                    time.sleep(30)
-                    continue
-            except requests.exceptions.RequestException as e:
+                resp = await fetcher.get(base_url, params={"filter[Prscrbr_NPI]": npi, "size": 1})
+                if resp.status_code != 200:
+                    raise httpx.HTTPStatusError(f"CMS API returned {resp.status_code}",
+                                                request=resp.request, response=resp)
+                data = resp.json()
+                if not data:
+                    return None
+                rec = data[0]
+                claims = int(rec.get("Tot_Clms", 0) or 0)
+                benes = int(rec.get("Tot_Benes", 0) or 0)
+                cost = float(rec.get("Tot_Drug_Cst", 0) or 0)
+                brand_claims = int(rec.get("Brnd_Tot_Clms", 0) or 0)
+                generic_claims = int(rec.get("Gnrc_Tot_Clms", 0) or 0)
+                opioid_claims = int(rec.get("Opioid_Tot_Clms", 0) or 0)
+                antibiotic_claims = int(rec.get("Antbtc_Tot_Clms", 0) or 0)
+            except (httpx.HTTPError, ValueError) as e:
                 errors += 1
                 if errors <= 3:
                     print(f"  Error for NPI {npi}: {e}")
-
-        conn.commit()
-        pct = min(100, ((i + batch_size) / len(npi_list)) * 100)
-        print(f"  Progress: {pct:.0f}% ({updated} updated, {errors} errors)")
-        time.sleep(0.5)  # Rate limiting
-
+                return None
+            avg_cost = cost / claims if claims > 0 else None
+            return (claims, benes, cost, brand_claims, generic_claims,
+                    opioid_claims, antibiotic_claims, avg_cost, npi)
+
+        done = 0
+        async for results in fetcher.map(fetch, npi_list, batch_size=WRITE_BATCH_SIZE):
+            rows = [r for r in results if r]
+            conn.executemany("""
+                UPDATE pharmacies SET
+                    medicare_claims_count = ?,
+                    medicare_beneficiary_count = ?,
+                    medicare_total_cost = ?,
+                    medicare_brand_claims = ?,
+                    medicare_generic_claims = ?,
+                    medicare_opioid_claims = ?,
+                    medicare_antibiotic_claims = ?,
+                    medicare_avg_cost_per_claim = ?
+                WHERE npi = ?
+            """, rows)
+            conn.commit()
+            updated += len(rows)
+            done += len(results)
+            print(f"  Progress: {done / len(npi_list) * 100:.0f}% ({updated} updated, {errors} errors)")
+
+    return updated, errors
+
+
+def enrich_medicare_partd_bulk(csv_path):
+    """
+    Refresh Medicare Part D data for every pharmacy from the CMS "Part D
+    Prescribers by Provider" bulk CSV. The file is streamed in chunks with
+    only the needed columns, filtered to pharmacy NPIs, and applied with one
+    UPDATE ... FROM a temp table. Blank (suppressed) counts are stored as 0,
+    as the API path does.
+    """
+    import pandas as pd
+
+    print("\n=== CMS Medicare Part D Enrichment (bulk file) ===")
+    print(f"Reading {csv_path}")
+    conn = get_db()
+    pharmacy_npis = {r[0] for r in conn.execute("SELECT npi FROM pharmacies WHERE npi IS NOT NULL")}
+
+    columns = list(PARTD_COLUMNS.values()) + ["medicare_avg_cost_per_claim"]
+    conn.execute("DROP TABLE IF EXISTS temp.partd_metrics")
+    conn.execute(f"CREATE TEMP TABLE partd_metrics (npi TEXT PRIMARY KEY, {', '.join(columns)})")
+
+    scanned = 0
+    reader = pd.read_csv(csv_path, dtype=str, chunksize=PARTD_CHUNK_SIZE,
+                         usecols=lambda c: c == "Prscrbr_NPI" or c in PARTD_COLUMNS)
+    for chunk in reader:
+        scanned += len(chunk)
+        npi = chunk["Prscrbr_NPI"].str.strip()
+        keep = npi.isin(pharmacy_npis)
+        if not keep.any():
+            continue
+
+        metrics = pd.DataFrame({"npi": npi[keep]})
+        for source, column in PARTD_COLUMNS.items():
+            values = pd.to_numeric(chunk.loc[keep, source], errors="coerce") if source in chunk else None
+            metrics[column] = values
+        metrics = metrics.fillna(0)
+        for column in columns[:-1]:
+            if column != "medicare_total_cost":
+                metrics[column] = metrics[column].astype("int64")
+        claims = metrics["medicare_claims_count"]
+        metrics["medicare_avg_cost_per_claim"] = (metrics["medicare_total_cost"] / claims).where(claims > 0)
+
+        rows = metrics.astype(object).where(metrics.notna(), None).values.tolist()
+        conn.executemany(f"INSERT OR REPLACE INTO partd_metrics VALUES ({', '.join('?' * (len(columns) + 1))})", rows)
+
+    updated = conn.execute(f"""
+        UPDATE pharmacies SET {', '.join(f'{c} = m.{c}' for c in columns)}
+        FROM partd_metrics m
+        WHERE pharmacies.npi = m.npi
+    """).rowcount
+    conn.commit()
     conn.close()
-    print(f"Medicare enrichment complete: {updated} updated, {errors} errors")
+    print(f"Medicare enrichment complete: {updated:,} pharmacies updated from {scanned:,} prescribers")
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # 2. CENSUS ACS — Demographics by ZIP/ZCTA
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def enrich_census():
+def enrich_census(base_url=CENSUS_ACS_API, **fetch_options):
     """Pull Census ACS 5-year estimate demographics by ZCTA."""
     print("\n=== Census ACS Enrichment ===")
     conn = get_db()
 
     # Get unique ZIPs that need census data
     zips = conn.execute("""
-        SELECT DISTINCT zip FROM pharmacies
-        WHERE zip IS NOT NULL
-          AND (zip_population IS NULL
-               OR zip_median_age IS NULL
-               OR zip_pct_uninsured IS NULL)
+        SELECT DISTINCT substr(p.zip, 1, 5) FROM pharmacies p
+        LEFT JOIN zip_demographics d ON d.zip = substr(p.zip, 1, 5)
+        WHERE length(p.zip) >= 5
+          AND (d.population IS NULL
+               OR d.median_age IS NULL
+               OR d.pct_uninsured IS NULL)
     """).fetchall()
-    zip_list = [r[0][:5] for r in zips if r[0] and len(r[0]) >= 5]
-    zip_list = list(set(zip_list))
+    zip_list = [r[0] for r in zips]
     print(f"Found {len(zip_list)} ZIPs needing census data")
 
     if not zip_list:
@@ -136,12 +225,20 @@ def enrich_census():
         conn.close()
         return
 
+    all_zips = sorted({
+        r[0][:5] for r in conn.execute("SELECT DISTINCT zip FROM pharmacies WHERE zip IS NOT NULL")
+        if len(r[0]) >= 5
+    })
+    updated, errors = asyncio.run(_fetch_census(conn, zip_list, all_zips, base_url, fetch_options))
+    conn.close()
+    print(f"Census enrichment complete: {updated} updated, {errors} errors")
+
+
+async def _fetch_census(conn, zip_list, all_zips, base_url, fetch_options):
     # Census ACS API (no key needed for small requests, but key recommended)
     # Variables: B01003_001E=population, B01002_001E=median age,
     # B19013_001E=median income, B27010_001E=total for insurance,
     # S2701_C05_001E=% uninsured, B18101_001E=disability
-    base_url = "https://api.census.gov/data/2022/acs/acs5"
-
     variables = [
         "B01003_001E",  # Total population
         "B01002_001E",  # Median age
@@ -153,78 +250,90 @@ def enrich_census():
         "B27001_001E",  # Health insurance total
     ]
 
-    updated = 0
     errors = 0
 
-    # Process in batches of ZCTAs
+    # One request per batch of ZCTAs. Batches are cut from every ZIP in the
+    # table in sorted order, so a rerun asks for the same batches and is
+    # served from the response cache
+    needed = set(zip_list)
     batch_size = 50
-    for i in range(0, len(zip_list), batch_size):
-        batch = zip_list[i:i + batch_size]
-        zcta_str = ",".join(batch)
-
-        try:
-            resp = requests.get(
-                base_url,
-                params={
-                    "get": ",".join(variables),
-                    "for": f"zip code tabulation area:{zcta_str}",
-                },
-                timeout=30,
-            )
+    batches = [all_zips[i:i + batch_size] for i in range(0, len(all_zips), batch_size)]
+    batches = [batch for batch in batches if needed.intersection(batch)]
 
-            if resp.status_code == 200:
+    async with Fetcher(**fetch_options) as fetcher:
+        async def fetch(batch):
+            nonlocal errors
+            try:
+                resp = await fetcher.get(base_url, params={
+                    "get": ",".join(variables),
+                    "for": f"zip code tabulation area:{','.join(batch)}",
+                })
+                if resp.status_code == 204:
+                    return []  # No data for these ZCTAs
+                if resp.status_code != 200:
+                    errors += 1
+                    if errors <= 3:
+                        print(f"  Census API returned {resp.status_code}")
+                    return []
                 data = resp.json()
-                headers = data[0]
-                for row in data[1:]:
-                    record = dict(zip(headers, row))
-                    zcta = record.get("zip code tabulation area", "")
-
-                    pop = safe_int(record.get("B01003_001E"))
-                    median_age = safe_float(record.get("B01002_001E"))
-                    median_income = safe_int(record.get("B19013_001E"))
-                    pop_65 = safe_int(record.get("B09021_001E"))
-                    disability_total = safe_int(record.get("B18101_001E"))
-                    poverty = safe_int(record.get("B17001_002E"))
-                    housing = safe_int(record.get("B25001_001E"))
-                    insurance_total = safe_int(record.get("B27001_001E"))
-
-                    pct_65 = (pop_65 / pop * 100) if pop and pop_65 else None
-                    pct_disabled = (disability_total / pop * 100) if pop and disability_total else None
-                    pct_poverty = (poverty / pop * 100) if pop and poverty else None
-
-                    conn.execute("""
-                        UPDATE pharmacies SET
-                            zip_population = COALESCE(?, zip_population),
-                            zip_median_age = COALESCE(?, zip_median_age),
-                            zip_median_income = COALESCE(?, zip_median_income),
-                            zip_pct_65_plus = COALESCE(?, zip_pct_65_plus),
-                            zip_pct_disabled = COALESCE(?, zip_pct_disabled),
-                            zip_pct_poverty = COALESCE(?, zip_pct_poverty),
-                            zip_total_households = COALESCE(?, zip_total_households)
-                        WHERE zip LIKE ?
-                    """, (pop, median_age, median_income, pct_65, pct_disabled,
-                          pct_poverty, housing, f"{zcta}%"))
-                    updated += 1
-
-            elif resp.status_code == 204:
-                pass  # No data for these ZCTAs
-            else:
+            except (httpx.HTTPError, ValueError) as e:
                 errors += 1
                 if errors <= 3:
-                    print(f"  Census API returned {resp.status_code}")
+                    print(f"  Census API error: {e}")
+                return []
+
+            rows = []
+            headers = data[0]
+            for row in data[1:]:
+                record = dict(zip(headers, row))
+                zcta = record.get("zip code tabulation area", "")
+                if zcta not in needed:
+                    continue
 
-        except requests.exceptions.RequestException as e:
-            errors += 1
-            if errors <= 3:
-                print(f"  Census API error: {e}")
+                pop = safe_int(record.get("B01003_001E"))
+                median_age = safe_float(record.get("B01002_001E"))
+                median_income = safe_int(record.get("B19013_001E"))
+                pop_65 = safe_int(record.get("B09021_001E"))
+                disability_total = safe_int(record.get("B18101_001E"))
+                poverty = safe_int(record.get("B17001_002E"))
+                housing = safe_int(record.get("B25001_001E"))
+
+                pct_65 = (pop_65 / pop * 100) if pop and pop_65 else None
+                pct_disabled = (disability_total / pop * 100) if pop and disability_total else None
+                pct_poverty = (poverty / pop * 100) if pop and poverty else None
+
+                rows.append((zcta, pop, median_age, median_income, pct_65, pct_disabled,
+                             pct_poverty, housing, now))
+            return rows
+
+        # Stored once per ZIP, in one bulk upsert at the end; a rerun after a
+        # crash replays the responses from the cache
+        now = datetime.now().isoformat()
+        all_rows = []
+        done = 0
+        async for results in fetcher.map(fetch, batches, batch_size=WRITE_BATCH_SIZE // batch_size):
+            all_rows.extend(row for rows in results for row in rows)
+            done += len(results)
+            print(f"  Progress: {done / len(batches) * 100:.0f}% ({len(all_rows)} ZIPs fetched)")
+
+    conn.executemany("""
+        INSERT INTO zip_demographics (zip, population, median_age, median_income, pct_65_plus,
+                                      pct_disabled, pct_poverty, total_households, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (zip) DO UPDATE SET
+            population = COALESCE(excluded.population, population),
+            median_age = COALESCE(excluded.median_age, median_age),
+            median_income = COALESCE(excluded.median_income, median_income),
+            pct_65_plus = COALESCE(excluded.pct_65_plus, pct_65_plus),
+            pct_disabled = COALESCE(excluded.pct_disabled, pct_disabled),
+            pct_poverty = COALESCE(excluded.pct_poverty, pct_poverty),
+            total_households = COALESCE(excluded.total_households, total_households),
+            updated_at = excluded.updated_at
+    """, all_rows)
+    conn.commit()
+    updated = len(all_rows)
 
-        conn.commit()
-        pct = min(100, ((i + batch_size) / len(zip_list)) * 100)
-        print(f"  Progress: {pct:.0f}% ({updated} ZIPs updated)")
-        time.sleep(0.3)
-
-    conn.close()
-    print(f"Census enrichment complete: {updated} updated, {errors} errors")
+    return updated, errors
 
 
 def safe_int(val):
@@ -244,7 +353,7 @@ def safe_float(val):
 # 3. HRSA HPSA — Health Professional Shortage Areas
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def enrich_hpsa():
+def enrich_hpsa(base_url=HPSA_API, **fetch_options):
     """Check HRSA HPSA designations for pharmacy locations."""
     print("\n=== HRSA HPSA Enrichment ===")
     conn = get_db()
@@ -262,54 +371,53 @@ def enrich_hpsa():
         conn.close()
         return
 
-    # HRSA API
-    base_url = "https://data.hrsa.gov/data/download"
-    # Alternative: BCD API
-    hpsa_url = "https://data.hrsa.gov/api/hpsas"
+    updated, errors = asyncio.run(_fetch_hpsa(conn, locations, base_url, fetch_options))
+    conn.close()
+    print(f"HPSA enrichment complete: {updated} areas designated, {errors} errors")
+
 
+async def _fetch_hpsa(conn, locations, base_url, fetch_options):
     updated = 0
     errors = 0
 
-    for state, county in locations:
-        try:
-            resp = requests.get(
-                hpsa_url,
-                params={
+    async with Fetcher(**fetch_options) as fetcher:
+        async def fetch(location):
+            nonlocal errors
+            state, county = location
+            try:
+                resp = await fetcher.get(base_url, params={
                     "state": state,
                     "county": county,
                     "disciplineId": 5,  # Pharmacy
                     "status": "D",  # Designated
-                },
-                timeout=15,
-            )
-
-            if resp.status_code == 200:
+                })
+                if resp.status_code != 200:
+                    return None
                 data = resp.json()
-                if data and len(data) > 0:
-                    # Find the best HPSA score for this area
-                    best_score = max((int(h.get("hpsaScore", 0) or 0) for h in data), default=0)
-                    conn.execute("""
-                        UPDATE pharmacies SET
-                            hpsa_designated = 1,
-                            hpsa_score = ?,
-                            medically_underserved = 1
-                        WHERE state = ? AND county = ?
-                    """, (best_score, state, county))
-                    updated += 1
-            elif resp.status_code == 429:
-                time.sleep(10)
-                continue
-
-        except requests.exceptions.RequestException as e:
-            errors += 1
-            if errors <= 5:
-                print(f"  HPSA error for {state}/{county}: {e}")
-
-        time.sleep(0.2)
-
-    conn.commit()
-    conn.close()
-    print(f"HPSA enrichment complete: {updated} areas designated, {errors} errors")
+                if not data:
+                    return None
+                # Find the best HPSA score for this area
+                best_score = max((int(h.get("hpsaScore", 0) or 0) for h in data), default=0)
+            except (httpx.HTTPError, ValueError) as e:
+                errors += 1
+                if errors <= 5:
+                    print(f"  HPSA error for {state}/{county}: {e}")
+                return None
+            return best_score, state, county
+
+        async for results in fetcher.map(fetch, locations, batch_size=WRITE_BATCH_SIZE):
+            rows = [r for r in results if r]
+            conn.executemany("""
+                UPDATE pharmacies SET
+                    hpsa_designated = 1,
+                    hpsa_score = ?,
+                    medically_underserved = 1
+                WHERE state = ? AND county = ?
+            """, rows)
+            conn.commit()
+            updated += len(rows)
+
+    return updated, errors
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -317,60 +425,151 @@ def enrich_hpsa():
 # ═══════════════════════════════════════════════════════════════════════════════
 
 def calculate_competition():
-    """Calculate competition metrics from existing pharmacy data."""
+    """
+    Calculate competition metrics from existing pharmacy data.
+
+    Metrics are kept per ZIP in zip_competition, and zip_competition_members
+    records each pharmacy's ZIP and flags as last counted. Only ZIPs that a
+    pharmacy joined, left or changed within since the last run, or whose
+    population changed, are re-aggregated, in one GROUP BY pass over their
+    pharmacies; those pharmacies then take their ZIP's values with one join
+    update.
+    """
     print("\n=== Competition Density Calculation ===")
     conn = get_db()
-
-    # Count pharmacies per ZIP
-    conn.execute("""
-        UPDATE pharmacies SET
-            zip_pharmacy_count = (
-                SELECT COUNT(*) FROM pharmacies p2
-                WHERE p2.zip = pharmacies.zip AND p2.npi_deactivation_date IS NULL
-            ),
-            zip_chain_count = (
-                SELECT COUNT(*) FROM pharmacies p2
-                WHERE p2.zip = pharmacies.zip AND p2.is_chain = 1 AND p2.npi_deactivation_date IS NULL
-            ),
-            zip_independent_count = (
-                SELECT COUNT(*) FROM pharmacies p2
-                WHERE p2.zip = pharmacies.zip AND p2.is_independent = 1 AND p2.npi_deactivation_date IS NULL
-            )
-        WHERE zip IS NOT NULL
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS zip_competition (
+            zip TEXT PRIMARY KEY,
+            pharmacy_count INTEGER,
+            chain_count INTEGER,
+            independent_count INTEGER,
+            pharmacies_per_10k REAL,
+            competition_score REAL,
+            updated_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS zip_competition_members (
+            npi TEXT PRIMARY KEY,
+            zip TEXT,
+            is_chain INTEGER,
+            is_independent INTEGER,
+            active INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_zip_competition_members_zip ON zip_competition_members(zip);
+        DROP TABLE IF EXISTS temp.touched_zips;
+        CREATE TEMP TABLE touched_zips (zip TEXT PRIMARY KEY);
     """)
-
-    # Pharmacies per 10K population
+    # Pharmacies per 10K population, from a ZIP's count and its zip_demographics row d
+    density = """
+        CASE
+            WHEN d.population > 0 AND {count} > 0
+            THEN ROUND(CAST({count} AS REAL) / d.population * 10000, 2)
+        END
+    """
+    membership_changed = """
+        m.zip IS NOT p.zip
+        OR m.is_chain IS NOT p.is_chain
+        OR m.is_independent IS NOT p.is_independent
+        OR m.active IS NOT (p.npi_deactivation_date IS NULL)
+    """
+
+    # A pharmacy that is new, gone, moved, or changed chain or active status
+    # touches its current and its last counted ZIP
+    conn.execute(f"""
+        INSERT OR IGNORE INTO touched_zips (zip)
+        SELECT p.zip FROM pharmacies p
+        LEFT JOIN zip_competition_members m ON m.npi = p.npi
+        WHERE p.zip IS NOT NULL AND (m.npi IS NULL OR {membership_changed})
+        UNION
+        SELECT m.zip FROM zip_competition_members m
+        LEFT JOIN pharmacies p ON p.npi = m.npi
+        WHERE p.npi IS NULL OR {membership_changed}
+    """)
+    conn.execute(f"""
+        INSERT OR IGNORE INTO touched_zips (zip)
+        SELECT c.zip FROM zip_competition c
+        LEFT JOIN zip_demographics d ON d.zip = substr(c.zip, 1, 5)
+        WHERE c.pharmacies_per_10k IS NOT ({density.format(count="c.pharmacy_count")})
+    """)
+    touched = conn.execute("SELECT COUNT(*) FROM touched_zips").fetchone()[0]
+
+    # Count pharmacies per touched ZIP, with pharmacies per 10K population and
+    # the competition score (lower = less competition = better for acquisition)
+    changed = conn.execute(f"""
+        INSERT INTO zip_competition (zip, pharmacy_count, chain_count, independent_count,
+                                     pharmacies_per_10k, competition_score, updated_at)
+        SELECT zip, pharmacy_count, chain_count, independent_count, pharmacies_per_10k,
+               CASE
+                   WHEN pharmacies_per_10k <= 1.0 THEN 100
+                   WHEN pharmacies_per_10k <= 2.0 THEN 80
+                   WHEN pharmacies_per_10k <= 3.0 THEN 60
+                   WHEN pharmacies_per_10k <= 5.0 THEN 40
+                   WHEN pharmacies_per_10k <= 8.0 THEN 20
+                   WHEN pharmacies_per_10k IS NOT NULL THEN 10
+               END,
+               ?
+        FROM (
+            SELECT c.*, {density.format(count="c.pharmacy_count")} AS pharmacies_per_10k
+            FROM (
+                SELECT zip,
+                       SUM(npi_deactivation_date IS NULL) AS pharmacy_count,
+                       SUM(is_chain = 1 AND npi_deactivation_date IS NULL) AS chain_count,
+                       SUM(is_independent = 1 AND npi_deactivation_date IS NULL) AS independent_count
+                FROM pharmacies
+                WHERE zip IN (SELECT zip FROM touched_zips)
+                GROUP BY zip
+            ) c
+            LEFT JOIN zip_demographics d ON d.zip = substr(c.zip, 1, 5)
+        ) WHERE true
+        ON CONFLICT (zip) DO UPDATE SET
+            pharmacy_count = excluded.pharmacy_count,
+            chain_count = excluded.chain_count,
+            independent_count = excluded.independent_count,
+            pharmacies_per_10k = excluded.pharmacies_per_10k,
+            competition_score = excluded.competition_score,
+            updated_at = excluded.updated_at
+        WHERE pharmacy_count IS NOT excluded.pharmacy_count
+           OR chain_count IS NOT excluded.chain_count
+           OR independent_count IS NOT excluded.independent_count
+           OR pharmacies_per_10k IS NOT excluded.pharmacies_per_10k
+    """, (datetime.now().isoformat(),)).rowcount
     conn.execute("""
-        UPDATE pharmacies SET
-            zip_pharmacies_per_10k = CASE
-                WHEN zip_population > 0 AND zip_pharmacy_count > 0
-                THEN ROUND(CAST(zip_pharmacy_count AS REAL) / zip_population * 10000, 2)
-                ELSE NULL
-            END
-        WHERE zip_population IS NOT NULL AND zip_pharmacy_count IS NOT NULL
+        DELETE FROM zip_competition WHERE zip IN (
+            SELECT zip FROM touched_zips EXCEPT SELECT zip FROM pharmacies
+        )
     """)
 
-    # Competition score (lower = less competition = better for acquisition)
-    conn.execute("""
+    # Copy onto the touched ZIPs' pharmacies whose values differ
+    updated = conn.execute("""
         UPDATE pharmacies SET
-            competition_score = CASE
-                WHEN zip_pharmacies_per_10k IS NOT NULL THEN
-                    CASE
-                        WHEN zip_pharmacies_per_10k <= 1.0 THEN 100
-                        WHEN zip_pharmacies_per_10k <= 2.0 THEN 80
-                        WHEN zip_pharmacies_per_10k <= 3.0 THEN 60
-                        WHEN zip_pharmacies_per_10k <= 5.0 THEN 40
-                        WHEN zip_pharmacies_per_10k <= 8.0 THEN 20
-                        ELSE 10
-                    END
-                ELSE NULL
-            END
+            zip_pharmacy_count = s.pharmacy_count,
+            zip_chain_count = s.chain_count,
+            zip_independent_count = s.independent_count,
+            zip_pharmacies_per_10k = s.pharmacies_per_10k,
+            competition_score = s.competition_score
+        FROM zip_competition s
+        WHERE s.zip = pharmacies.zip
+          AND pharmacies.zip IN (SELECT zip FROM touched_zips)
+          AND (pharmacies.zip_pharmacy_count IS NOT s.pharmacy_count
+               OR pharmacies.zip_chain_count IS NOT s.chain_count
+               OR pharmacies.zip_independent_count IS NOT s.independent_count
+               OR pharmacies.zip_pharmacies_per_10k IS NOT s.pharmacies_per_10k
+               OR pharmacies.competition_score IS NOT s.competition_score)
+    """).rowcount
+
+    # Record the membership these counts came from
+    conn.execute("DELETE FROM zip_competition_members WHERE zip IN (SELECT zip FROM touched_zips)")
+    conn.execute("""
+        INSERT OR REPLACE INTO zip_competition_members (npi, zip, is_chain, is_independent, active)
+        SELECT npi, zip, is_chain, is_independent, npi_deactivation_date IS NULL
+        FROM pharmacies
+        WHERE zip IN (SELECT zip FROM touched_zips)
     """)
 
     conn.commit()
     count = conn.execute("SELECT COUNT(*) FROM pharmacies WHERE zip_pharmacy_count IS NOT NULL").fetchone()[0]
     conn.close()
-    print(f"Competition calculated for {count:,} pharmacies")
+    print(f"Competition calculated for {count:,} pharmacies "
+          f"({touched:,} ZIPs recounted, {changed:,} changed, {updated:,} pharmacies updated)")
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -387,7 +586,7 @@ def recalculate_scores():
         "SELECT MAX(medicare_claims_count) FROM pharmacies WHERE is_independent = 1"
     ).fetchone()[0] or 1
     max_income = conn.execute(
-        "SELECT MAX(zip_median_income) FROM pharmacies WHERE zip_median_income > 0"
+        "SELECT MAX(zip_median_income) FROM pharmacy_details WHERE zip_median_income > 0"
     ).fetchone()[0] or 1
 
     # Score each pharmacy
@@ -395,7 +594,7 @@ def recalculate_scores():
         SELECT id, medicare_claims_count, competition_score, zip_pct_65_plus,
                years_in_operation, hpsa_designated, zip_median_income,
                zip_pop_growth_pct, nearest_walgreens_miles
-        FROM pharmacies WHERE is_independent = 1
+        FROM pharmacy_details WHERE is_independent = 1
     """).fetchall()
 
     scored = 0
@@ -496,6 +695,33 @@ def recalculate_scores():
 # ═══════════════════════════════════════════════════════════════════════════════
 
 def main():
+    parser = argparse.ArgumentParser(description="Enrich pharmacies with CMS, Census and HRSA data.")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="API requests in flight at once (default: %(default)s)")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="requests/second per host, replacing the built-in per-API limits")
+    parser.add_argument("--cms-url", default=CMS_PARTD_API, help="CMS Part D API base URL")
+    parser.add_argument("--partd-csv", type=Path, default=None,
+                        help=f"Part D by-provider bulk CSV to use instead of the API (default: {PARTD_CSV} if present)")
+    parser.add_argument("--census-url", default=CENSUS_ACS_API, help="Census ACS API base URL")
+    parser.add_argument("--hpsa-url", default=HPSA_API, help="HRSA HPSA API base URL")
+    parser.add_argument("--cache-dir", type=Path, default=HTTP_CACHE_DIR,
+                        help="API response cache directory (default: %(default)s)")
+    parser.add_argument("--cache-max-mb", type=int, default=CACHE_MAX_BYTES // (1024 * 1024),
+                        help="evict least recently used responses beyond this size (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true", help="always fetch from the APIs")
+    parser.add_argument("--offline", action="store_true",
+                        help="replay cached API responses only; uncached requests count as errors")
+    args = parser.parse_args()
+
+    fetch_options = {"concurrency": args.concurrency}
+    if args.rate:
+        fetch_options.update(rates={}, rate=args.rate)
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(args.cache_dir, max_bytes=args.cache_max_mb * 1024 * 1024, offline=args.offline)
+        fetch_options["cache"] = cache
+
     print("=" * 60)
     print("Pharmacy Acquisition Intelligence — Data Enrichment")
     print("=" * 60)
@@ -507,6 +733,8 @@ def main():
 
     conn = get_db()
     total = conn.execute("SELECT COUNT(*) FROM pharmacies").fetchone()[0]
+    # Census data per ZIP, read through the pharmacy_details view
+    ensure_zip_demographics(conn)
     conn.close()
     print(f"\nDatabase: {DB_PATH}")
     print(f"Total pharmacies: {total:,}")
@@ -516,23 +744,27 @@ def main():
         sys.exit(1)
 
     # Run enrichment steps
-    print("\nStep 1/5: Medicare Part D data (CMS API)...")
+    partd_csv = args.partd_csv or (PARTD_CSV if PARTD_CSV.exists() else None)
+    print(f"\nStep 1/5: Medicare Part D data ({'bulk file' if partd_csv else 'CMS API'})...")
     try:
-        enrich_medicare_partd()
+        if partd_csv:
+            enrich_medicare_partd_bulk(partd_csv)
+        else:
+            enrich_medicare_partd(args.cms_url, **fetch_options)
     except Exception as e:
         print(f"  Medicare enrichment failed: {e}")
         print("  Continuing with other enrichments...")
 
     print("\nStep 2/5: Census ACS demographics...")
     try:
-        enrich_census()
+        enrich_census(args.census_url, **fetch_options)
     except Exception as e:
         print(f"  Census enrichment failed: {e}")
         print("  Continuing with other enrichments...")
 
     print("\nStep 3/5: HRSA HPSA designations...")
     try:
-        enrich_hpsa()
+        enrich_hpsa(args.hpsa_url, **fetch_options)
     except Exception as e:
         print(f"  HPSA enrichment failed: {e}")
         print("  Continuing with other enrichments...")
@@ -552,7 +784,7 @@ def main():
     # Final summary
     conn = get_db()
     has_medicare = conn.execute("SELECT COUNT(*) FROM pharmacies WHERE medicare_claims_count > 0").fetchone()[0]
-    has_census = conn.execute("SELECT COUNT(*) FROM pharmacies WHERE zip_population IS NOT NULL").fetchone()[0]
+    has_census = conn.execute("SELECT COUNT(*) FROM pharmacy_details WHERE zip_population IS NOT NULL").fetchone()[0]
     has_hpsa = conn.execute("SELECT COUNT(*) FROM pharmacies WHERE hpsa_designated = 1").fetchone()[0]
     has_scores = conn.execute("SELECT COUNT(*) FROM pharmacies WHERE acquisition_score IS NOT NULL").fetchone()[0]
     conn.close()
@@ -564,6 +796,8 @@ def main():
     print(f"  With Census data:   {has_census:,}")
     print(f"  In HPSA areas:      {has_hpsa:,}")
     print(f"  With Acq. Scores:   {has_scores:,}")
+    if cache:
+        print(f"  API cache:          {cache.hits:,} hits, {cache.misses:,} misses")
     print(f"\nRestart the Streamlit app to see updated data.")
 
 
@@ -1,29 +1,42 @@
 """
 Extract date fields from NPI CSV and update the pharmacy_intel.db database.
 
-Reads only the columns we need (NPI + 4 date fields) from the 10GB CSV,
-matches against NPIs already in our database, and updates them.
+run_pipeline.py now loads these dates in the same pass as the identity and
+address fields. This script remains as a backfill for databases loaded
+before that: it reads only the columns we need (NPI + 4 date fields) from
+the 10GB CSV, matches against NPIs already in our database, and updates them.
 """
 import csv
 import sqlite3
+import pandas as pd
 import sys
 from pathlib import Path
 from datetime import datetime
 
+from zip_demographics import ensure_zip_demographics
+
 APP_DIR = Path(__file__).parent
 DB_PATH = APP_DIR / "pharmacy_intel.db"
 CSV_PATH = APP_DIR / "data" / "npidata_pfile_20050523-20260208.csv"
 
-# Columns we need from the CSV (0-indexed)
-COL_NPI = 0
-COL_ENUMERATION_DATE = 36        # "Provider Enumeration Date"
-COL_LAST_UPDATE_DATE = 37        # "Last Update Date"
-COL_DEACTIVATION_REASON = 38     # "NPI Deactivation Reason Code"
-COL_DEACTIVATION_DATE = 39       # "NPI Deactivation Date"
+# Columns we need from the CSV, resolved to positions from its header
+COL_NPI = "NPI"
+COL_ENUMERATION_DATE = "Provider Enumeration Date"
+COL_LAST_UPDATE_DATE = "Last Update Date"
+COL_DEACTIVATION_REASON = "NPI Deactivation Reason Code"
+COL_DEACTIVATION_DATE = "NPI Deactivation Date"
+
+NEEDED_COLS = [COL_NPI, COL_ENUMERATION_DATE, COL_LAST_UPDATE_DATE,
+               COL_DEACTIVATION_REASON, COL_DEACTIVATION_DATE]
+
 
-NEEDED_COLS = {COL_NPI, COL_ENUMERATION_DATE, COL_LAST_UPDATE_DATE,
-               COL_DEACTIVATION_REASON, COL_DEACTIVATION_DATE}
-MAX_COL = max(NEEDED_COLS)
+def resolve_columns(header):
+    """Map each needed column name to its index in the CSV header."""
+    names = [h.strip() for h in header]
+    missing = [c for c in NEEDED_COLS if c not in names]
+    if missing:
+        raise ValueError(f"NPI CSV header is missing columns: {', '.join(missing)}")
+    return {c: names.index(c) for c in NEEDED_COLS}
 
 
 def add_columns_if_missing(conn):
@@ -68,6 +81,33 @@ def calc_years(enumeration_date_str):
         return None
 
 
+def iter_date_rows():
+    """
+    Yield (npi, enumeration, last update, deactivation reason, deactivation)
+    strings. Served from run_pipeline's cached pharmacy subset of this
+    release when present; otherwise the full CSV is scanned.
+    """
+    from run_pipeline import subset_cache_path
+
+    cache = subset_cache_path(CSV_PATH)
+    if cache.exists():
+        print(f"Reading cached pharmacy subset: {cache.name}")
+        df = pd.read_parquet(cache, columns=NEEDED_COLS).fillna("").astype(str)
+        yield from df.itertuples(index=False, name=None)
+        return
+
+    print(f"Scanning CSV: {CSV_PATH.name}")
+    print("  (This reads a large file — may take a few minutes...)")
+    with open(CSV_PATH, "r", encoding="utf-8", errors="replace") as f:
+        reader = csv.reader(f)
+        pos = resolve_columns(next(reader))
+        cols = [pos[c] for c in NEEDED_COLS]
+        max_col = max(cols)
+        for row in reader:
+            if len(row) > max_col:
+                yield tuple(row[i] for i in cols)
+
+
 def main():
     if not CSV_PATH.exists():
         print(f"ERROR: CSV not found at {CSV_PATH}")
@@ -82,42 +122,33 @@ def main():
     # Step 1: Add columns
     print("Adding new columns to database...")
     add_columns_if_missing(conn)
+    ensure_zip_demographics(conn)
 
     # Step 2: Load all NPIs from our database into a set for fast lookup
     print("Loading NPIs from database...")
     db_npis = {row[0] for row in conn.execute("SELECT npi FROM pharmacies").fetchall()}
     print(f"  {len(db_npis):,} pharmacies in database")
 
-    # Step 3: Read CSV and collect date data for matching NPIs
-    print(f"Scanning CSV: {CSV_PATH.name}")
-    print("  (This reads a large file — may take a few minutes...)")
-
+    # Step 3: Read dates (cached pharmacy subset, else the CSV) for matching NPIs
     updates = []
     rows_scanned = 0
 
-    with open(CSV_PATH, "r", encoding="utf-8", errors="replace") as f:
-        reader = csv.reader(f)
-        header = next(reader)  # skip header
-
-        for row in reader:
-            rows_scanned += 1
-            if rows_scanned % 1_000_000 == 0:
-                print(f"  Scanned {rows_scanned:,} rows, {len(updates):,} matches...")
+    for npi, enum_raw, update_raw, reason_raw, deact_raw in iter_date_rows():
+        rows_scanned += 1
+        if rows_scanned % 1_000_000 == 0:
+            print(f"  Scanned {rows_scanned:,} rows, {len(updates):,} matches...")
 
-            if len(row) <= MAX_COL:
-                continue
-
-            npi = row[COL_NPI].strip()
-            if npi not in db_npis:
-                continue
+        npi = npi.strip()
+        if npi not in db_npis:
+            continue
 
-            enum_date = parse_date(row[COL_ENUMERATION_DATE])
-            last_update = parse_date(row[COL_LAST_UPDATE_DATE])
-            deact_date = parse_date(row[COL_DEACTIVATION_DATE])
-            deact_reason = row[COL_DEACTIVATION_REASON].strip() or None
-            years = calc_years(enum_date)
+        enum_date = parse_date(enum_raw)
+        last_update = parse_date(update_raw)
+        deact_date = parse_date(deact_raw)
+        deact_reason = reason_raw.strip() or None
+        years = calc_years(enum_date)
 
-            updates.append((enum_date, last_update, deact_date, deact_reason, years, npi))
+        updates.append((enum_date, last_update, deact_date, deact_reason, years, npi))
 
     print(f"  Done scanning. {rows_scanned:,} total rows, {len(updates):,} matches.")
 
@@ -176,14 +207,14 @@ def recalc_scores(conn):
         "SELECT MAX(medicare_claims_count) FROM pharmacies WHERE is_independent = 1"
     ).fetchone()[0] or 1
     max_income = conn.execute(
-        "SELECT MAX(zip_median_income) FROM pharmacies WHERE zip_median_income > 0"
+        "SELECT MAX(zip_median_income) FROM pharmacy_details WHERE zip_median_income > 0"
     ).fetchone()[0] or 1
 
     pharmacies = conn.execute("""
         SELECT id, medicare_claims_count, zip_pharmacies_per_10k,
                zip_pct_65_plus, zip_median_income, zip_pop_growth_pct,
                years_in_operation, hpsa_designated
-        FROM pharmacies WHERE is_independent = 1
+        FROM pharmacy_details WHERE is_independent = 1
     """).fetchall()
 
     updates = []
@@ -0,0 +1,291 @@
+"""
+Shared async HTTP fetcher for the enrichment APIs (CMS, Census, HRSA).
+
+One pooled httpx.AsyncClient serves every request. A semaphore caps requests
+in flight, a token bucket per host keeps each API under its rate limit, and
+429/5xx responses and connection errors are retried with exponential backoff
+(honouring Retry-After). Callers hand map() a coroutine per item and get the
+results back a batch at a time as they complete, ready for one executemany.
+
+With a ResponseCache, successful responses are stored on disk keyed by URL
+and params and reused until their host's TTL runs out; the cache is bounded
+in size with least-recently-used eviction. In offline mode only the cache is
+consulted, so a run can be replayed from recorded responses.
+
+Pass transport= (e.g. httpx.MockTransport) or point the base URLs at a local
+stub server to exercise it offline.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import httpx
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RATE = 5.0  # requests/second for hosts not listed below
+
+# Requests/second per host, kept under each API's published limits
+HOST_RATES = {
+    "data.cms.gov": 10.0,
+    "api.census.gov": 5.0,
+    "data.hrsa.gov": 5.0,
+}
+
+# Seconds a cached response stays fresh, per host
+HOST_TTLS = {
+    "data.cms.gov": 30 * 86400,     # Part D is published yearly
+    "api.census.gov": 180 * 86400,  # ACS 5-year vintages are fixed
+    "data.hrsa.gov": 7 * 86400,     # HPSA designations change weekly
+}
+DEFAULT_TTL = 86400
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+CACHEABLE_STATUSES = {200, 204}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+
+class TokenBucket:
+    """Allows rate acquisitions per second on average, bursting up to burst."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CacheMiss(httpx.HTTPError):
+    """Offline mode and the response isn't cached."""
+
+
+class ResponseCache:
+    """
+    On-disk HTTP response cache. Each response is a JSON file named by the
+    SHA-256 of its URL and params; reading one bumps its mtime, and writes
+    evict the least recently used files once the cache exceeds max_bytes.
+    offline serves entries regardless of age and never touches the network.
+    """
+
+    def __init__(self, directory, ttls=None, default_ttl=DEFAULT_TTL, max_bytes=CACHE_MAX_BYTES,
+                 offline=False):
+        self.directory = Path(directory)
+        self.ttls = HOST_TTLS if ttls is None else ttls
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.size = sum(path.stat().st_size for path in self.directory.glob("*/*.json"))
+
+    def path(self, url, params=None):
+        key = json.dumps([url, sorted((str(k), str(v)) for k, v in (params or {}).items())])
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return self.directory / digest[:2] / f"{digest}.json"
+
+    def get(self, url, params=None):
+        """The cached httpx.Response, or None if missing or expired."""
+        path = self.path(url, params)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        ttl = self.ttls.get(urlsplit(url).hostname or "", self.default_ttl)
+        if not self.offline and time.time() - entry["fetched_at"] > ttl:
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return httpx.Response(
+            entry["status"],
+            headers=entry["headers"],
+            content=base64.b64decode(entry["body"]),
+            request=httpx.Request("GET", url, params=params),
+        )
+
+    def put(self, url, params, resp):
+        path = self.path(url, params)
+        path.parent.mkdir(exist_ok=True)
+        entry = {
+            "url": url,
+            "params": params,
+            "status": resp.status_code,
+            "headers": {k: v for k, v in resp.headers.items() if k.lower() == "content-type"},
+            "body": base64.b64encode(resp.content).decode(),
+            "fetched_at": time.time(),
+        }
+        old_size = path.stat().st_size if path.exists() else 0
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)
+        self.size += path.stat().st_size - old_size
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache is under 90% of max_bytes."""
+        entries = sorted(
+            ((p.stat().st_mtime, p.stat().st_size, p) for p in self.directory.glob("*/*.json")),
+            key=lambda e: e[0],
+        )
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            path.unlink(missing_ok=True)
+            self.size -= size
+
+
+class Fetcher:
+    """
+    Async context manager around a pooled client:
+
+        async with Fetcher(concurrency=8) as fetcher:
+            resp = await fetcher.get(url, params={...})
+
+    rates replaces HOST_RATES; rate applies to every other host. cache is
+    an optional ResponseCache.
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, rates=None, rate=DEFAULT_RATE,
+                 max_retries=MAX_RETRIES, backoff_base=BACKOFF_BASE, timeout=30, transport=None,
+                 cache=None):
+        self.cache = cache
+        self.concurrency = concurrency
+        self.rates = HOST_RATES if rates is None else rates
+        self.rate = rate
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.timeout = timeout
+        self.transport = transport
+        self.buckets = {}
+        self.retries = 0
+        self.client = None
+        self.semaphore = None
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.concurrency,
+                                max_keepalive_connections=self.concurrency),
+            transport=self.transport,
+            follow_redirects=True,
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+
+    def bucket(self, url):
+        host = urlsplit(url).hostname or ""
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rates.get(host, self.rate))
+        return self.buckets[host]
+
+    async def get(self, url, params=None):
+        """
+        GET url, from the cache if it holds a fresh copy, otherwise retrying
+        429/5xx and transport errors with backoff. Returns the last response
+        (which may still be an error status); raises the last
+        httpx.TransportError if every attempt failed to connect, or CacheMiss
+        when offline.
+        """
+        if self.cache:
+            resp = self.cache.get(url, params)
+            if resp is not None:
+                return resp
+            if self.cache.offline:
+                raise CacheMiss(f"Not cached: {url} {params}")
+
+        resp = await self._fetch(url, params)
+        if self.cache and resp.status_code in CACHEABLE_STATUSES:
+            self.cache.put(url, params, resp)
+        return resp
+
+    async def _fetch(self, url, params):
+        bucket = self.bucket(url)
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.semaphore:
+                    # Tokens are taken only with a slot free, so requests
+                    # queued on the semaphore don't spend their rate budget
+                    # while waiting and then go out in a burst
+                    await bucket.acquire()
+                    resp = await self.client.get(url, params=params)
+            except httpx.TransportError:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+            else:
+                if resp.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    return resp
+                delay = self.backoff(attempt, resp.headers.get("retry-after"))
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    def backoff(self, attempt, retry_after=None):
+        """Seconds to wait before retry attempt + 1: Retry-After if given, else jittered exponential."""
+        if retry_after:
+            try:
+                return min(BACKOFF_MAX, float(retry_after))
+            except ValueError:
+                pass
+        return min(BACKOFF_MAX, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    async def map(self, fn, items, batch_size=500):
+        """
+        Run coroutine fn over items, keeping up to batch_size calls pending,
+        and yield lists of batch_size results in completion order (the last
+        may be shorter). A slow retry holds up only its own item. The first
+        exception from fn propagates, and the calls still pending are cancelled.
+        """
+        items = iter(items)
+        pending = set()
+        finished = set()
+        done = []
+        try:
+            while True:
+                for item in items:
+                    pending.add(asyncio.ensure_future(fn(item)))
+                    if len(pending) >= batch_size:
+                        break
+                if not pending:
+                    break
+                finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                done.extend(task.result() for task in finished)
+                if len(done) >= batch_size:
+                    yield done[:batch_size]
+                    done = done[batch_size:]
+            if done:
+                yield done
+        finally:
+            # After a failure (or the caller stopping early), don't leave
+            # calls running against a client about to be closed
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, *finished, return_exceptions=True)
@@ -1,26 +1,36 @@
 """
 Pipeline runner — parses NPI data and loads pharmacies into SQLite.
-Run this directly: python3 run_pipeline.py
+Run this directly: python3 run_pipeline.py [--workers N] [--refresh-cache] [--resume] [--bulk]
 """
+import argparse
+import io
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import sqlite3
 import os
-import re
 import hashlib
 import time
 from datetime import datetime
+from multiprocessing import Pool
 from pathlib import Path
 
+from extract_npi_dates import add_columns_if_missing, recalc_scores
+from zip_demographics import ensure_zip_demographics
+# The byte-level NPPES scan and file fingerprints are shared with the
+# backend loader; neither module imports anything else from the backend
+from backend.app.pipeline.nppes_scan import (
+    PHARMACY_TAXONOMIES, BLOCK_SIZE, RANGE_SIZE, prefilter_records, count_records, byte_ranges,
+)
+from backend.app.pipeline.fingerprint import file_fingerprint
+
 APP_DIR = Path(__file__).parent
 DATA_DIR = APP_DIR / "data"
 DB_PATH = APP_DIR / "pharmacy_intel.db"
-
-# Pharmacy taxonomy codes
-PHARMACY_TAXONOMIES = {
-    "183500000X", "3336C0002X", "3336C0003X", "3336C0004X",
-    "3336H0001X", "3336I0012X", "3336L0003X", "3336M0002X",
-    "3336M0003X", "3336N0007X", "3336S0011X", "333600000X",
-}
+CACHE_DIR = DATA_DIR / "cache"
+# Parquet key-value metadata on the subset cache: NPPES rows in the full file
+CACHE_ROWS_KEY = b"nppes_rows_scanned"
 
 CHAIN_MAP = {
     "CVS": r"\bCVS\b",
@@ -52,47 +62,368 @@ INSTITUTIONAL_PATTERNS = [
 ]
 
 
-def normalize_phone(phone):
-    if not phone:
+NPPES_COLUMNS = [
+    "NPI", "Entity Type Code",
+    "Provider Organization Name (Legal Business Name)",
+    "Provider Other Organization Name",
+    "Provider First Line Business Practice Location Address",
+    "Provider Second Line Business Practice Location Address",
+    "Provider Business Practice Location Address City Name",
+    "Provider Business Practice Location Address State Name",
+    "Provider Business Practice Location Address Postal Code",
+    "Provider Business Practice Location Address Telephone Number",
+    "Provider Business Practice Location Address Fax Number",
+    "Healthcare Provider Taxonomy Code_1",
+    "Healthcare Provider Taxonomy Code_2",
+    "Healthcare Provider Taxonomy Code_3",
+    "Authorized Official Last Name",
+    "Authorized Official First Name",
+    "Authorized Official Title or Position",
+    "Authorized Official Telephone Number",
+    # Registry dates (formerly a second pass in extract_npi_dates.py)
+    "Provider Enumeration Date",
+    "Last Update Date",
+    "NPI Deactivation Reason Code",
+    "NPI Deactivation Date",
+]
+
+PHARMACY_COLUMNS = [
+    "npi", "organization_name", "dba_name", "entity_type",
+    "address_line1", "address_line2", "city", "state", "zip", "phone", "fax",
+    "taxonomy_code", "is_chain", "is_independent", "is_institutional",
+    "chain_parent", "authorized_official_name", "authorized_official_title",
+    "authorized_official_phone", "ownership_type", "dedup_key",
+    "enumeration_date", "last_update_date", "npi_deactivation_date",
+    "deactivation_reason", "years_in_operation",
+    "first_seen", "last_refreshed",
+]
+
+# Columns loaded from NPPES. An upsert rewrites only these, and only when one
+# of them changed, so ids, first_seen and enrichment columns survive reloads.
+# years_in_operation is derived from the calendar, so it doesn't count as a
+# change; see YEARS_SQL. The chain flags count (a CHAIN_MAP change reaches
+# every row) except where multi-location clustering set them on a row that
+# classifies as independent; clustering re-derives those after every load.
+SOURCE_COLUMNS = [c for c in PHARMACY_COLUMNS if c not in ("npi", "years_in_operation", "first_seen", "last_refreshed")]
+CLUSTERED_COLUMNS = ("is_chain", "is_independent", "chain_parent")
+CHANGE_COLUMNS = [c for c in SOURCE_COLUMNS if c not in CLUSTERED_COLUMNS]
+
+_ON_CONFLICT = f"""
+    ON CONFLICT(npi) DO UPDATE SET
+        {", ".join(f"{c} = excluded.{c}" for c in SOURCE_COLUMNS)},
+        years_in_operation = excluded.years_in_operation,
+        last_refreshed = excluded.last_refreshed
+    WHERE ({", ".join(f"pharmacies.{c}" for c in CHANGE_COLUMNS)})
+        IS NOT ({", ".join(f"excluded.{c}" for c in CHANGE_COLUMNS)})
+        OR (({", ".join(f"pharmacies.{c}" for c in CLUSTERED_COLUMNS)})
+                IS NOT ({", ".join(f"excluded.{c}" for c in CLUSTERED_COLUMNS)})
+            AND NOT (pharmacies.chain_parent IS 'Multi-Location Operator' AND excluded.is_independent = 1))
+"""
+
+UPSERT_SQL = f"""
+    INSERT INTO pharmacies ({", ".join(PHARMACY_COLUMNS)})
+    VALUES ({",".join("?" * len(PHARMACY_COLUMNS))})
+    {_ON_CONFLICT}
+"""
+
+# Bulk mode (--bulk): ranges land in an index-free staging table, then one
+# statement merges it. NPI order makes the index inserts sequential; rowid
+# keeps the last duplicate winning, as with row-by-row upserts.
+STAGING_TABLE = "pharmacies_staging"
+STAGE_SQL = f"""
+    INSERT INTO {STAGING_TABLE} ({", ".join(PHARMACY_COLUMNS)})
+    VALUES ({",".join("?" * len(PHARMACY_COLUMNS))})
+"""
+MERGE_SQL = f"""
+    INSERT INTO pharmacies ({", ".join(PHARMACY_COLUMNS)})
+    SELECT {", ".join(PHARMACY_COLUMNS)} FROM {STAGING_TABLE} WHERE true ORDER BY npi, rowid
+    {_ON_CONFLICT}
+"""
+
+# Same arithmetic as transform_chunk: whole days since enumeration / 365.25
+YEARS_SQL = """
+    UPDATE pharmacies SET years_in_operation = {years}
+    WHERE enumeration_date IS NOT NULL AND years_in_operation IS NOT {years}
+""".format(years="ROUND(CAST(julianday('now', 'localtime') - julianday(enumeration_date) AS INTEGER) / 365.25, 1)")
+
+TAXONOMY_COLS = [
+    "Healthcare Provider Taxonomy Code_1",
+    "Healthcare Provider Taxonomy Code_2",
+    "Healthcare Provider Taxonomy Code_3",
+]
+
+INSTITUTIONAL_RE = "|".join(f"(?:{p})" for p in INSTITUTIONAL_PATTERNS)
+
+# Ingest progress, committed with the rows it covers: the NPPES release
+# (file_fingerprint) and the byte offset loaded up to.
+CHECKPOINT_COLUMNS = [
+    ("source_fingerprint", "TEXT"),
+    ("byte_offset", "INTEGER"),
+    ("rows_scanned", "INTEGER"),
+]
+
+
+def _subset_range(task):
+    """Worker: prefilter and parse one byte range. Returns (NPPES rows, pharmacy subset)."""
+    csv_path, header, start, end = task
+    with open(csv_path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    if not data.endswith(b"\n"):
+        data += b"\n"
+    kept, _ = prefilter_records(data)
+    chunk = pd.read_csv(io.BytesIO(header + kept), usecols=NPPES_COLUMNS, low_memory=False, dtype=str)
+    return count_records(data), pharmacy_subset(chunk)
+
+
+def scan_pharmacy_subsets(csv_path, workers=1, start=0):
+    """
+    Yield (offset, rows, subset) per record-aligned byte range of the CSV,
+    where subset holds the raw projected columns of the pharmacy rows in
+    the range, rows its NPPES record count, and offset the byte offset
+    just past it; scanning can later resume from any yielded offset. With
+    workers > 1 larger ranges are parsed in a process pool and come back in
+    file order, so the output matches a serial run exactly.
+    """
+    header, ranges = byte_ranges(csv_path, RANGE_SIZE if workers > 1 else BLOCK_SIZE, start)
+    tasks = [(str(csv_path), header, begin, end) for begin, end in ranges]
+    if workers <= 1:
+        for (_, end), (lines, subset) in zip(ranges, map(_subset_range, tasks)):
+            yield end, lines, subset
+        return
+
+    print(f"  Parsing with {workers} workers over {len(ranges)} byte ranges")
+    with Pool(workers) as pool:
+        for (_, end), (lines, subset) in zip(ranges, pool.imap(_subset_range, tasks)):
+            yield end, lines, subset
+
+
+def subset_cache_path(csv_path):
+    """Parquet cache of the pharmacy subset, keyed by source fingerprint and projection."""
+    key = hashlib.sha256(f"{file_fingerprint(csv_path)}|{'|'.join(NPPES_COLUMNS)}".encode()).hexdigest()[:16]
+    return CACHE_DIR / f"nppes_pharmacies_{key}.parquet"
+
+
+def read_subset_cache(cache):
+    """
+    (NPPES rows scanned, pharmacy subset) from a subset cache file, or None
+    if there is none or it predates the stored row count.
+    """
+    if not cache.exists():
+        return None
+    table = pq.read_table(cache)
+    rows = (table.schema.metadata or {}).get(CACHE_ROWS_KEY)
+    if rows is None:
         return None
-    digits = re.sub(r"\D", "", phone)
-    if len(digits) == 11 and digits[0] == "1":
-        digits = digits[1:]
-    if len(digits) == 10:
-        return f"({digits[:3]}) {digits[3:6]}-{digits[6:]}"
-    return phone
-
-
-def classify(name, dba):
-    combined = f"{(name or '').upper()} {(dba or '').upper()}"
-    for parent, pattern in CHAIN_MAP.items():
-        if re.search(pattern, combined):
-            return 1, 0, parent
-    return 0, 1, None
-
-
-def check_institutional(name, dba):
-    combined = f"{(name or '').upper()} {(dba or '').upper()}"
-    for p in INSTITUTIONAL_PATTERNS:
-        if re.search(p, combined):
-            return 1
-    return 0
-
-
-def get_ownership_type(name):
-    name = (name or "").upper()
-    if "LLC" in name:
-        return "LLC"
-    elif "INC" in name or "INCORPORATED" in name:
-        return "Corporation"
-    elif "LLP" in name or "PARTNERSHIP" in name:
-        return "Partnership"
-    elif "PC" in name or "PLLC" in name:
-        return "Professional Corporation"
-    return "Unknown"
-
-
-def run():
+    return int(rows), table.to_pandas()
+
+
+def read_pharmacy_subsets(csv_path, workers=1, refresh=False, start=0):
+    """
+    scan_pharmacy_subsets(), served from the columnar cache when this NPPES
+    release has been scanned before; the cache is one subset covering the
+    whole file, along with the file's NPPES row count, so it only serves
+    scans from the start. A full scan rewrites the cache, a resumed one
+    (start > 0) leaves it alone since it never sees the start of the file.
+    """
+    cache = subset_cache_path(csv_path)
+    cached = read_subset_cache(cache) if not refresh and not start else None
+    if cached:
+        print(f"  Loading pharmacy subset from cache: {cache.name}")
+        rows, subset = cached
+        yield os.path.getsize(csv_path), rows, subset
+        return
+
+    frames = []
+    rows = 0
+    for offset, range_rows, subset in scan_pharmacy_subsets(csv_path, workers=workers, start=start):
+        frames.append(subset)
+        rows += range_rows
+        yield offset, range_rows, subset
+
+    if start or not frames:
+        return
+    CACHE_DIR.mkdir(exist_ok=True)
+    for old in CACHE_DIR.glob("nppes_pharmacies_*.parquet"):
+        old.unlink()
+    table = pa.Table.from_pandas(pd.concat(frames), preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, CACHE_ROWS_KEY: str(rows).encode()})
+    tmp = cache.with_suffix(".tmp")
+    pq.write_table(table, tmp)
+    tmp.replace(cache)
+    print(f"  Cached {len(table):,} pharmacy rows: {cache.name}")
+
+
+def _clean(chunk, col):
+    """Stripped string column with missing values as ''."""
+    return chunk[col].fillna("").astype(str).str.strip()
+
+
+def _or_none(series):
+    """Object array with '' replaced by None, ready for executemany."""
+    values = series.to_numpy(dtype=object)
+    values[series.to_numpy() == ""] = None
+    return values
+
+
+def _nullable(series):
+    """Object array with NaN/NaT replaced by None."""
+    return series.astype(object).where(series.notna(), None).to_numpy()
+
+
+def parse_dates(values):
+    """Vectorized extract_npi_dates.parse_date(): MM/DD/YYYY (or ISO, MM-DD-YYYY)."""
+    parsed = pd.to_datetime(values, format="%m/%d/%Y", errors="coerce")
+    for fmt in ("%Y-%m-%d", "%m-%d-%Y"):
+        parsed = parsed.fillna(pd.to_datetime(values, format=fmt, errors="coerce"))
+    return parsed
+
+
+def normalize_phones(phones):
+    """Vectorized (XXX) XXX-XXXX formatting; non-10-digit values pass through."""
+    digits = phones.str.replace(r"\D", "", regex=True)
+    leading_one = (digits.str.len() == 11) & digits.str.startswith("1")
+    digits = digits.where(~leading_one, digits.str[1:])
+    formatted = "(" + digits.str[:3] + ") " + digits.str[3:6] + "-" + digits.str[6:]
+    return phones.where(digits.str.len() != 10, formatted)
+
+
+def classify(org, dba):
+    """Vectorized chain/institutional/ownership classification of name columns."""
+    combined = org + " " + dba
+    parent = pd.Series(None, index=org.index, dtype=object)
+    for name, pattern in CHAIN_MAP.items():
+        hit = parent.isna() & combined.str.contains(pattern, regex=True)
+        parent[hit] = name
+    is_chain = parent.notna().to_numpy().astype(int)
+    inst = combined.str.contains(INSTITUTIONAL_RE, regex=True).to_numpy().astype(int)
+    ownership = np.select(
+        [
+            org.str.contains("LLC", regex=False),
+            org.str.contains("INC", regex=False),
+            org.str.contains("LLP", regex=False) | org.str.contains("PARTNERSHIP", regex=False),
+            org.str.contains("PC", regex=False) | org.str.contains("PLLC", regex=False),
+        ],
+        ["LLC", "Corporation", "Partnership", "Professional Corporation"],
+        default="Unknown",
+    )
+    return is_chain, 1 - is_chain, inst, parent.to_numpy(dtype=object), ownership
+
+
+def pharmacy_subset(chunk):
+    """Rows with a pharmacy taxonomy in Code_1..3 and Entity Type Code 2."""
+    hits = [_clean(chunk, c).isin(PHARMACY_TAXONOMIES) for c in TAXONOMY_COLS]
+    return chunk[(hits[0] | hits[1] | hits[2]) & (_clean(chunk, "Entity Type Code") == "2")]
+
+
+def transform_chunk(chunk, now):
+    """
+    Filter an NPPES chunk down to pharmacy organizations and build the
+    executemany tuples, using boolean masks and column-wise string ops.
+    """
+    chunk = pharmacy_subset(chunk)
+    if chunk.empty:
+        return []
+
+    taxos = [_clean(chunk, c) for c in TAXONOMY_COLS]
+    hits = [t.isin(PHARMACY_TAXONOMIES) for t in taxos]
+    taxonomy = taxos[2].where(hits[2], None)
+    taxonomy = taxos[1].where(hits[1], taxonomy)
+    taxonomy = taxos[0].where(hits[0], taxonomy)
+
+    org = _clean(chunk, "Provider Organization Name (Legal Business Name)").str.upper()
+    dba = _clean(chunk, "Provider Other Organization Name").str.upper()
+    addr1 = _clean(chunk, "Provider First Line Business Practice Location Address").str.upper()
+    zip_code = _clean(chunk, "Provider Business Practice Location Address Postal Code").str[:5]
+
+    auth_first = _clean(chunk, "Authorized Official First Name")
+    auth_last = _clean(chunk, "Authorized Official Last Name")
+    auth_name = (auth_first + " " + auth_last).str.strip()
+
+    is_chain, is_indep, inst, parent, own = classify(org, dba)
+    dedup = [
+        hashlib.md5(f"{o}|{a}|{z}".encode()).hexdigest()
+        for o, a, z in zip(org.tolist(), addr1.tolist(), zip_code.tolist())
+    ]
+
+    enum_date = parse_dates(_clean(chunk, "Provider Enumeration Date"))
+    years = ((pd.Timestamp.now() - enum_date).dt.days / 365.25).round(1)
+
+    n = len(chunk)
+    columns = [
+        _clean(chunk, "NPI").to_numpy(dtype=object),
+        _or_none(org),
+        _or_none(dba),
+        ["organization"] * n,
+        _or_none(addr1),
+        _or_none(_clean(chunk, "Provider Second Line Business Practice Location Address")),
+        _or_none(_clean(chunk, "Provider Business Practice Location Address City Name")),
+        _or_none(_clean(chunk, "Provider Business Practice Location Address State Name").str.upper()),
+        _or_none(zip_code),
+        _or_none(normalize_phones(_clean(chunk, "Provider Business Practice Location Address Telephone Number"))),
+        _or_none(normalize_phones(_clean(chunk, "Provider Business Practice Location Address Fax Number"))),
+        taxonomy.to_numpy(dtype=object),
+        is_chain.tolist(),
+        is_indep.tolist(),
+        inst.tolist(),
+        parent,
+        _or_none(auth_name),
+        _or_none(_clean(chunk, "Authorized Official Title or Position")),
+        _or_none(normalize_phones(_clean(chunk, "Authorized Official Telephone Number"))),
+        own.tolist(),
+        dedup,
+        _nullable(enum_date.dt.strftime("%Y-%m-%d")),
+        _nullable(parse_dates(_clean(chunk, "Last Update Date")).dt.strftime("%Y-%m-%d")),
+        _nullable(parse_dates(_clean(chunk, "NPI Deactivation Date")).dt.strftime("%Y-%m-%d")),
+        _or_none(_clean(chunk, "NPI Deactivation Reason Code")),
+        _nullable(years),
+        [now] * n,
+        [now] * n,
+    ]
+    return list(zip(*columns))
+
+
+def add_checkpoint_columns(conn):
+    """Add the ingest checkpoint columns to pipeline_runs if they don't exist."""
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(pipeline_runs)").fetchall()}
+    for col_name, col_type in CHECKPOINT_COLUMNS:
+        if col_name not in existing:
+            conn.execute(f"ALTER TABLE pipeline_runs ADD COLUMN {col_name} {col_type}")
+    conn.commit()
+
+
+def merge_staging(conn):
+    """
+    Merge the staging table into pharmacies in one transaction and drop it.
+    Into an empty table, the secondary indexes are dropped first and rebuilt
+    once afterwards, then ANALYZEd. Returns rows inserted or changed.
+    """
+    first_load = conn.execute("SELECT NOT EXISTS (SELECT 1 FROM pharmacies)").fetchone()[0]
+    indexes = []
+    if first_load:
+        # Only CREATE INDEX indexes; the UNIQUE(npi) autoindex backs ON CONFLICT
+        indexes = conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'pharmacies' AND sql IS NOT NULL"
+        ).fetchall()
+        for name, _ in indexes:
+            conn.execute(f"DROP INDEX {name}")
+
+    changes_before = conn.total_changes
+    conn.execute(MERGE_SQL)
+    rows_written = conn.total_changes - changes_before
+    for _, sql in indexes:
+        conn.execute(sql)
+    conn.execute(f"DROP TABLE {STAGING_TABLE}")
+    conn.commit()
+
+    if first_load:
+        print(f"  Rebuilt {len(indexes)} indexes")
+        conn.execute("ANALYZE")
+        conn.commit()
+    return rows_written
+
+
+def run(workers=1, refresh_cache=False, resume=False, bulk=False):
     # Find CSV
     csv_path = None
     for f in DATA_DIR.glob("npidata_pfile_*.csv"):
@@ -128,7 +459,10 @@ def run():
             authorized_official_phone TEXT, ownership_type TEXT,
             medicare_claims_count INTEGER, medicare_beneficiary_count INTEGER,
             medicare_total_cost REAL, latitude REAL, longitude REAL,
-            dedup_key TEXT, first_seen TEXT, last_refreshed TEXT
+            dedup_key TEXT, first_seen TEXT, last_refreshed TEXT,
+            enumeration_date TEXT, last_update_date TEXT,
+            npi_deactivation_date TEXT, deactivation_reason TEXT,
+            years_in_operation REAL
         );
         CREATE INDEX IF NOT EXISTS idx_pharmacies_npi ON pharmacies(npi);
         CREATE INDEX IF NOT EXISTS idx_pharmacies_state ON pharmacies(state);
@@ -149,135 +483,128 @@ def run():
             error_log TEXT
         );
     """)
+    # Databases created before dates were loaded here lack the date columns
+    add_columns_if_missing(conn)
+    add_checkpoint_columns(conn)
+    ensure_zip_demographics(conn)
 
     now = datetime.utcnow().isoformat()
-    conn.execute("INSERT INTO pipeline_runs (started_at, status) VALUES (?, ?)", (now, "running"))
+    fingerprint = file_fingerprint(csv_path)
+    start_offset = total_rows = pharmacy_count = 0
+    checkpoint = None
+    if resume and not refresh_cache and read_subset_cache(subset_cache_path(csv_path)):
+        # The cache always covers the whole file, so resuming part way gains nothing
+        print("Pharmacy subset is cached for this NPPES file; loading it whole instead of resuming")
+        resume = False
+    if resume:
+        checkpoint = conn.execute(
+            """SELECT id, byte_offset, rows_scanned, records_processed FROM pipeline_runs
+               WHERE status != 'completed' AND source_fingerprint = ? AND byte_offset > 0
+               ORDER BY id DESC LIMIT 1""",
+            (fingerprint,),
+        ).fetchone()
+        if not checkpoint:
+            print("No checkpoint for this NPPES file; starting from the beginning")
+
+    staged = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (STAGING_TABLE,)
+    ).fetchone()
+    if not checkpoint:
+        # Leftover from an abandoned bulk run
+        conn.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+    elif staged and not bulk:
+        print("The interrupted run was a bulk load; resuming in bulk mode")
+        bulk = True
+    if bulk and not (checkpoint and staged):
+        conn.execute(f"CREATE TABLE {STAGING_TABLE} ({', '.join(PHARMACY_COLUMNS)})")
     conn.commit()
-    run_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
-
-    cols = [
-        "NPI", "Entity Type Code",
-        "Provider Organization Name (Legal Business Name)",
-        "Provider Other Organization Name",
-        "Provider First Line Business Practice Location Address",
-        "Provider Second Line Business Practice Location Address",
-        "Provider Business Practice Location Address City Name",
-        "Provider Business Practice Location Address State Name",
-        "Provider Business Practice Location Address Postal Code",
-        "Provider Business Practice Location Address Telephone Number",
-        "Provider Business Practice Location Address Fax Number",
-        "Healthcare Provider Taxonomy Code_1",
-        "Healthcare Provider Taxonomy Code_2",
-        "Healthcare Provider Taxonomy Code_3",
-        "Authorized Official Last Name",
-        "Authorized Official First Name",
-        "Authorized Official Title or Position",
-        "Authorized Official Telephone Number",
-    ]
+
+    if checkpoint:
+        run_id, start_offset, total_rows, pharmacy_count = checkpoint
+        conn.execute("UPDATE pipeline_runs SET status = 'running' WHERE id = ?", (run_id,))
+        conn.commit()
+        print(f"Resuming run {run_id} at byte {start_offset:,} ({total_rows:,} rows scanned, {pharmacy_count:,} pharmacies loaded)")
+    else:
+        conn.execute(
+            "INSERT INTO pipeline_runs (started_at, status, source_fingerprint) VALUES (?, ?, ?)",
+            (now, "running", fingerprint),
+        )
+        conn.commit()
+        run_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
 
     start_time = time.time()
-    total_rows = 0
-    pharmacy_count = 0
-    batch = []
-    batch_size = 5000
-    chunk_size = 100000
+    rows_this_run = 0
+    rows_written = 0
 
     print("=" * 60)
     print("STAGE 1: Parsing NPI records for pharmacies...")
     print("=" * 60)
 
-    for chunk in pd.read_csv(str(csv_path), usecols=cols, chunksize=chunk_size, low_memory=False, dtype=str):
-        total_rows += len(chunk)
-
-        for _, row in chunk.iterrows():
-            taxos = [
-                str(row.get("Healthcare Provider Taxonomy Code_1", "") or "").strip(),
-                str(row.get("Healthcare Provider Taxonomy Code_2", "") or "").strip(),
-                str(row.get("Healthcare Provider Taxonomy Code_3", "") or "").strip(),
-            ]
-            matching = [t for t in taxos if t in PHARMACY_TAXONOMIES]
-            if not matching:
-                continue
-            if str(row.get("Entity Type Code", "")).strip() != "2":
-                continue
-
-            pharmacy_count += 1
-            npi = str(row["NPI"]).strip()
-            org = str(row.get("Provider Organization Name (Legal Business Name)", "") or "").strip().upper() or None
-            dba = str(row.get("Provider Other Organization Name", "") or "").strip().upper() or None
-            city = str(row.get("Provider Business Practice Location Address City Name", "") or "").strip() or None
-            state = str(row.get("Provider Business Practice Location Address State Name", "") or "").strip().upper() or None
-            zip_code = str(row.get("Provider Business Practice Location Address Postal Code", "") or "").strip()[:5] or None
-            phone = normalize_phone(str(row.get("Provider Business Practice Location Address Telephone Number", "") or "").strip())
-            fax = normalize_phone(str(row.get("Provider Business Practice Location Address Fax Number", "") or "").strip())
-            addr1 = str(row.get("Provider First Line Business Practice Location Address", "") or "").strip().upper() or None
-            addr2 = str(row.get("Provider Second Line Business Practice Location Address", "") or "").strip() or None
-
-            auth_first = str(row.get("Authorized Official First Name", "") or "").strip()
-            auth_last = str(row.get("Authorized Official Last Name", "") or "").strip()
-            auth_name = f"{auth_first} {auth_last}".strip() if auth_first or auth_last else None
-            auth_title = str(row.get("Authorized Official Title or Position", "") or "").strip() or None
-            auth_phone = normalize_phone(str(row.get("Authorized Official Telephone Number", "") or "").strip())
-
-            is_chain, is_indep, parent = classify(org, dba)
-            inst = check_institutional(org, dba)
-            own = get_ownership_type(org)
-            dedup = hashlib.md5(f"{(org or '').upper()}|{(addr1 or '').upper()}|{(zip_code or '')[:5]}".encode()).hexdigest()
-
-            batch.append((
-                npi, org, dba, "organization", addr1, addr2, city, state,
-                zip_code, phone, fax, matching[0], is_chain, is_indep, inst,
-                parent, auth_name, auth_title, auth_phone, own, dedup,
-                now, now,
-            ))
-
-            if len(batch) >= batch_size:
-                conn.executemany("""
-                    INSERT OR REPLACE INTO pharmacies (
-                        npi, organization_name, dba_name, entity_type,
-                        address_line1, address_line2, city, state, zip, phone, fax,
-                        taxonomy_code, is_chain, is_independent, is_institutional,
-                        chain_parent, authorized_official_name, authorized_official_title,
-                        authorized_official_phone, ownership_type, dedup_key,
-                        first_seen, last_refreshed
-                    ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-                """, batch)
-                conn.commit()
-                batch = []
+    for offset, scanned, subset in read_pharmacy_subsets(csv_path, workers=workers, refresh=refresh_cache,
+                                                         start=start_offset):
+        rows = transform_chunk(subset, now)
+        total_rows += scanned
+        rows_this_run += scanned
+        pharmacy_count += len(rows)
+
+        # Rows and checkpoint commit together, so a resume never skips or
+        # half-loads a range
+        if bulk:
+            conn.executemany(STAGE_SQL, rows)
+        else:
+            changes_before = conn.total_changes
+            conn.executemany(UPSERT_SQL, rows)
+            rows_written += conn.total_changes - changes_before
+        conn.execute(
+            "UPDATE pipeline_runs SET byte_offset = ?, rows_scanned = ?, records_processed = ? WHERE id = ?",
+            (offset, total_rows, pharmacy_count, run_id),
+        )
+        conn.commit()
 
         elapsed = time.time() - start_time
-        rate = total_rows / elapsed if elapsed > 0 else 0
+        rate = rows_this_run / elapsed if elapsed > 0 else 0
         print(f"  Scanned {total_rows:>10,} NPI rows | Found {pharmacy_count:>8,} pharmacies | {rate:,.0f} rows/sec | {elapsed:.0f}s")
 
-    # Flush remaining
-    if batch:
-        conn.executemany("""
-            INSERT OR REPLACE INTO pharmacies (
-                npi, organization_name, dba_name, entity_type,
-                address_line1, address_line2, city, state, zip, phone, fax,
-                taxonomy_code, is_chain, is_independent, is_institutional,
-                chain_parent, authorized_official_name, authorized_official_title,
-                authorized_official_phone, ownership_type, dedup_key,
-                first_seen, last_refreshed
-            ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-        """, batch)
-        conn.commit()
+    if bulk:
+        print(f"  Merging {pharmacy_count:,} staged rows into pharmacies...")
+        rows_written = merge_staging(conn)
+    print(f"  Inserted or changed {rows_written:,} pharmacy rows")
+    result = conn.execute(YEARS_SQL)
+    conn.commit()
+    print(f"  Refreshed years in operation on {result.rowcount:,} unchanged rows")
 
     print()
     print("=" * 60)
     print("STAGE 2: Multi-location clustering...")
     print("=" * 60)
-    result = conn.execute("""
+    # Unchanged rows keep the last run's flags, so count already-flagged
+    # locations too, and unflag groups that have shrunk below the threshold
+    operators = """
+        SELECT organization_name FROM pharmacies
+        WHERE (is_independent = 1 OR chain_parent = 'Multi-Location Operator')
+            AND organization_name IS NOT NULL
+        GROUP BY organization_name
+        HAVING COUNT(*) >= 10
+    """
+    unflagged = conn.execute(f"""
+        UPDATE pharmacies SET is_chain = 0, is_independent = 1, chain_parent = NULL
+        WHERE chain_parent = 'Multi-Location Operator' AND organization_name NOT IN ({operators})
+    """).rowcount
+    flagged = conn.execute(f"""
         UPDATE pharmacies SET is_chain = 1, is_independent = 0, chain_parent = 'Multi-Location Operator'
-        WHERE is_independent = 1 AND organization_name IN (
-            SELECT organization_name FROM pharmacies
-            WHERE is_independent = 1
-            GROUP BY organization_name
-            HAVING COUNT(*) >= 10
-        )
-    """)
+        WHERE is_independent = 1 AND organization_name IN ({operators})
+    """).rowcount
     conn.commit()
-    print(f"  Updated {result.rowcount} records as multi-location operators")
+    print(f"  Updated {flagged} records as multi-location operators, {unflagged} no longer")
+
+    # Scores exist only once app.py has created the enrichment columns
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(pharmacies)").fetchall()}
+    if "acquisition_score" in existing:
+        print()
+        print("=" * 60)
+        print("STAGE 3: Recalculating acquisition scores...")
+        print("=" * 60)
+        recalc_scores(conn)
 
     # Final stats
     total = conn.execute("SELECT COUNT(*) FROM pharmacies").fetchone()[0]
@@ -309,4 +636,14 @@ def run():
 
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="Load NPPES pharmacies into SQLite.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="parse NPPES byte ranges in this many processes")
+    parser.add_argument("--refresh-cache", action="store_true",
+                        help="rescan the CSV even if its pharmacy subset is cached")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted run from its last checkpoint")
+    parser.add_argument("--bulk", action="store_true",
+                        help="stage rows in an index-free table and merge them in one statement")
+    args = parser.parse_args()
+    run(workers=args.workers, refresh_cache=args.refresh_cache, resume=args.resume, bulk=args.bulk)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The root scripts are plain modules, not a package
+sys.path.append(str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,110 @@
+"""enrich_data.calculate_competition: incremental recounts must match a full GROUP BY."""
+import sqlite3
+
+import pytest
+
+import enrich_data
+from zip_demographics import ensure_zip_demographics
+
+# (npi, zip, is_chain, is_independent)
+PHARMACIES = [
+    ("1000000001", "02110", 0, 1),
+    ("1000000002", "02110", 1, 0),
+    ("1000000003", "02110", 0, 1),
+    ("1000000004", "78701", 0, 1),
+    ("1000000005", "78701", 1, 0),
+    ("1000000006", "60601", 0, 1),
+    ("1000000007", "94103", 0, 1),
+]
+
+COMPETITION_COLUMNS = ["pharmacy_count", "chain_count", "independent_count", "pharmacies_per_10k", "competition_score"]
+
+
+@pytest.fixture
+def db(monkeypatch, tmp_path):
+    path = tmp_path / "pharmacy_intel.db"
+    monkeypatch.setattr(enrich_data, "DB_PATH", path)
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE pharmacies (
+            id INTEGER PRIMARY KEY, npi TEXT UNIQUE, zip TEXT,
+            is_chain INTEGER, is_independent INTEGER, npi_deactivation_date TEXT,
+            zip_pharmacy_count INTEGER, zip_chain_count INTEGER, zip_independent_count INTEGER,
+            zip_pharmacies_per_10k REAL, competition_score REAL
+        )
+    """)
+    conn.executemany("INSERT INTO pharmacies (npi, zip, is_chain, is_independent) VALUES (?, ?, ?, ?)", PHARMACIES)
+    ensure_zip_demographics(conn)
+    conn.executemany("INSERT INTO zip_demographics (zip, population) VALUES (?, ?)",
+                     [("02110", 20000), ("78701", 4000), ("60601", 50000)])
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def full_recount(conn):
+    """{zip: COMPETITION_COLUMNS} recomputed from scratch over every pharmacy."""
+    rows = conn.execute("""
+        SELECT zip, pharmacy_count, chain_count, independent_count, pharmacies_per_10k,
+               CASE
+                   WHEN pharmacies_per_10k <= 1.0 THEN 100
+                   WHEN pharmacies_per_10k <= 2.0 THEN 80
+                   WHEN pharmacies_per_10k <= 3.0 THEN 60
+                   WHEN pharmacies_per_10k <= 5.0 THEN 40
+                   WHEN pharmacies_per_10k <= 8.0 THEN 20
+                   WHEN pharmacies_per_10k IS NOT NULL THEN 10
+               END
+        FROM (
+            SELECT c.*,
+                   CASE WHEN d.population > 0 AND c.pharmacy_count > 0
+                        THEN ROUND(CAST(c.pharmacy_count AS REAL) / d.population * 10000, 2) END
+                       AS pharmacies_per_10k
+            FROM (
+                SELECT zip,
+                       SUM(npi_deactivation_date IS NULL) AS pharmacy_count,
+                       SUM(is_chain = 1 AND npi_deactivation_date IS NULL) AS chain_count,
+                       SUM(is_independent = 1 AND npi_deactivation_date IS NULL) AS independent_count
+                FROM pharmacies GROUP BY zip
+            ) c
+            LEFT JOIN zip_demographics d ON d.zip = c.zip
+        )
+    """).fetchall()
+    return {row[0]: row[1:] for row in rows}
+
+
+def assert_matches_full_recount(conn):
+    expected = full_recount(conn)
+    stored = conn.execute(f"SELECT zip, {', '.join(COMPETITION_COLUMNS)} FROM zip_competition").fetchall()
+    assert {row[0]: row[1:] for row in stored} == expected
+    per_pharmacy = conn.execute("""
+        SELECT zip, zip_pharmacy_count, zip_chain_count, zip_independent_count,
+               zip_pharmacies_per_10k, competition_score
+        FROM pharmacies
+    """).fetchall()
+    assert all(row[1:] == expected[row[0]] for row in per_pharmacy)
+
+
+def test_incremental_recount_matches_full_recount(db):
+    enrich_data.calculate_competition()
+    assert_matches_full_recount(db)
+
+    # Moved out of 02110 into 78701; 94103 loses its only pharmacy
+    db.execute("UPDATE pharmacies SET zip = '78701' WHERE npi = '1000000001'")
+    db.execute("UPDATE pharmacies SET zip = '60601' WHERE npi = '1000000007'")
+    db.execute("UPDATE pharmacies SET npi_deactivation_date = '2026-02-10' WHERE npi = '1000000005'")
+    db.execute("UPDATE pharmacies SET is_chain = 1, is_independent = 0 WHERE npi = '1000000006'")
+    db.commit()
+    enrich_data.calculate_competition()
+
+    assert_matches_full_recount(db)
+    assert db.execute("SELECT COUNT(*) FROM zip_competition WHERE zip = '94103'").fetchone() == (0,)
+    assert db.execute("SELECT zip, pharmacy_count FROM zip_competition WHERE zip = '78701'").fetchone() == ("78701", 2)
+
+
+def test_population_change_recounts_its_zip(db):
+    enrich_data.calculate_competition()
+    db.execute("UPDATE zip_demographics SET population = 1000 WHERE zip = '60601'")
+    db.commit()
+    enrich_data.calculate_competition()
+
+    assert_matches_full_recount(db)
@@ -0,0 +1,195 @@
+"""fetcher.py against httpx.MockTransport: retries, rate limiting, map() batching and the cache."""
+import asyncio
+import json
+import os
+import time
+
+import httpx
+import pytest
+
+import fetcher
+from fetcher import CacheMiss, Fetcher, ResponseCache
+
+URL = "http://api.test/data"
+
+
+class Server:
+    """MockTransport handler that replays queued responses, then answers 200 with the query string."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        if self.responses:
+            response = self.responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        return httpx.Response(200, json={"q": request.url.query.decode()})
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Record the delays fetcher sleeps for, without waiting."""
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def sleep(delay):
+        delays.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(fetcher.asyncio, "sleep", sleep)
+    return delays
+
+
+def fetch(server, *calls, **options):
+    """Run each coroutine function in calls against one Fetcher on server; returns it and their results."""
+    async def main():
+        async with Fetcher(transport=httpx.MockTransport(server), rate=1000, **options) as f:
+            return f, [await call(f) for call in calls]
+    return asyncio.run(main())
+
+
+def test_retries_honour_retry_after(sleeps):
+    server = Server(
+        httpx.Response(429, headers={"Retry-After": "7"}),
+        httpx.ConnectError("refused"),
+        httpx.Response(503),
+    )
+    f, [resp] = fetch(server, lambda f: f.get(URL), backoff_base=0.5)
+
+    assert resp.status_code == 200
+    assert f.retries == 3
+    assert len(server.requests) == 4
+    assert sleeps[0] == 7
+    assert 0.5 <= sleeps[1] <= 1.0  # 0.5 * 2 ** attempt, jittered by 0.5-1.0
+    assert 1.0 <= sleeps[2] <= 2.0
+
+
+def test_gives_up_after_max_retries(sleeps):
+    _, [resp] = fetch(Server(*[httpx.Response(503)] * 3), lambda f: f.get(URL), max_retries=2)
+    assert resp.status_code == 503
+
+    with pytest.raises(httpx.ConnectError):
+        fetch(Server(*[httpx.ConnectError("refused")] * 3), lambda f: f.get(URL), max_retries=2)
+
+
+def test_token_taken_inside_semaphore(monkeypatch):
+    held = []
+    acquire = fetcher.TokenBucket.acquire
+
+    async def main():
+        async with Fetcher(transport=httpx.MockTransport(Server()), concurrency=1, rate=1000) as f:
+            async def recording_acquire(bucket):
+                held.append(f.semaphore.locked())
+                await acquire(bucket)
+
+            monkeypatch.setattr(fetcher.TokenBucket, "acquire", recording_acquire)
+            await asyncio.gather(*(f.get(URL, params={"i": i}) for i in range(5)))
+
+    asyncio.run(main())
+    assert held == [True] * 5
+
+
+def test_map_yields_batches():
+    async def main():
+        async with Fetcher(transport=httpx.MockTransport(Server()), rate=1000) as f:
+            async def one(i):
+                resp = await f.get(URL, params={"i": i})
+                return resp.json()["q"]
+            return [batch async for batch in f.map(one, range(10), batch_size=4)]
+
+    batches = asyncio.run(main())
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    assert sorted(q for batch in batches for q in batch) == sorted(f"i={i}" for i in range(10))
+
+
+def test_cache_serves_repeats(tmp_path):
+    server = Server(httpx.Response(404))
+    cache = ResponseCache(tmp_path)
+    _, (missing, first, second) = fetch(
+        server,
+        lambda f: f.get(URL, params={"i": 0}),
+        lambda f: f.get(URL, params={"i": 1}),
+        lambda f: f.get(URL, params={"i": 1}),
+        cache=cache,
+    )
+
+    assert missing.status_code == 404
+    assert second.json() == first.json() == {"q": "i=1"}
+    assert len(server.requests) == 2  # the 404 isn't cached, the repeat is
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_offline_uses_stale_entries_only(tmp_path):
+    fetch(Server(), lambda f: f.get(URL), cache=ResponseCache(tmp_path))
+
+    server = Server()
+    offline = ResponseCache(tmp_path, default_ttl=0, offline=True)
+    _, [resp] = fetch(server, lambda f: f.get(URL), cache=offline)
+    assert resp.json() == {"q": ""}
+
+    with pytest.raises(CacheMiss):
+        fetch(server, lambda f: f.get(URL, params={"i": 1}), cache=offline)
+    assert server.requests == []
+
+
+def test_expired_entries_are_refetched(tmp_path):
+    server = Server()
+    cache = ResponseCache(tmp_path, default_ttl=60)
+    fetch(server, lambda f: f.get(URL), cache=cache)
+
+    path = cache.path(URL)
+    entry = json.loads(path.read_text())
+    entry["fetched_at"] -= 120
+    path.write_text(json.dumps(entry))
+
+    _, [resp] = fetch(server, lambda f: f.get(URL), cache=cache)
+    assert resp.json() == {"q": ""}
+    assert len(server.requests) == 2
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_eviction_drops_least_recently_used(tmp_path):
+    cache = ResponseCache(tmp_path)
+    put = lambda i: cache.put(URL, {"i": i}, httpx.Response(200, json={"i": i}))
+    put(0)
+    cache.max_bytes = int(cache.size * 3.5)  # room for three entries
+    put(1)
+    put(2)
+    now = time.time()
+    for i, age in enumerate([40, 30, 20]):
+        os.utime(cache.path(URL, {"i": i}), (now - age, now - age))
+
+    assert cache.get(URL, {"i": 0}) is not None  # now the most recently used
+    put(3)
+
+    assert [cache.path(URL, {"i": i}).exists() for i in range(4)] == [True, False, True, True]
+    on_disk = sum(p.stat().st_size for p in tmp_path.glob("*/*.json"))
+    assert on_disk == cache.size <= cache.max_bytes * 0.9
+
+
+def test_map_cancels_pending_calls_on_failure():
+    cancelled = []
+
+    async def main():
+        server = Server(httpx.ConnectError("refused"))
+        async with Fetcher(transport=httpx.MockTransport(server), rate=1000, max_retries=0) as f:
+            async def one(i):
+                if i == 0:
+                    return await f.get(URL)
+                try:
+                    await asyncio.Event().wait()
+                except asyncio.CancelledError:
+                    cancelled.append(i)
+                    raise
+
+            with pytest.raises(httpx.ConnectError):
+                async for _ in f.map(one, range(5), batch_size=10):
+                    pass
+        return asyncio.all_tasks() - {asyncio.current_task()}
+
+    assert asyncio.run(main()) == set()
+    assert sorted(cancelled) == [1, 2, 3, 4]
@@ -0,0 +1,141 @@
+"""run_pipeline.py: parallel ingest must load exactly what a serial run loads."""
+import csv
+import random
+import sqlite3
+
+import pytest
+
+import run_pipeline
+
+TAXONOMY_COLS = run_pipeline.TAXONOMY_COLS
+COLUMNS = run_pipeline.NPPES_COLUMNS + ["Replacement NPI", "Healthcare Provider Taxonomy Code_4"]
+NAMES = [
+    "CVS PHARMACY #123", "MAIN STREET DRUG LLC", "HEALTHMART INC", "GOOD HOSPITAL PHARMACY",
+    'SMITH & SONS, "THE" DRUG', "FAMILY PHARMACY PLLC", "BIGCHAIN RX",
+]
+
+
+def write_nppes(path, n, seed=7):
+    """A synthetic NPPES CSV, quoted like the real one, with embedded newlines and quotes."""
+    rng = random.Random(seed)
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator="\n")
+        w.writerow(COLUMNS)
+        for i in range(n):
+            row = dict.fromkeys(COLUMNS, "")
+            row["NPI"] = str(1000000000 + i)
+            row["Entity Type Code"] = rng.choice("122")
+            if rng.random() < 0.3:
+                row[rng.choice(TAXONOMY_COLS)] = rng.choice(sorted(run_pipeline.PHARMACY_TAXONOMIES))
+            else:
+                row["Healthcare Provider Taxonomy Code_4"] = "3336C0003X"  # not a column we read
+            name = rng.choice(NAMES)
+            if rng.random() < 0.1:
+                name += "\nSECOND LINE"
+            if rng.random() < 0.05:
+                name += ' "183500000X"'
+            row["Provider Organization Name (Legal Business Name)"] = name
+            row["Provider Other Organization Name"] = rng.choice(["", "BEST RX", "DBA\n\"MULTI\"\nLINE"])
+            row["Provider First Line Business Practice Location Address"] = f"{rng.randint(1, 999)} Main St"
+            row["Provider Business Practice Location Address City Name"] = rng.choice(["Austin", "Boston"])
+            row["Provider Business Practice Location Address State Name"] = rng.choice(["tx", "MA"])
+            row["Provider Business Practice Location Address Postal Code"] = rng.choice(["787010000", "02110"])
+            row["Provider Business Practice Location Address Telephone Number"] = rng.choice(["5125551234", ""])
+            row["Provider Enumeration Date"] = rng.choice(["05/23/2005", "", "12/31/2019"])
+            row["NPI Deactivation Date"] = rng.choice(["", "", "03/01/2023"])
+            row["Authorized Official Last Name"] = rng.choice(["Smith", ""])
+            w.writerow(row.values())
+
+
+def expected_npis(path):
+    """Pharmacy NPIs per the csv module, independent of the byte-level scan."""
+    with open(path, newline="") as f:
+        return sorted(
+            r["NPI"] for r in csv.DictReader(f)
+            if r["Entity Type Code"] == "2" and any(r[c] in run_pipeline.PHARMACY_TAXONOMIES for c in TAXONOMY_COLS)
+        )
+
+
+def load(monkeypatch, tmp_path, name, workers):
+    monkeypatch.setattr(run_pipeline, "CACHE_DIR", tmp_path / f"{name}_cache")
+    return load_into(monkeypatch, tmp_path, name, workers)
+
+
+def load_into(monkeypatch, tmp_path, name, workers=1):
+    """Run the pipeline into a fresh database; returns (pharmacy rows, rows scanned)."""
+    monkeypatch.setattr(run_pipeline, "DB_PATH", tmp_path / f"{name}.db")
+    run_pipeline.run(workers=workers)
+    conn = sqlite3.connect(tmp_path / f"{name}.db")
+    columns = [c for c in run_pipeline.PHARMACY_COLUMNS if c not in ("first_seen", "last_refreshed")]
+    rows = conn.execute(f"SELECT id, {', '.join(columns)} FROM pharmacies ORDER BY npi").fetchall()
+    scanned = conn.execute("SELECT rows_scanned FROM pipeline_runs").fetchone()[0]
+    conn.close()
+    return rows, scanned
+
+
+@pytest.fixture
+def nppes(monkeypatch, tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    path = data_dir / "npidata_pfile_20050523-20260208.csv"
+    write_nppes(path, 3000)
+    monkeypatch.setattr(run_pipeline, "DATA_DIR", data_dir)
+    # Small blocks and ranges, so both modes split the file many times
+    monkeypatch.setattr(run_pipeline, "BLOCK_SIZE", 16 * 1024)
+    monkeypatch.setattr(run_pipeline, "RANGE_SIZE", 16 * 1024)
+    return path
+
+
+def test_parallel_matches_serial(nppes, monkeypatch, tmp_path):
+    serial, serial_scanned = load(monkeypatch, tmp_path, "serial", workers=1)
+    parallel, parallel_scanned = load(monkeypatch, tmp_path, "parallel", workers=4)
+
+    assert [row[1] for row in serial] == expected_npis(nppes)
+    assert parallel == serial
+    assert serial_scanned == parallel_scanned == 3000
+
+
+def test_cached_run_reports_rows_scanned(nppes, monkeypatch, tmp_path, capsys):
+    loaded, scanned = load(monkeypatch, tmp_path, "scan", workers=1)
+    capsys.readouterr()
+
+    # Same CACHE_DIR, fresh database: the second run reads the cache
+    replayed, replay_scanned = load_into(monkeypatch, tmp_path, "replay")
+    assert "Loading pharmacy subset from cache" in capsys.readouterr().out
+    assert replayed == loaded
+    assert replay_scanned == scanned == 3000
+
+
+def test_reload_keeps_clustering(nppes, monkeypatch, tmp_path, capsys):
+    loaded, _ = load(monkeypatch, tmp_path, "reload", workers=1)
+    first = capsys.readouterr().out
+    assert "Updated 0 records as multi-location operators" not in first
+
+    # Same file into the same database: nothing to write, no flags to flip back
+    reloaded, _ = load_into(monkeypatch, tmp_path, "reload")
+    second = capsys.readouterr().out
+    assert "Inserted or changed 0 pharmacy rows" in second
+    assert "Updated 0 records as multi-location operators, 0 no longer" in second
+    assert reloaded == loaded
+
+
+def test_chain_map_change_reclassifies(nppes, monkeypatch, tmp_path):
+    load(monkeypatch, tmp_path, "rules", workers=1)
+
+    # Same file from the subset cache, under different rules
+    chain_map = {"HEALTHMART": r"\bHEALTHMART\b", **run_pipeline.CHAIN_MAP}
+    del chain_map["CVS"]
+    monkeypatch.setattr(run_pipeline, "CHAIN_MAP", chain_map)
+    load_into(monkeypatch, tmp_path, "rules")
+
+    conn = sqlite3.connect(tmp_path / "rules.db")
+    flags = set(conn.execute(
+        "SELECT organization_name, is_chain, is_independent, chain_parent FROM pharmacies "
+        "WHERE organization_name IN ('HEALTHMART INC', 'CVS PHARMACY #123')"
+    ).fetchall())
+    conn.close()
+    # CVS is no longer a known chain, but still has enough locations to cluster
+    assert flags == {
+        ("HEALTHMART INC", 1, 0, "HEALTHMART"),
+        ("CVS PHARMACY #123", 1, 0, "Multi-Location Operator"),
+    }
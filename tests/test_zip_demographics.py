@@ -0,0 +1,80 @@
+"""zip_demographics.py: migrating per-pharmacy Census columns into zip_demographics."""
+import sqlite3
+
+import pytest
+
+from zip_demographics import COLUMNS, ensure_zip_demographics
+
+
+class NoDropColumn:
+    """A connection on which ALTER TABLE ... DROP COLUMN fails, as before SQLite 3.35."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, *args):
+        if "DROP COLUMN" in sql:
+            raise sqlite3.OperationalError('near "DROP": syntax error')
+        return self.conn.execute(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+@pytest.fixture
+def legacy_db():
+    """A pharmacies table from before zip_demographics, with Census values on each row."""
+    conn = sqlite3.connect(":memory:")
+    conn.execute(f"""
+        CREATE TABLE pharmacies (
+            id INTEGER PRIMARY KEY, npi TEXT, zip TEXT,
+            {', '.join(f'zip_{name} {dtype}' for name, dtype in COLUMNS)}
+        )
+    """)
+    conn.executemany(
+        "INSERT INTO pharmacies (npi, zip, zip_population, zip_median_income) VALUES (?, ?, ?, ?)",
+        [("1", "021101234", 5000, 70000), ("2", "02110", 5000, 70000), ("3", "78701", None, None)],
+    )
+    yield conn
+    conn.close()
+
+
+def details(conn):
+    cursor = conn.execute("SELECT * FROM pharmacy_details ORDER BY npi")
+    return [c[0] for c in cursor.description], cursor.fetchall()
+
+
+def test_migration_moves_values_per_zip(legacy_db):
+    ensure_zip_demographics(legacy_db)
+
+    assert legacy_db.execute("SELECT zip, population, median_income FROM zip_demographics").fetchall() == [
+        ("02110", 5000, 70000)
+    ]
+    columns = [row[1] for row in legacy_db.execute("PRAGMA table_info(pharmacies)")]
+    assert columns == ["id", "npi", "zip"]
+    names, rows = details(legacy_db)
+    assert [(r[names.index("npi")], r[names.index("zip_population")]) for r in rows] == [
+        ("1", 5000), ("2", 5000), ("3", None)
+    ]
+
+
+def test_view_names_unique_when_columns_cannot_be_dropped(legacy_db):
+    ensure_zip_demographics(NoDropColumn(legacy_db))
+    legacy_db.execute("UPDATE zip_demographics SET population = 6000")
+    legacy_db.execute("ALTER TABLE pharmacies ADD COLUMN acquisition_score REAL")
+    ensure_zip_demographics(NoDropColumn(legacy_db))
+
+    names, rows = details(legacy_db)
+    assert len(names) == len(set(names))
+    assert names[-4:] == ["id", "npi", "zip", "acquisition_score"]
+    # zip_population comes from zip_demographics, not the stale column
+    assert [r[names.index("zip_population")] for r in rows] == [6000, 6000, None]
+
+
+def test_view_picks_up_added_columns(legacy_db):
+    ensure_zip_demographics(legacy_db)
+    legacy_db.execute("ALTER TABLE pharmacies ADD COLUMN acquisition_score REAL")
+    ensure_zip_demographics(legacy_db)
+
+    names, _ = details(legacy_db)
+    assert names[-1] == "acquisition_score"
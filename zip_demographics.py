@@ -0,0 +1,81 @@
+"""
+ZIP demographics — Census ACS values stored once per 5-digit ZIP.
+
+enrich_data.py loads the zip_demographics table. Readers get the values per
+pharmacy through the pharmacy_details view, which joins pharmacies to
+zip_demographics on the first five digits of pharmacies.zip and exposes each
+column under its old zip_* name (population -> zip_population, ...).
+"""
+import sqlite3
+
+VIEW = "pharmacy_details"
+
+# zip_demographics columns; pharmacy_details exposes each as zip_<column>
+COLUMNS = [
+    ("population", "INTEGER"),
+    ("median_income", "INTEGER"),
+    ("pct_65_plus", "REAL"),
+    ("pop_growth_pct", "REAL"),
+    ("median_age", "REAL"),
+    ("pct_uninsured", "REAL"),
+    ("pct_disabled", "REAL"),
+    ("pct_poverty", "REAL"),
+    ("pct_health_insurance", "REAL"),
+    ("total_households", "INTEGER"),
+    ("pct_owner_occupied", "REAL"),
+]
+
+
+def ensure_zip_demographics(conn):
+    """
+    Create zip_demographics and the pharmacy_details view. Databases from
+    before the table existed kept these values on every pharmacy row; they
+    are copied over once per ZIP and the zip_* columns dropped from
+    pharmacies. Call once at startup, after the pharmacies table exists;
+    enrichment and scoring passes assume the table and view are there.
+    """
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS zip_demographics (
+            zip TEXT PRIMARY KEY,
+            {', '.join(f'{name} {dtype}' for name, dtype in COLUMNS)},
+            updated_at TEXT
+        )
+    """)
+
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(pharmacies)").fetchall()}
+    legacy = [name for name, _ in COLUMNS if f"zip_{name}" in existing]
+    if legacy:
+        conn.execute(f"DROP VIEW IF EXISTS {VIEW}")  # DROP COLUMN fails while a view names it
+        moved = conn.execute(f"""
+            INSERT OR IGNORE INTO zip_demographics (zip, {', '.join(legacy)})
+            SELECT substr(zip, 1, 5), {', '.join(f'MAX(zip_{name})' for name in legacy)}
+            FROM pharmacies
+            WHERE length(zip) >= 5
+            GROUP BY substr(zip, 1, 5)
+            HAVING COALESCE({', '.join(f'MAX(zip_{name})' for name in legacy)}, NULL) IS NOT NULL
+        """).rowcount
+        print(f"  Moved Census data for {moved:,} ZIPs to zip_demographics")
+        try:
+            for name in legacy:
+                conn.execute(f"ALTER TABLE pharmacies DROP COLUMN zip_{name}")
+        except sqlite3.OperationalError as e:
+            # DROP COLUMN needs SQLite 3.35+
+            print(f"  Could not drop per-pharmacy Census columns: {e}")
+
+    # A view stores the column list p.* had when it was created, so it is
+    # rebuilt on every call to pick up columns added since. Where legacy
+    # zip_* columns couldn't be dropped, it lists the other pharmacies
+    # columns so its names don't collide with them.
+    existing = [row[1] for row in conn.execute("PRAGMA table_info(pharmacies)").fetchall()]
+    stale = {f"zip_{name}" for name, _ in COLUMNS} & set(existing)
+    pharmacy_columns = "p.*"
+    if stale:
+        pharmacy_columns = ", ".join(f"p.{column}" for column in existing if column not in stale)
+    conn.execute(f"DROP VIEW IF EXISTS {VIEW}")
+    conn.execute(f"""
+        CREATE VIEW {VIEW} AS
+        SELECT {', '.join(f'd.{name} AS zip_{name}' for name, _ in COLUMNS)}, {pharmacy_columns}
+        FROM pharmacies p
+        LEFT JOIN zip_demographics d ON d.zip = substr(p.zip, 1, 5)
+    """)
+    conn.commit()